@@ -1,19 +1,112 @@
-from fastapi import FastAPI, Query, HTTPException, File, UploadFile
-from fastapi.responses import JSONResponse
-from invoice_agent.miscFiles.invoice_agent import process_user_input
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, Header, Query, HTTPException, File, UploadFile
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from core.clients import ClientRegistry, get_registry, set_registry
+from core.context_cache import get_prompt_cache
+from core.resilience import CallRejectedError, CircuitOpenError, DeadlineExceeded, resilience_stats
+from core.model_backend import requires_api_key
+from core.metrics import CONTENT_TYPE, INVOICE_STREAM_FIRST_CONTENT, REGISTRY, MetricsMiddleware
+from core.tracing import TracingMiddleware
+from core.profiling import ProfilingExecutor, get_profiler, profiled
+from core.memory import get_memory_monitor
+from invoice_agent.miscFiles.invoice_agent import clarification_stats, patch_stats, process_user_input
+from invoice_agent.miscFiles.fast_parser import fast_path_stats
+from invoice_agent.miscFiles.response_cache import get_response_cache
+from invoice_agent.miscFiles.sessions import get_session_store, new_session_id
 from financial_analyser.miscFiles.financial_agent import FinancialDocumentAgent
+from financial_analyser.miscFiles.config import settings
+from financial_analyser.miscFiles.cache import get_extraction_cache
+from financial_analyser.miscFiles.near_duplicates import get_near_duplicate_index
+from financial_analyser.miscFiles.preprocess import preprocess_stats
+from financial_analyser.miscFiles.utils import summarize_results, SummaryAccumulator
+from financial_analyser.miscFiles.job_queue import get_job_queue
 from dotenv import load_dotenv
+import asyncio
+import json
 import os
+import tempfile
+import time
 from pathlib import Path
-import shutil
+from typing import List, Optional, Tuple, Union
 
 load_dotenv()
 
+# Oversized uploads are spooled here under unique names
+SPOOL_DIR = Path("temp_uploads")
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif'}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the shared Gemini client registry for the lifetime of the app"""
+    registry = ClientRegistry()
+    set_registry(registry)
+    # Starts tracemalloc when MEMORY_PROFILE is set
+    get_memory_monitor()
+    if get_profiler().enabled:
+        # Lets sampled requests profile the work they hand to asyncio.to_thread
+        asyncio.get_running_loop().set_default_executor(ProfilingExecutor())
+    app.state.registry = registry
+    yield
+    await registry.aclose()
+    set_registry(None)
+
+
 app = FastAPI(
     title="Vyapaar Agent API",
     description="API for Invoice Generation and Financial Document Processing",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
+app.add_middleware(MetricsMiddleware)
+# Added last so it wraps everything; responses carry X-Trace-Id when tracing is on
+app.add_middleware(TracingMiddleware)
+
+
+def collect_ocr_metrics():
+    """Scrape-time export of the OCR cache, near-duplicate and job queue counters"""
+    cache = get_extraction_cache()
+    if cache is not None:
+        stats = cache.stats()
+        yield (
+            "vyapaar_ocr_cache_events_total", "counter", "Extraction cache lookups and maintenance events",
+            [({"event": event}, stats[event]) for event in (
+                "memory_hits", "disk_hits", "misses", "stores", "expired", "memory_evictions", "disk_evictions"
+            )],
+        )
+        yield (
+            "vyapaar_ocr_cache_entries", "gauge", "Entries held per cache tier",
+            [({"tier": "memory"}, stats["memory_entries"]), ({"tier": "disk"}, stats["disk_entries"])],
+        )
+
+    near_duplicates = get_near_duplicate_index()
+    if near_duplicates is not None:
+        stats = near_duplicates.stats()
+        yield (
+            "vyapaar_ocr_near_duplicate_hashes", "gauge", "Perceptual hashes in the near-duplicate index",
+            [({}, stats["stored"])],
+        )
+
+    stats = preprocess_stats.stats()
+    yield (
+        "vyapaar_ocr_preprocess_bytes_total", "counter", "Image bytes before and after pre-processing",
+        [({"direction": "in"}, stats["bytes_in"]), ({"direction": "out"}, stats["bytes_out"])],
+    )
+
+    yield (
+        "vyapaar_ocr_jobs", "gauge", "Jobs in the durable OCR queue by status",
+        [({"status": status}, count) for status, count in get_job_queue().counts().items()],
+    )
+
+
+REGISTRY.register_collector(collect_ocr_metrics)
+
+
+def get_financial_agent() -> FinancialDocumentAgent:
+    """Shared FinancialDocumentAgent from the app-lifetime registry"""
+    return get_registry().get_agent("financial", FinancialDocumentAgent)
 
 
 @app.get("/")
@@ -26,77 +119,80 @@ def read_root():
             "invoice_generation": {
                 "path": "/invoice",
                 "method": "GET",
-                "description": "Generate invoice from natural language command",
+                "description": "Generate invoice from natural language command; answer clarification questions by sending the answer as command with the returned session_id",
                 "example": "/invoice?command=make gst bill for CJ"
             },
+            "invoice_stream": {
+                "path": "/invoice/stream",
+                "method": "GET",
+                "description": "Same as /invoice, streaming the draft document as Server-Sent Events (header, item, totals, then done)",
+                "example": "/invoice/stream?command=make gst bill for CJ 50 bag cement @380"
+            },
             "financial_ocr": {
                 "path": "/financial-ocr",
                 "method": "POST",
                 "description": "Extract data from financial document images",
                 "content_type": "multipart/form-data"
             },
+            "financial_ocr_batch": {
+                "path": "/financial-ocr/batch",
+                "method": "POST",
+                "description": "Extract data from many document images in one request",
+                "content_type": "multipart/form-data"
+            },
+            "jobs": {
+                "path": "/jobs",
+                "method": "POST",
+                "description": "Queue an image for OCR; poll GET /jobs/{job_id} for the result",
+                "content_type": "multipart/form-data"
+            },
+            "metrics": {
+                "path": "/metrics",
+                "method": "GET",
+                "description": "Prometheus metrics: per-stage latency histograms and counters"
+            },
+            "stats": {
+                "path": "/stats",
+                "method": "GET",
+                "description": "Client reuse, model call resilience, prompt context caching, invoice fast path, cache and sessions, and OCR cache statistics"
+            },
             "documentation": "/docs"
         }
     }
 
 
 @app.get("/invoice")
-def create_invoice(command: str = Query(..., description="Natural language command to generate invoice (e.g., 'make gst bill for CJ')")):
+@profiled("invoice")
+def create_invoice(
+    command: str = Query(..., description="Natural language command to generate invoice (e.g., 'make gst bill for CJ')"),
+    session_id: Optional[str] = Query(None, max_length=64, description="Session from a needs_clarification response; the command is then the answer (e.g., '50 bag @380')")
+):
     """
     Generate an invoice from natural language command
     
     Args:
-        command: Natural language command like "make gst bill for CJ"
+        command: Natural language command like "make gst bill for CJ", or
+            the answer to the clarification questions of session_id
+        session_id: Session returned with a needs_clarification response
     
     Returns:
         JSON response with generated document or clarification questions
     """
     # Check for API key
-    if not os.getenv('GEMINI_API_KEY'):
+    if requires_api_key() and not os.getenv('GEMINI_API_KEY'):
         raise HTTPException(
             status_code=500, 
             detail="GEMINI_API_KEY not configured in environment"
         )
     
     try:
-        # Process the command
-        result = process_user_input(command)
-        
-        if "error" in result:
-            return JSONResponse(
-                status_code=400,
-                content={
-                    "status": "error",
-                    "error": result.get("error"),
-                    "command": command
-                }
-            )
-        
-        # Check if document is complete or needs clarification
-        if result.get("status") == "complete":
-            return {
-                "status": "success",
-                "message": "Invoice generated successfully",
-                "document": result["document"],
-                "json_path": result["json_path"],
-                "command": command
-            }
-        
-        elif result.get("status") == "needs_clarification":
-            return {
-                "status": "needs_clarification",
-                "message": "Additional information required",
-                "missing_fields": result["missing_fields"],
-                "clarification_questions": result["clarification_questions"],
-                "partial_document": result["partial_document"],
-                "command": command
-            }
-        
-        else:
-            raise HTTPException(
-                status_code=500,
-                detail="Unexpected response from invoice processor"
-            )
+        # Process the command (a new session is started when none is given)
+        session_id = session_id or new_session_id()
+        result = process_user_input(command, session_id=session_id)
+        status_code, content = invoice_response(result, command, session_id)
+        if status_code != 200:
+            return JSONResponse(status_code=status_code, content=content)
+        return content
     
     except Exception as e:
         raise HTTPException(
@@ -105,7 +201,193 @@ def create_invoice(command: str = Query(..., description="Natural language comma
         )
 
 
-@app.post("/financial-ocr")
+def invoice_response(result: dict, command: str, session_id: str) -> Tuple[int, dict]:
+    """
+    Shape a process_user_input result into the /invoice response body
+    
+    Returns:
+        (HTTP status code, body)
+    """
+    if "error" in result:
+        return 400, {
+            "status": "error",
+            "error": result.get("error"),
+            "command": command
+        }
+    
+    # Check if document is complete or needs clarification
+    if result.get("status") == "complete":
+        return 200, {
+            "status": "success",
+            "message": "Invoice generated successfully",
+            "document": result["document"],
+            "json_path": result["json_path"],
+            "command": command,
+            "session_id": session_id,
+            "patch": result.get("patch")
+        }
+    
+    elif result.get("status") == "needs_clarification":
+        return 200, {
+            "status": "needs_clarification",
+            "message": "Additional information required",
+            "missing_fields": result["missing_fields"],
+            "clarification_questions": result["clarification_questions"],
+            "partial_document": result["partial_document"],
+            "command": command,
+            "session_id": session_id,
+            "patch": result.get("patch")
+        }
+    
+    else:
+        raise HTTPException(
+            status_code=500,
+            detail="Unexpected response from invoice processor"
+        )
+
+
+def sse_event(event: str, data: dict) -> str:
+    """One Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.get("/invoice/stream")
+async def stream_invoice(
+    command: str = Query(..., description="Natural language command to generate invoice (e.g., 'make gst bill for CJ')"),
+    session_id: Optional[str] = Query(None, max_length=64, description="Session from a needs_clarification response; the command is then the answer (e.g., '50 bag @380')")
+):
+    """
+    Generate an invoice, streaming the draft as Server-Sent Events
+    
+    Events, in order:
+        session: {"session_id", "command"}, sent immediately
+        header: {field: value} for each top-level field as it is decoded
+        item: {"index", "item"} for each line item
+        totals: {field: value} for amounts (subtotal, taxes, total, ...)
+        done: the /invoice response body, after validation ("status" is
+            success, needs_clarification or error)
+    
+    Documents from the fast path, the response cache or a session patch
+    arrive all at once and are sent as the same events.
+    """
+    # Check for API key
+    if requires_api_key() and not os.getenv('GEMINI_API_KEY'):
+        raise HTTPException(
+            status_code=500,
+            detail="GEMINI_API_KEY not configured in environment"
+        )
+    
+    session_id = session_id or new_session_id()
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    started = time.perf_counter()
+    
+    def on_event(event: str, data: Optional[dict]):
+        loop.call_soon_threadsafe(queue.put_nowait, (event, data))
+    
+    def run():
+        # Runs in a worker thread; a client that leaves early does not stop
+        # it, so the document is still saved and the session kept
+        try:
+            result = process_user_input(command, session_id=session_id, on_event=on_event)
+            _, content = invoice_response(result, command, session_id)
+            on_event("done", content)
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else f"Error processing command: {str(e)}"
+            on_event("done", {"status": "error", "error": detail, "command": command})
+    
+    async def events():
+        yield sse_event("session", {"session_id": session_id, "command": command})
+        worker = asyncio.ensure_future(asyncio.to_thread(run))
+        first_content = True
+        while True:
+            event, data = await queue.get()
+            if first_content and event != "done":
+                INVOICE_STREAM_FIRST_CONTENT.observe(time.perf_counter() - started)
+                first_content = False
+            yield sse_event(event, data)
+            if event == "done":
+                break
+        await worker
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def read_upload(file: UploadFile, suffix: str = "") -> Union[bytes, Path]:
+    """
+    Read an upload into memory, spilling to a spool file only when oversized
+
+    Args:
+        file: Uploaded file
+        suffix: Extension for the spool file
+
+    Returns:
+        The image bytes, or the path of a uniquely named spool file
+    """
+    limit = settings.OCR_INMEMORY_UPLOAD_LIMIT_MB * 1024 * 1024
+    data = await file.read(limit + 1)
+    if len(data) <= limit:
+        return data
+
+    SPOOL_DIR.mkdir(exist_ok=True)
+    fd, spool_name = tempfile.mkstemp(prefix="ocr_", suffix=suffix, dir=SPOOL_DIR)
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            while data:
+                await asyncio.to_thread(buffer.write, data)
+                data = await file.read(UPLOAD_CHUNK_SIZE)
+    except BaseException:
+        # Client disconnected or the disk filled up mid-upload
+        Path(spool_name).unlink(missing_ok=True)
+        raise
+    return Path(spool_name)
+
+
+async def process_upload(file: UploadFile, file_ext: str) -> dict:
+    """
+    Run one uploaded image through the shared agent
+    
+    Args:
+        file: Uploaded image
+        file_ext: Validated file extension
+    
+    Returns:
+        The agent's result dictionary
+    """
+    spool_path = None
+    try:
+        # Keep the upload in memory; only oversized files touch the disk
+        image_input = await read_upload(file, file_ext)
+        if isinstance(image_input, Path):
+            spool_path = image_input
+        
+        agent = get_financial_agent()
+        return await agent.aprocess_image(image_input, filename=file.filename)
+    
+    finally:
+        # Clean up spool file
+        if spool_path is not None:
+            spool_path.unlink(missing_ok=True)
+
+
+def require_memory_headroom():
+    """Shed new OCR work with 503 while RSS is over MEMORY_SOFT_LIMIT_MB"""
+    memory = get_memory_monitor()
+    if memory.over_budget():
+        memory.count("rejected")
+        raise HTTPException(
+            status_code=503,
+            detail="Server is over its memory budget, retry shortly",
+            headers={"Retry-After": "5"}
+        )
+
+
+@app.post("/financial-ocr", dependencies=[Depends(require_memory_headroom)])
+@profiled("financial_ocr")
 async def extract_financial_document(file: UploadFile = File(..., description="Image file (receipt, invoice, or UPI screenshot)")):
     """
     Extract data from financial document image using OCR
@@ -117,38 +399,24 @@ async def extract_financial_document(file: UploadFile = File(..., description="I
         JSON response with extracted financial data
     """
     # Check for API key
-    if not os.getenv('GEMINI_API_KEY'):
+    if requires_api_key() and not os.getenv('GEMINI_API_KEY'):
         raise HTTPException(
             status_code=500,
             detail="GEMINI_API_KEY not configured in environment"
         )
     
     # Validate file type
-    allowed_extensions = {'.jpg', '.jpeg', '.png', '.webp', '.gif'}
     file_ext = Path(file.filename).suffix.lower()
     
-    if file_ext not in allowed_extensions:
+    if file_ext not in ALLOWED_EXTENSIONS:
         raise HTTPException(
             status_code=400,
-            detail=f"Invalid file type. Allowed: {', '.join(allowed_extensions)}"
+            detail=f"Invalid file type. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
         )
     
     try:
-        # Create temporary directory for uploads
-        temp_dir = Path("temp_uploads")
-        temp_dir.mkdir(exist_ok=True)
-        
-        # Save uploaded file temporarily
-        temp_file_path = temp_dir / file.filename
-        with temp_file_path.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
         # Process the image
-        agent = FinancialDocumentAgent()
-        result = agent.process_image(temp_file_path)
-        
-        # Clean up temp file
-        temp_file_path.unlink()
+        result = await process_upload(file, file_ext)
         
         # Check result status
         if result.get("status") == "error":
@@ -169,20 +437,242 @@ async def extract_financial_document(file: UploadFile = File(..., description="I
             "document_type": result["data"].get("document_type"),
             "confidence_score": result.get("confidence_score"),
             "timestamp": result.get("timestamp"),
+            "cache": result.get("cache"),
+            "near_duplicate": result.get("near_duplicate"),
+            "preprocessing": result.get("preprocessing"),
             "data": result["data"]
         }
     
+    except (CircuitOpenError, CallRejectedError) as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
-        # Clean up temp file on error
-        if temp_file_path.exists():
-            temp_file_path.unlink()
-        
         raise HTTPException(
             status_code=500,
             detail=f"Error processing image: {str(e)}"
         )
 
 
+@app.post("/financial-ocr/batch", dependencies=[Depends(require_memory_headroom)])
+@profiled("financial_ocr_batch")
+async def extract_financial_documents_batch(
+    files: List[UploadFile] = File(..., description="Image files (receipts, invoices, or UPI screenshots)"),
+    stream: bool = Query(False, description="Stream per-file results as NDJSON as they complete")
+):
+    """
+    Extract data from many financial document images in one request
+    
+    Files are processed concurrently (up to OCR_BATCH_CONCURRENCY at a time).
+    A file that fails is reported in its own entry and does not fail the batch.
+    
+    Args:
+        files: Image files (JPEG, PNG, etc.)
+        stream: When true, respond with application/x-ndjson: one
+            {"type": "result"} line per file in completion order, then a
+            final {"type": "summary"} line
+    
+    Returns:
+        JSON response with per-file results and batch summary aggregates
+    """
+    # Check for API key
+    if requires_api_key() and not os.getenv('GEMINI_API_KEY'):
+        raise HTTPException(
+            status_code=500,
+            detail="GEMINI_API_KEY not configured in environment"
+        )
+    
+    if len(files) > settings.OCR_BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many files. Maximum per batch: {settings.OCR_BATCH_MAX_FILES}"
+        )
+    
+    slots = asyncio.Semaphore(settings.OCR_BATCH_CONCURRENCY)
+    
+    async def run_one(file: UploadFile) -> dict:
+        file_ext = Path(file.filename).suffix.lower()
+        if file_ext not in ALLOWED_EXTENSIONS:
+            return {
+                "status": "error",
+                "filename": file.filename,
+                "error": f"Invalid file type. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
+            }
+        
+        async with slots:
+            try:
+                result = await process_upload(file, file_ext)
+            except Exception as e:
+                return {
+                    "status": "error",
+                    "filename": file.filename,
+                    "error": f"Error processing image: {str(e)}"
+                }
+        
+        if result.get("status") == "error":
+            return {
+                "status": "error",
+                "filename": file.filename,
+                "error": result.get("error")
+            }
+        
+        return {
+            "status": "success",
+            "filename": file.filename,
+            "document_type": result["data"].get("document_type"),
+            "confidence_score": result.get("confidence_score"),
+            "timestamp": result.get("timestamp"),
+            "cache": result.get("cache"),
+            "near_duplicate": result.get("near_duplicate"),
+            "data": result["data"]
+        }
+    
+    if stream:
+        async def run_indexed(index: int, file: UploadFile):
+            return index, await run_one(file)
+        
+        async def result_lines():
+            summary = SummaryAccumulator()
+            tasks = [asyncio.create_task(run_indexed(i, file)) for i, file in enumerate(files)]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    index, result = await next_done
+                    summary.add(result)
+                    yield json.dumps({"type": "result", "index": index, **result}, ensure_ascii=False) + "\n"
+                yield json.dumps({"type": "summary", **summary.summary()}, ensure_ascii=False) + "\n"
+            finally:
+                # Client went away: stop the remaining work
+                for task in tasks:
+                    task.cancel()
+        
+        return StreamingResponse(result_lines(), media_type="application/x-ndjson")
+    
+    results = await asyncio.gather(*(run_one(file) for file in files))
+    summary = summarize_results(results)
+    
+    return {
+        "status": "success" if summary["failed"] == 0 else "partial",
+        "message": f"Processed {summary['successful']} of {summary['total']} documents",
+        "summary": summary,
+        "results": results
+    }
+
+
+@app.post("/jobs", status_code=202)
+@profiled("jobs")
+async def submit_ocr_job(file: UploadFile = File(..., description="Image file (receipt, invoice, or UPI screenshot)")):
+    """
+    Queue an image for asynchronous OCR by the worker processes
+    
+    Args:
+        file: Image file (JPEG, PNG, etc.)
+    
+    Returns:
+        Job id and the URL to poll for its status
+    """
+    file_ext = Path(file.filename).suffix.lower()
+    
+    if file_ext not in ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid file type. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
+        )
+    
+    image_input = await read_upload(file, file_ext)
+    try:
+        job_id = await asyncio.to_thread(get_job_queue().enqueue, image_input, file.filename)
+    finally:
+        # enqueue moves the spool file into JOBS_DIR; anything left is ours to remove
+        if isinstance(image_input, Path):
+            image_input.unlink(missing_ok=True)
+    
+    return {
+        "status": "queued",
+        "job_id": job_id,
+        "filename": file.filename,
+        "status_url": f"/jobs/{job_id}"
+    }
+
+
+@app.get("/jobs/{job_id}")
+def get_ocr_job(job_id: str):
+    """
+    Status of a queued OCR job, with the extraction result once it succeeded
+    """
+    job = get_job_queue().get(job_id)
+    
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    
+    return job
+
+
+@app.get("/stats")
+def read_stats():
+    """Runtime statistics for shared resources"""
+    cache = get_extraction_cache()
+    near_duplicates = get_near_duplicate_index()
+    return {
+        "clients": get_registry().stats(),
+        "model_calls": resilience_stats(),
+        "context_cache": get_prompt_cache().stats(),
+        "invoice_fast_path": fast_path_stats.stats(),
+        "invoice_cache": get_response_cache().stats(),
+        "invoice_clarification": clarification_stats.stats(),
+        "invoice_sessions": {**get_session_store().stats(), "patches": patch_stats.stats()},
+        "ocr_cache": cache.stats() if cache else {"enabled": False},
+        "ocr_near_duplicates": near_duplicates.stats() if near_duplicates else {"enabled": False},
+        "ocr_preprocessing": preprocess_stats.stats(),
+        "ocr_jobs": get_job_queue().counts()
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    """Prometheus text exposition of latency histograms and counters"""
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Admin endpoints exist only when PROFILE_ADMIN_TOKEN is set"""
+    profiler = get_profiler()
+    if not profiler.admin_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not profiler.check_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+def read_profile_status():
+    """Profiler sample rate and sampled request counts per endpoint"""
+    return get_profiler().status()
+
+
+@app.put("/admin/profile/sampling", dependencies=[Depends(require_admin)])
+def set_profile_sampling(rate: float = Query(..., ge=0, le=1, description="Fraction of requests to profile")):
+    """Change the fraction of requests profiled under cProfile"""
+    get_profiler().set_sample_rate(rate)
+    return get_profiler().status()
+
+
+@app.post("/admin/profile/window", dependencies=[Depends(require_admin)])
+async def run_profile_window(seconds: float = Query(10, gt=0, le=300, description="Length of the window")):
+    """Sample every thread's stack for a timed window and write folded stacks"""
+    try:
+        return await asyncio.to_thread(get_profiler().sample_window, seconds)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.get("/admin/memory", dependencies=[Depends(require_admin)])
+async def read_memory_report(checkpoint: bool = Query(False, description="Take a tracemalloc snapshot first")):
+    """Per-stage memory growth, top allocation sites and soft budget state"""
+    memory = get_memory_monitor()
+    if checkpoint:
+        await asyncio.to_thread(memory.checkpoint, "admin")
+    return memory.report()
+
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
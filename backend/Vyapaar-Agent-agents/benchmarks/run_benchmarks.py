@@ -0,0 +1,536 @@
+"""
+End-to-end benchmarks for the agents backend
+
+Runs every stage against the offline fake model backend (MODEL_BACKEND=fake)
+inside a throwaway working directory, and reports p50/p95/p99 latency plus
+allocations (tracemalloc) per stage. Results are written as JSON so runs
+can be compared across releases.
+
+Usage:
+    python benchmarks/run_benchmarks.py                      # full run
+    python benchmarks/run_benchmarks.py --quick              # CI-sized run
+    python benchmarks/run_benchmarks.py --only pdf,db        # subset of groups
+    python benchmarks/run_benchmarks.py --compare old.json   # diff against a baseline
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from tabulate import tabulate
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+GROUPS = ["asgi", "invoice", "prompt", "pdf", "json", "db"]
+
+COMMANDS = [
+    "Rahul ko 10 bag cement 400 rupay per bag pakka bill",
+    "Amit se 5000 cash mila udhaar ka",
+    "Priya ke liye estimate 20 litre paint 300 per litre",
+    "Suresh ko kachha bill 50 piece brick 12 rupay",
+    "Mohan ko 25 kg steel rod 65 per kg ka GST bill",
+]
+
+
+def percentile(ordered: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    index = max(int(round(pct / 100 * len(ordered))) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+class BenchmarkRunner:
+    """
+    Times callables and collects per-stage results
+    """
+
+    def __init__(self, iterations: int, warmup: int, alloc_iterations: int):
+        self.iterations = iterations
+        self.warmup = warmup
+        self.alloc_iterations = alloc_iterations
+        self.results: List[Dict[str, Any]] = []
+
+    def measure(
+        self,
+        name: str,
+        fn: Callable[[int], Any],
+        iterations: Optional[int] = None,
+        **params
+    ) -> Dict[str, Any]:
+        """
+        Time fn(i) over warm-up, timed and allocation runs, re-running a few
+        calls under tracemalloc so allocation tracking does not skew timings
+
+        Args:
+            name: Stage name used in the report
+            fn: Callable taking the iteration index
+            iterations: Override the default iteration count
+            **params: Extra fields recorded with the result (e.g. items=100)
+        """
+        iterations = iterations or self.iterations
+        # Every call gets a distinct index so fixtures (UTRs, images) never repeat
+        calls = iter(range(self.warmup + iterations + self.alloc_iterations))
+        for _ in range(self.warmup):
+            fn(next(calls))
+
+        timings = []
+        for _ in range(iterations):
+            i = next(calls)
+            started = time.perf_counter()
+            fn(i)
+            timings.append((time.perf_counter() - started) * 1000)
+
+        peaks, retained = [], []
+        for _ in range(min(self.alloc_iterations, iterations)):
+            i = next(calls)
+            tracemalloc.start()
+            before, _ = tracemalloc.get_traced_memory()
+            fn(i)
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            peaks.append(peak - before)
+            retained.append(current - before)
+
+        ordered = sorted(timings)
+        result = {
+            "name": name,
+            "params": params,
+            "iterations": iterations,
+            "p50_ms": round(percentile(ordered, 50), 3),
+            "p95_ms": round(percentile(ordered, 95), 3),
+            "p99_ms": round(percentile(ordered, 99), 3),
+            "mean_ms": round(statistics.fmean(ordered), 3),
+            "min_ms": round(ordered[0], 3),
+            "max_ms": round(ordered[-1], 3),
+            "alloc_peak_kb": round(max(peaks) / 1024, 1) if peaks else None,
+            "alloc_retained_kb": round(statistics.fmean(retained) / 1024, 1) if retained else None,
+        }
+        self.results.append(result)
+        label = f"{name} {params}" if params else name
+        print(f"  ⏱️  {label}: p50={result['p50_ms']}ms p95={result['p95_ms']}ms p99={result['p99_ms']}ms")
+        return result
+
+
+# ---------- fixtures ----------
+
+def make_image_bytes(seed: int, size=(1200, 1600)) -> bytes:
+    """A receipt-sized PNG that differs per seed, so no cache tier can answer it"""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    for line in range(40):
+        y = 40 + line * 38
+        draw.rectangle([60, y, 60 + rng.randint(200, 1000), y + 18], fill=(rng.randint(0, 90),) * 3)
+    draw.text((60, 10), f"RECEIPT #{seed}", fill="black")
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def make_document(doc_type: str, n_items: int) -> Dict[str, Any]:
+    """Synthetic document of doc_type with n_items line items"""
+    items = [
+        {
+            "description": f"Item {i} cement bag",
+            "hsn_code": "2523",
+            "quantity": i % 20 + 1,
+            "unit": "bag",
+            "rate": 350.0,
+            "amount": (i % 20 + 1) * 350.0,
+        }
+        for i in range(n_items)
+    ]
+    subtotal = sum(item["amount"] for item in items)
+    base = {"document_type": doc_type, "customer_name": "Rahul Verma", "items": items}
+    if doc_type == "gst_invoice":
+        base.update(
+            invoice_number="INV-BENCH", invoice_date="2026-01-01", customer_gstin="27AAPFU0939F1ZV",
+            subtotal=subtotal, cgst_rate=9, cgst_amount=subtotal * 0.09, sgst_rate=9,
+            sgst_amount=subtotal * 0.09, total=subtotal * 1.18,
+        )
+    elif doc_type == "bill_of_supply":
+        base.update(bill_number="BOS-BENCH", bill_date="2026-01-01", total=subtotal)
+    elif doc_type == "quotation":
+        base.update(
+            quotation_number="QT-BENCH", quotation_date="2026-01-01", valid_until="2026-01-15",
+            subtotal=subtotal, total_estimate=subtotal,
+        )
+    else:
+        base = {
+            "document_type": "payment_receipt", "receipt_number": "RCP-BENCH",
+            "receipt_date": "2026-01-01", "received_from": "Rahul Verma", "amount_received": 5000,
+            "payment_mode": "Cash", "payment_for": "Udhaar payment", "previous_balance": 8000,
+            "current_balance": 3000,
+        }
+    return base
+
+
+# ---------- groups ----------
+
+def bench_asgi(runner: BenchmarkRunner, quick: bool):
+    from fastapi.testclient import TestClient
+    import app as app_module
+
+    images = [make_image_bytes(seed) for seed in range(runner.warmup + runner.iterations + runner.alloc_iterations)]
+    with TestClient(app_module.app) as client:
+        def invoice(i):
+            response = client.get("/invoice", params={"command": COMMANDS[i % len(COMMANDS)]})
+            assert response.status_code == 200, response.text
+
+        def financial_ocr(i):
+            response = client.post(
+                "/financial-ocr", files={"file": (f"bench_{i}.png", images[i % len(images)], "image/png")}
+            )
+            assert response.status_code == 200, response.text
+
+        runner.measure("asgi /invoice", invoice)
+        runner.measure("asgi /financial-ocr", financial_ocr)
+
+
+def bench_invoice(runner: BenchmarkRunner, quick: bool):
+    from invoice_agent.miscFiles import invoice_agent
+    from invoice_agent.miscFiles.invoice_agent import process_user_input, validate_document
+    from invoice_agent.miscFiles.fast_parser import parse_command
+    from invoice_agent.miscFiles.normaliser import normalize_document
+
+    runner.measure("parse_command", lambda i: parse_command(COMMANDS[i % len(COMMANDS)]))
+    runner.measure("process_user_input", lambda i: process_user_input(COMMANDS[i % len(COMMANDS)]))
+    # Same commands with every one going to the model, for comparison
+    invoice_agent.FAST_PATH_ENABLED = False
+    invoice_agent.RESPONSE_CACHE_ENABLED = False
+    try:
+        runner.measure(
+            "process_user_input", lambda i: process_user_input(COMMANDS[i % len(COMMANDS)]),
+            fast_path=False, cache=False,
+        )
+        # Model answers served from a warm response cache
+        invoice_agent.RESPONSE_CACHE_ENABLED = True
+        for command in COMMANDS:
+            process_user_input(command)
+        runner.measure(
+            "process_user_input", lambda i: process_user_input(COMMANDS[i % len(COMMANDS)]),
+            fast_path=False, cache="warm",
+        )
+    finally:
+        invoice_agent.FAST_PATH_ENABLED = True
+        invoice_agent.RESPONSE_CACHE_ENABLED = True
+
+    # Time to the first part of the document a client can render: the end of
+    # the call when blocking, the first decoded field when streaming
+    for stream in (False, True):
+        first_content: List[float] = []
+
+        def generate(i, stream=stream, first_content=first_content):
+            started = time.perf_counter()
+            seen = []
+
+            def on_event(event, data):
+                if not seen:
+                    seen.append(time.perf_counter() - started)
+
+            invoice_agent.generate_document_json(COMMANDS[i % len(COMMANDS)], on_event if stream else None)
+            first_content.append((seen[0] if seen else time.perf_counter() - started) * 1000)
+
+        result = runner.measure("generate_document_json", generate, stream=stream)
+        ordered = sorted(first_content)
+        result["first_content_p50_ms"] = round(percentile(ordered, 50), 3)
+        result["first_content_p95_ms"] = round(percentile(ordered, 95), 3)
+        print(f"      ✏️  first content: p50={result['first_content_p50_ms']}ms p95={result['first_content_p95_ms']}ms")
+
+    for n_items in (1, 10, 100):
+        doc = make_document("gst_invoice", n_items)
+        runner.measure("validate_document", lambda i: validate_document(doc), items=n_items)
+        runner.measure("normalize_document", lambda i: normalize_document(doc), items=n_items)
+
+
+def bench_prompt(runner: BenchmarkRunner, quick: bool):
+    from core.context_cache import get_prompt_cache
+    from core.metrics import MODEL_TOKENS
+    from financial_analyser.miscFiles.financial_agent import FinancialDocumentAgent
+    from invoice_agent.miscFiles.invoice_agent import generate_document_json
+    from invoice_agent.prompts import transaction_prompt
+
+    runner.measure("get_transaction_system_prompt", lambda i: transaction_prompt.get_transaction_system_prompt())
+    # What every call used to do: format today's date and rebuild the string
+    runner.measure(
+        "get_transaction_system_prompt",
+        lambda i: transaction_prompt._compile_transaction_prompt.__wrapped__(
+            datetime.now().strftime("%Y-%m-%d"), transaction_prompt.TRANSACTION_PROMPT_VERSION
+        ),
+        compiled=False,
+    )
+
+    # Prompt sent inline vs served from the provider's context cache. The fake
+    # backend has no caching minimum, so the real providers' one is lifted here
+    agent = FinancialDocumentAgent()
+    images = [make_image_bytes(seed) for seed in range(runner.warmup + runner.iterations + runner.alloc_iterations)]
+    calls = {
+        "invoice_generate": lambda i: generate_document_json(COMMANDS[i % len(COMMANDS)]),
+        "financial_ocr": lambda i: agent.process_image(images[i % len(images)], f"bench_{i}.png"),
+    }
+    cache = get_prompt_cache()
+    saved = cache.enabled, cache.min_tokens
+    try:
+        for endpoint, call in calls.items():
+            for enabled in (False, True):
+                cache.enabled, cache.min_tokens = enabled, 0
+                tokens = {kind: MODEL_TOKENS.labels(endpoint, kind) for kind in ("prompt", "cached")}
+                before = {kind: child.value for kind, child in tokens.items()}
+                result = runner.measure(endpoint, call, context_cache=enabled)
+                n_calls = runner.warmup + result["iterations"] + min(runner.alloc_iterations, result["iterations"])
+                for kind, child in tokens.items():
+                    result[f"{kind}_tokens_per_call"] = round((child.value - before[kind]) / n_calls, 1)
+                billed = result["prompt_tokens_per_call"] - result["cached_tokens_per_call"]
+                print(f"      🪙 prompt tokens/call: {result['prompt_tokens_per_call']} "
+                      f"({result['cached_tokens_per_call']} cached, {billed:.1f} at the full rate)")
+    finally:
+        cache.enabled, cache.min_tokens = saved
+
+
+def bench_pdf(runner: BenchmarkRunner, quick: bool):
+    from invoice_agent.miscFiles.pdf_generator import (
+        generate_gst_invoice_pdf,
+        generate_bill_of_supply_pdf,
+        generate_quotation_pdf,
+        generate_payment_receipt_pdf
+    )
+
+    sizes = (1, 10, 100) if quick else (1, 10, 100, 1000)
+    generators = {
+        "gst_invoice": generate_gst_invoice_pdf,
+        "bill_of_supply": generate_bill_of_supply_pdf,
+        "quotation": generate_quotation_pdf,
+    }
+    for doc_type, generate in generators.items():
+        for n_items in sizes:
+            doc = make_document(doc_type, n_items)
+            # Large documents are slow; fewer iterations keep the run bounded
+            iterations = max(runner.iterations // (10 if n_items >= 1000 else 1), 5)
+            runner.measure(f"generate_{doc_type}_pdf", lambda i: generate(doc), iterations, items=n_items)
+
+    receipt = make_document("payment_receipt", 0)
+    runner.measure("generate_payment_receipt_pdf", lambda i: generate_payment_receipt_pdf(receipt))
+
+
+def bench_json(runner: BenchmarkRunner, quick: bool):
+    from financial_analyser.miscFiles.config import settings
+    from financial_analyser.miscFiles.utils import save_json_output
+
+    result = {
+        "status": "success",
+        "data": {"document_type": "invoice", "amount": 1250.5, "items": [f"Item {i}" for i in range(20)]},
+        "confidence_score": 0.92,
+        "timestamp": datetime.now().isoformat(),
+    }
+    runner.measure("save_json_output", lambda i: save_json_output(result, settings.OUTPUT_DIR, f"bench_{i}.png"))
+
+
+def seed_rows(manager, rows: int, chunk: int = 10_000):
+    """Bulk-insert synthetic extraction rows"""
+    from financial_analyser.miscFiles.database import FinancialDocument
+
+    doc_types = ["upi_screenshot", "invoice", "handwritten_note", "unknown"]
+    table = FinancialDocument.__table__
+    now = datetime.utcnow()
+    with manager.engine.begin() as conn:
+        for start in range(0, rows, chunk):
+            conn.execute(table.insert(), [
+                {
+                    "document_type": doc_types[i % len(doc_types)],
+                    "amount": float(i % 5000),
+                    "transaction_date": "01/01/2026",
+                    "utr_number": f"SEED{i:012d}",
+                    "vendor_name": f"Vendor {i % 500}",
+                    "created_at": now,
+                    "updated_at": now,
+                }
+                for i in range(start, min(start + chunk, rows))
+            ])
+
+
+def bench_db(runner: BenchmarkRunner, quick: bool):
+    from financial_analyser.miscFiles.database import DatabaseManager
+
+    row_counts = (10_000,) if quick else (10_000, 100_000, 1_000_000)
+    for rows in row_counts:
+        db_path = Path.cwd() / f"bench_{rows}.db"
+        manager = DatabaseManager(f"sqlite:///{db_path}")
+        print(f"  🌱 Seeding {rows:,} rows...")
+        seed_rows(manager, rows)
+
+        def save(i, rows=rows):
+            manager.save_extraction({
+                "document_type": "upi_screenshot",
+                "amount": 499.0,
+                "date": "01/01/2026",
+                "utr_number": f"BENCH{rows}{i:08d}",
+                "sender_name": "Rahul Verma",
+                "payment_app": "PhonePe",
+            })
+
+        runner.measure("DatabaseManager.save_extraction", save, rows=rows)
+        stats_iterations = max(runner.iterations // 10, 5)
+        runner.measure("DatabaseManager.get_statistics", lambda i: manager.get_statistics(), stats_iterations, rows=rows)
+        manager.engine.dispose()
+
+
+BENCHMARKS = {
+    "asgi": bench_asgi,
+    "invoice": bench_invoice,
+    "prompt": bench_prompt,
+    "pdf": bench_pdf,
+    "json": bench_json,
+    "db": bench_db,
+}
+
+
+# ---------- reporting ----------
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result: Dict[str, Any]) -> str:
+    params = ",".join(f"{k}={v}" for k, v in sorted(result["params"].items()))
+    return f"{result['name']}[{params}]" if params else result["name"]
+
+
+def print_comparison(baseline_path: Path, results: List[Dict[str, Any]]):
+    """Table of p50/p95 changes against an earlier run"""
+    baseline = {result_key(r): r for r in json.loads(baseline_path.read_text())["results"]}
+    rows = []
+    for result in results:
+        old = baseline.get(result_key(result))
+        if old is None:
+            continue
+        row = [result_key(result)]
+        for field in ("p50_ms", "p95_ms"):
+            change = (result[field] - old[field]) / old[field] * 100 if old[field] else 0.0
+            row += [old[field], result[field], f"{change:+.1f}%"]
+        rows.append(row)
+    print(f"\n📊 Compared with {baseline_path}")
+    print(tabulate(rows, headers=["Stage", "p50 old", "p50 new", "Δ", "p95 old", "p95 new", "Δ"], tablefmt="grid"))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the agents backend against the fake model backend")
+    parser.add_argument("--quick", action="store_true", help="Small run for CI (fewer iterations and sizes)")
+    parser.add_argument("--iterations", type=int, help="Timed iterations per stage")
+    parser.add_argument("--warmup", type=int, default=3, help="Untimed warm-up calls per stage")
+    parser.add_argument("--alloc-iterations", type=int, default=3, help="Calls re-run under tracemalloc")
+    parser.add_argument("--only", help=f"Comma-separated groups to run ({', '.join(GROUPS)})")
+    parser.add_argument("--model-latency-ms", type=float, default=0.0,
+                        help="Median latency of the fake model (0 = measure only our own overhead)")
+    parser.add_argument("--prefill-ms-per-1k", type=float, default=0.0,
+                        help="Extra fake model latency per 1,000 uncached prompt tokens")
+    parser.add_argument("--ms-per-output-token", type=float, default=0.0,
+                        help="Fake model decoding time per output token (streamed over chunks)")
+    parser.add_argument("--output", "-o", help="Result JSON path (default benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="Earlier result JSON to diff against")
+    parser.add_argument("--keep-workdir", action="store_true", help="Keep the scratch directory for inspection")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    iterations = args.iterations or (20 if args.quick else 100)
+    groups = args.only.split(",") if args.only else GROUPS
+    unknown = set(groups) - set(GROUPS)
+    if unknown:
+        sys.exit(f"❌ Unknown benchmark group(s): {', '.join(sorted(unknown))}")
+
+    output = Path(args.output) if args.output else (
+        ROOT / "benchmarks" / "results" / f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    output = output.resolve()
+    compare = Path(args.compare).resolve() if args.compare else None
+
+    # Everything the app writes (PDFs, JSON, caches, databases) goes to a scratch dir
+    workdir = Path(tempfile.mkdtemp(prefix="vyapaar-bench-"))
+    os.environ.update({
+        "MODEL_BACKEND": "fake",
+        "MODEL_CASSETTE_MODE": "off",
+        "FAKE_MODEL_LATENCY_MS": str(args.model_latency_ms),
+        "FAKE_MODEL_PREFILL_MS_PER_1K_TOKENS": str(args.prefill_ms_per_1k),
+        "FAKE_MODEL_MS_PER_OUTPUT_TOKEN": str(args.ms_per_output_token),
+        "FAKE_MODEL_ERROR_RATE": "0",
+        "FAKE_MODEL_SEED": "0",
+        "OCR_CACHE_ENABLED": "false",
+        "OCR_NEAR_DUPLICATE_MODE": "off",
+    })
+    for name in ("UPLOAD_DIR", "LOGS_DIR", "OUTPUT_DIR", "CACHE_DIR", "JOBS_DIR"):
+        path = workdir / name.lower()
+        path.mkdir()
+        os.environ[name] = str(path)
+    os.chdir(workdir)
+
+    runner = BenchmarkRunner(iterations, args.warmup, args.alloc_iterations)
+    started = time.perf_counter()
+    try:
+        for group in groups:
+            print(f"\n🚀 {group}")
+            BENCHMARKS[group](runner, args.quick)
+    finally:
+        os.chdir(ROOT)
+        if args.keep_workdir:
+            print(f"\n🗂️  Scratch files kept in: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "quick": args.quick,
+            "iterations": iterations,
+            "warmup": args.warmup,
+            "alloc_iterations": args.alloc_iterations,
+            "model_latency_ms": args.model_latency_ms,
+            "prefill_ms_per_1k": args.prefill_ms_per_1k,
+            "ms_per_output_token": args.ms_per_output_token,
+            "groups": groups,
+        },
+        "duration_seconds": round(time.perf_counter() - started, 2),
+        "results": runner.results,
+    }
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+
+    print("\n" + tabulate(
+        [
+            [result_key(r), r["iterations"], r["p50_ms"], r["p95_ms"], r["p99_ms"], r["alloc_peak_kb"]]
+            for r in runner.results
+        ],
+        headers=["Stage", "N", "p50 ms", "p95 ms", "p99 ms", "Peak KiB"],
+        tablefmt="grid",
+    ))
+    print(f"\n💾 Results saved to: {output}")
+
+    if compare:
+        print_comparison(compare, runner.results)
+
+
+if __name__ == "__main__":
+    main()
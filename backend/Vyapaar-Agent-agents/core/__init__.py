@@ -0,0 +1 @@
+"""Shared infrastructure used by the invoice and financial agents"""
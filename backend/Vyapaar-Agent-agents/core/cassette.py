@@ -0,0 +1,269 @@
+"""
+Record/replay cassette for model calls
+
+CassetteBackend wraps another ModelBackend and stores every request ->
+response pair in a SQLite file, keyed on the model plus hashes of the
+prompt text, the image bytes and the generation config. Responses (text
+and usage metadata) are stored zlib-compressed.
+
+Modes (MODEL_CASSETTE_MODE):
+  - record: always call the wrapped backend and store the response
+  - replay: answer only from the cassette; a miss raises CassetteMiss
+  - replay_or_record: replay when possible, otherwise call and store
+
+ISO dates inside the system instruction are masked in the key, so the
+invoice prompt (which embeds today's date) still replays on later days.
+Requests that reference a cached prompt prefix (config["cached_content"])
+are keyed as the equivalent inline request, so recordings replay whether or
+not context caching is on.
+"""
+
+import re
+import json
+import time
+import uuid
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+from enum import Enum
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from pydantic import BaseModel
+
+from core.model_backend import CachedPrefix, ModelBackend, ModelResponse, content_parts, part_bytes
+
+logger = logging.getLogger(__name__)
+
+MODES = ("record", "replay", "replay_or_record")
+ISO_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+# Transport settings that do not change what the model returns
+IGNORED_CONFIG_KEYS = {"http_options"}
+
+
+class CassetteMiss(LookupError):
+    """Replay-only cassette has no recording for this request"""
+
+
+def _config_default(value):
+    if isinstance(value, type) and issubclass(value, BaseModel):
+        return value.model_json_schema()
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json", exclude_none=True)
+    return repr(value)
+
+
+def request_hashes(model: str, contents: Any, config: Optional[Dict[str, Any]]) -> Dict[str, str]:
+    """
+    Hashes that identify a request
+
+    Returns:
+        {"key", "prompt_hash", "image_hash", "config_hash"}
+    """
+    config = {k: v for k, v in (config or {}).items() if k not in IGNORED_CONFIG_KEYS and v is not None}
+    if isinstance(config.get("system_instruction"), str):
+        config["system_instruction"] = ISO_DATE.sub("<date>", config["system_instruction"])
+
+    prompt = hashlib.sha256()
+    image = hashlib.sha256()
+    for part in content_parts(contents):
+        (prompt if isinstance(part, str) else image).update(part_bytes(part))
+
+    config_hash = hashlib.sha256(
+        json.dumps(config, sort_keys=True, default=_config_default).encode("utf-8")
+    ).hexdigest()
+    hashes = {
+        "prompt_hash": prompt.hexdigest(),
+        "image_hash": image.hexdigest(),
+        "config_hash": config_hash,
+    }
+    hashes["key"] = hashlib.sha256(
+        f"{model}|{hashes['prompt_hash']}|{hashes['image_hash']}|{config_hash}".encode()
+    ).hexdigest()
+    return hashes
+
+
+class Cassette:
+    """
+    SQLite store of recorded model responses
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS model_calls (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                image_hash TEXT NOT NULL,
+                config_hash TEXT NOT NULL,
+                response BLOB NOT NULL,
+                recorded_at REAL NOT NULL,
+                replays INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[ModelResponse]:
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM model_calls WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE model_calls SET replays = replays + 1 WHERE key = ?", (key,))
+            self._conn.commit()
+        payload = json.loads(zlib.decompress(row[0]).decode("utf-8"))
+        return ModelResponse(payload["text"], payload["model"], payload.get("usage", {}))
+
+    def put(self, hashes: Dict[str, str], response: ModelResponse):
+        blob = zlib.compress(json.dumps(
+            {"text": response.text, "model": response.model, "usage": response.usage},
+            ensure_ascii=False,
+        ).encode("utf-8"), 9)
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO model_calls
+                    (key, model, prompt_hash, image_hash, config_hash, response, recorded_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    hashes["key"], response.model, hashes["prompt_hash"], hashes["image_hash"],
+                    hashes["config_hash"], blob, time.time(),
+                ),
+            )
+            self._conn.commit()
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            count, size, replays = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(response)), 0), COALESCE(SUM(replays), 0) FROM model_calls"
+            ).fetchone()
+        return {"path": str(self.path), "recordings": count, "stored_bytes": size, "total_replays": replays}
+
+
+class CassetteBackend(ModelBackend):
+    """
+    Records or replays the calls made to a wrapped backend
+    """
+
+    def __init__(self, inner: ModelBackend, path: Path, mode: str = "replay_or_record"):
+        """
+        Args:
+            inner: Backend that serves calls which are not replayed
+            path: Cassette SQLite file
+            mode: "record", "replay" or "replay_or_record"
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown cassette mode: {mode} (expected one of {', '.join(MODES)})")
+        self.inner = inner
+        self.mode = mode
+        self.cassette = Cassette(path)
+        self.name = f"cassette({inner.name})"
+        self._lock = threading.Lock()
+        self._stats = {"replayed": 0, "recorded": 0, "misses": 0}
+        # cached_content name -> (system instruction, prefix contents)
+        self._prefixes: Dict[str, Tuple[Optional[str], list]] = {}
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _inline(self, contents, config) -> Tuple[Any, Optional[Dict[str, Any]]]:
+        """The request without its cached_content reference, prefix restored"""
+        name = (config or {}).get("cached_content")
+        with self._lock:
+            prefix = self._prefixes.get(name) if name else None
+        if prefix is None:
+            return contents, config
+        system_instruction, prefix_contents = prefix
+        config = {k: v for k, v in config.items() if k != "cached_content"}
+        if system_instruction is not None:
+            config["system_instruction"] = system_instruction
+        return prefix_contents + content_parts(contents), config
+
+    def _replay(self, model, contents, config) -> Tuple[Dict[str, str], Optional[ModelResponse]]:
+        hashes = request_hashes(model, *self._inline(contents, config))
+        if self.mode == "record":
+            return hashes, None
+        response = self.cassette.get(hashes["key"])
+        if response is not None:
+            self._count("replayed")
+            return hashes, response
+        self._count("misses")
+        if self.mode == "replay":
+            raise CassetteMiss(f"No recording for {model} request {hashes['key'][:12]}")
+        return hashes, None
+
+    def _record(self, hashes, response: ModelResponse) -> ModelResponse:
+        self.cassette.put(hashes, response)
+        self._count("recorded")
+        return response
+
+    def generate(self, model, contents, config=None):
+        hashes, response = self._replay(model, contents, config)
+        if response is not None:
+            return response
+        return self._record(hashes, self.inner.generate(model, contents, config))
+
+    async def agenerate(self, model, contents, config=None):
+        hashes, response = self._replay(model, contents, config)
+        if response is not None:
+            return response
+        return self._record(hashes, await self.inner.agenerate(model, contents, config))
+
+    def generate_stream(self, model, contents, config=None):
+        hashes, response = self._replay(model, contents, config)
+        if response is not None:
+            yield response
+            return
+        # Recorded as one response once the stream completes
+        texts, usage, served_by = [], {}, model
+        for chunk in self.inner.generate_stream(model, contents, config):
+            texts.append(chunk.text)
+            usage = chunk.usage or usage
+            served_by = chunk.model
+            yield chunk
+        self._record(hashes, ModelResponse("".join(texts), served_by, usage))
+
+    def create_cache(self, model, system_instruction=None, contents=None, ttl_seconds=3600, display_name=None):
+        if self.mode == "replay":
+            # Replay never reaches the provider, so the prefix only lives here
+            prefix = CachedPrefix(f"cassette/{uuid.uuid4().hex}", model, 0, time.time() + ttl_seconds)
+        else:
+            prefix = self.inner.create_cache(model, system_instruction, contents, ttl_seconds, display_name)
+        with self._lock:
+            self._prefixes[prefix.name] = (
+                system_instruction, content_parts(contents) if contents is not None else []
+            )
+        return prefix
+
+    def delete_cache(self, name):
+        with self._lock:
+            self._prefixes.pop(name, None)
+        if self.mode != "replay":
+            self.inner.delete_cache(name)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(backend=self.name, mode=self.mode, cassette=self.cassette.summary())
+        return stats
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    path = sys.argv[1] if len(sys.argv) > 1 else os.getenv("MODEL_CASSETTE_PATH", "cassettes/model_calls.sqlite3")
+    print(json.dumps(Cassette(Path(path)).summary(), indent=2))
@@ -0,0 +1,181 @@
+"""
+Process-wide registry for the Gemini client and long-lived agents
+
+One genai.Client is shared by every request in the process so its HTTP
+connection pool (and the TLS sessions inside it) is reused instead of being
+rebuilt per upload. The registry also owns the ModelBackend the agents call
+(Gemini, or the offline fake when MODEL_BACKEND=fake). The API creates the
+registry in its lifespan hook; CLIs fall back to a lazily created default
+registry.
+"""
+
+import os
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+from google import genai
+from google.genai import types
+
+from core.cassette import CassetteBackend
+from core.model_backend import ModelBackend, backend_name, create_backend
+
+logger = logging.getLogger(__name__)
+
+
+class ClientRegistry:
+    """
+    Owns the shared Gemini client and any agents built on top of it
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        max_connections: Optional[int] = None,
+        max_keepalive_connections: Optional[int] = None,
+        keepalive_expiry: Optional[float] = None,
+        backend: Optional[str] = None,
+        cassette_mode: Optional[str] = None,
+        cassette_path: Optional[str] = None,
+    ):
+        """
+        Args:
+            api_key: Gemini API key (defaults to GEMINI_API_KEY)
+            max_connections: Upper bound on open connections per pool
+            max_keepalive_connections: Idle connections kept for reuse
+            keepalive_expiry: Seconds an idle connection is kept alive
+            backend: Model backend name (defaults to MODEL_BACKEND, then "gemini")
+            cassette_mode: Wrap the backend in a record/replay cassette
+                (defaults to MODEL_CASSETTE_MODE; "off" or empty disables it)
+            cassette_path: Cassette file (defaults to MODEL_CASSETTE_PATH)
+        """
+        self.api_key = api_key or os.getenv("GEMINI_API_KEY", "")
+        self.max_connections = max_connections or int(os.getenv("GEMINI_MAX_CONNECTIONS", 100))
+        self.max_keepalive_connections = max_keepalive_connections or int(
+            os.getenv("GEMINI_MAX_KEEPALIVE_CONNECTIONS", 20)
+        )
+        self.keepalive_expiry = keepalive_expiry or float(os.getenv("GEMINI_KEEPALIVE_EXPIRY_SECONDS", 30))
+
+        self._lock = threading.Lock()
+        self.backend_name = backend or backend_name()
+        self.cassette_mode = (cassette_mode or os.getenv("MODEL_CASSETTE_MODE", "off")).strip().lower()
+        self.cassette_path = cassette_path or os.getenv("MODEL_CASSETTE_PATH", "cassettes/model_calls.sqlite3")
+
+        self._client: Optional[genai.Client] = None
+        self._backend: Optional[ModelBackend] = None
+        self._agents: Dict[str, Any] = {}
+        self._stats = {
+            "clients_created": 0,
+            "client_requests": 0,
+            "agents_created": 0,
+            "agent_requests": 0,
+        }
+
+    def _http_options(self) -> types.HttpOptions:
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+        return types.HttpOptions(
+            client_args={"limits": limits},
+            async_client_args={"limits": limits},
+        )
+
+    def get_client(self) -> genai.Client:
+        """Return the shared client, creating it on first use"""
+        with self._lock:
+            self._stats["client_requests"] += 1
+            if self._client is None:
+                if not self.api_key:
+                    raise ValueError("API key not provided")
+                self._client = genai.Client(api_key=self.api_key, http_options=self._http_options())
+                self._stats["clients_created"] += 1
+                logger.info(
+                    f"Gemini client created (max_connections={self.max_connections}, "
+                    f"keepalive={self.max_keepalive_connections})"
+                )
+            return self._client
+
+    def get_backend(self) -> ModelBackend:
+        """Return the model backend, creating it on first use"""
+        with self._lock:
+            if self._backend is None:
+                backend = create_backend(self.backend_name, client_factory=self.get_client)
+                if self.cassette_mode not in ("", "off"):
+                    backend = CassetteBackend(backend, self.cassette_path, self.cassette_mode)
+                    logger.info(f"Model calls go through cassette {self.cassette_path} ({self.cassette_mode})")
+                self._backend = backend
+            return self._backend
+
+    def get_agent(self, name: str, factory: Callable[[], Any]) -> Any:
+        """
+        Return the agent registered under name, building it with factory once
+
+        Args:
+            name: Registry key, e.g. "financial"
+            factory: Zero-argument callable that builds the agent
+
+        Returns:
+            The shared agent instance
+        """
+        with self._lock:
+            self._stats["agent_requests"] += 1
+            agent = self._agents.get(name)
+            if agent is not None:
+                return agent
+
+        agent = factory()
+
+        with self._lock:
+            # Another thread may have won the race while factory() ran
+            if name not in self._agents:
+                self._agents[name] = agent
+                self._stats["agents_created"] += 1
+            return self._agents[name]
+
+    def stats(self) -> Dict[str, Any]:
+        """Reuse counters for the client and agents"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["client_reuses"] = max(stats["client_requests"] - stats["clients_created"], 0)
+            stats["agent_reuses"] = max(stats["agent_requests"] - stats["agents_created"], 0)
+            stats["agents"] = sorted(self._agents)
+            stats["backend"] = self._backend.stats() if self._backend else {"backend": self.backend_name}
+            stats["pool"] = {
+                "max_connections": self.max_connections,
+                "max_keepalive_connections": self.max_keepalive_connections,
+                "keepalive_expiry": self.keepalive_expiry,
+            }
+            return stats
+
+    async def aclose(self):
+        """Close both connection pools of the shared client"""
+        with self._lock:
+            client, self._client = self._client, None
+            self._backend = None
+            self._agents.clear()
+        if client is not None:
+            await client.aio.aclose()
+            client.close()
+
+
+_registry: Optional[ClientRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> ClientRegistry:
+    """Return the process-wide registry, creating a default one if needed"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ClientRegistry()
+        return _registry
+
+
+def set_registry(registry: Optional[ClientRegistry]):
+    """Install the registry used by get_registry (None resets it)"""
+    global _registry
+    with _registry_lock:
+        _registry = registry
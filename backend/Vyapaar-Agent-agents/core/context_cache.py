@@ -0,0 +1,281 @@
+"""
+Provider-side caching of static prompt prefixes
+
+The invoice system prompt and FINANCIAL_DOCUMENT_PROMPT are the same on
+every call, yet each request sends them again and the model re-encodes (and
+bills) them as fresh input. PromptCache creates a cached content entry for
+such a prefix once per MODEL_CONTEXT_CACHE_TTL_SECONDS and hands back its
+name; callers pass it as config["cached_content"] and send only the part of
+the request that follows the prefix. Cached tokens are reported as
+cached_content_token_count and counted as kind="cached" in
+vyapaar_model_tokens_total.
+
+Providers refuse to cache short prefixes (Gemini needs about 1,024 tokens on
+Flash models), so prefixes estimated below MODEL_CONTEXT_CACHE_MIN_TOKENS
+are sent inline without trying. Today both the compiled invoice prompt
+(~400 tokens) and FINANCIAL_DOCUMENT_PROMPT (~200) are below that, so
+caching only takes effect once a prompt grows past the minimum, or for a
+provider with a lower one (set MODEL_CONTEXT_CACHE_MIN_TOKENS). A failed
+creation is retried after RETRY_SECONDS; meanwhile calls fall back to the
+inline prompt.
+
+The provider can drop a prefix before its expiry (evicted, or deleted by
+another process). Requests then fail with 404, which the resilience layer
+does not retry; call_with_prefix/acall_with_prefix forget the prefix and
+repeat the request once with the prompt inline.
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from google.genai import errors
+
+from core.metrics import MODEL_CONTEXT_CACHE
+from core.model_backend import CachedPrefix, ModelBackend, content_parts, part_bytes
+
+logger = logging.getLogger(__name__)
+
+# Recreate a prefix this long before it expires, so no request races the expiry
+REFRESH_MARGIN_SECONDS = 60
+RETRY_SECONDS = 300
+
+T = TypeVar("T")
+
+
+@dataclass
+class _Entry:
+    prefix: Optional[CachedPrefix]
+    retry_at: float = 0.0
+
+
+def is_missing_prefix(exc: BaseException) -> bool:
+    """True when a request failed because its cached_content no longer exists"""
+    return isinstance(exc, errors.APIError) and exc.code == 404
+
+
+def _prefix_key(backend: ModelBackend, model: str, system_instruction: Optional[str], contents: list) -> Tuple:
+    digest = hashlib.sha256((system_instruction or "").encode("utf-8"))
+    for part in contents:
+        digest.update(part_bytes(part))
+    return id(backend), model, digest.hexdigest()
+
+
+class PromptCache:
+    """
+    Cached content handles per (backend, model, prefix), created on demand
+    """
+
+    def __init__(
+        self,
+        enabled: Optional[bool] = None,
+        ttl_seconds: Optional[float] = None,
+        min_tokens: Optional[int] = None,
+    ):
+        """
+        Args:
+            enabled: Use context caching at all (MODEL_CONTEXT_CACHE)
+            ttl_seconds: Lifetime of each cached prefix
+            min_tokens: Prefixes estimated below this are always sent inline
+        """
+        self.enabled = (
+            enabled if enabled is not None
+            else os.getenv("MODEL_CONTEXT_CACHE", "true").strip().lower() in ("1", "true", "yes")
+        )
+        self.ttl_seconds = ttl_seconds or float(os.getenv("MODEL_CONTEXT_CACHE_TTL_SECONDS", 3600))
+        self.min_tokens = min_tokens if min_tokens is not None else int(os.getenv("MODEL_CONTEXT_CACHE_MIN_TOKENS", 1024))
+        self._entries: Dict[Tuple, _Entry] = {}
+        self._lock = threading.Lock()
+        self._create_lock = threading.Lock()
+        self._stats = {
+            "created": 0, "reused": 0, "inline": 0, "failed": 0, "below_minimum": 0, "invalidated": 0,
+        }
+
+    def _count(self, endpoint: str, event: str):
+        with self._lock:
+            self._stats[event] += 1
+        MODEL_CONTEXT_CACHE.labels(endpoint, event).inc()
+
+    def _lookup(self, key: Tuple, endpoint: str) -> Tuple[bool, Optional[str]]:
+        """(settled, name): settled is False when the prefix has to be created"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        now = time.time()
+        if entry.prefix is not None:
+            if entry.prefix.expires_at - REFRESH_MARGIN_SECONDS > now:
+                self._count(endpoint, "reused")
+                return True, entry.prefix.name
+            return False, None
+        if now < entry.retry_at:
+            self._count(endpoint, "inline")
+            return True, None
+        return False, None
+
+    def get(
+        self,
+        backend: ModelBackend,
+        model: str,
+        endpoint: str,
+        system_instruction: Optional[str] = None,
+        contents: Optional[list] = None,
+    ) -> Optional[str]:
+        """
+        Name of a cached prefix for this model, creating it if needed
+
+        Args:
+            backend: Backend the request will go to
+            model: Model name (caches are per model)
+            endpoint: Label for metrics and the cache's display name
+            system_instruction: Static system instruction to cache
+            contents: Static leading content parts to cache
+
+        Returns:
+            The cached_content name, or None to send the prefix inline
+        """
+        if not self.enabled:
+            return None
+        contents = content_parts(contents) if contents is not None else []
+        key = _prefix_key(backend, model, system_instruction, contents)
+        settled, name = self._lookup(key, endpoint)
+        if settled:
+            return name
+        return self._create(key, backend, model, endpoint, system_instruction, contents)
+
+    async def aget(
+        self,
+        backend: ModelBackend,
+        model: str,
+        endpoint: str,
+        system_instruction: Optional[str] = None,
+        contents: Optional[list] = None,
+    ) -> Optional[str]:
+        """get() for the event loop; only a (re)creation leaves the loop"""
+        if not self.enabled:
+            return None
+        contents = content_parts(contents) if contents is not None else []
+        key = _prefix_key(backend, model, system_instruction, contents)
+        settled, name = self._lookup(key, endpoint)
+        if settled:
+            return name
+        return await asyncio.to_thread(self._create, key, backend, model, endpoint, system_instruction, contents)
+
+    def _create(self, key, backend, model, endpoint, system_instruction, contents) -> Optional[str]:
+        with self._create_lock:
+            # Another request may have created it while this one waited
+            settled, name = self._lookup(key, endpoint)
+            if settled:
+                return name
+
+            estimate = sum(len(part) // 4 if isinstance(part, str) else 258 for part in contents)
+            estimate += len(system_instruction or "") // 4
+            if estimate < self.min_tokens:
+                # Re-checked after a TTL, so dated keys (the daily invoice prompt) age out
+                self._prune()
+                self._entries[key] = _Entry(None, retry_at=time.time() + self.ttl_seconds)
+                self._count(endpoint, "below_minimum")
+                logger.info(
+                    f"Prompt prefix for {endpoint} is ~{estimate} tokens, below the "
+                    f"{self.min_tokens}-token caching minimum; sending it inline"
+                )
+                return None
+
+            try:
+                prefix = backend.create_cache(
+                    model,
+                    system_instruction=system_instruction,
+                    contents=contents or None,
+                    ttl_seconds=self.ttl_seconds,
+                    display_name=f"vyapaar-{endpoint}",
+                )
+            except Exception as e:
+                self._prune()
+                self._entries[key] = _Entry(None, retry_at=time.time() + RETRY_SECONDS)
+                self._count(endpoint, "failed")
+                logger.warning(f"⚠️ Could not cache the {endpoint} prompt ({type(e).__name__}: {e}); sending it inline")
+                return None
+
+            self._prune()
+            self._entries[key] = _Entry(prefix)
+            self._count(endpoint, "created")
+            logger.info(f"🗄️ Cached the {endpoint} prompt prefix ({prefix.token_count} tokens) as {prefix.name}")
+            return prefix.name
+
+    def _prune(self):
+        """
+        Drop expired prefixes and lapsed inline markers, e.g. yesterday's
+        invoice prompt (caller holds _create_lock)
+        """
+        now = time.time()
+        for stale in [key for key, entry in self._entries.items()
+                      if (entry.prefix.expires_at if entry.prefix is not None else entry.retry_at) < now]:
+            del self._entries[stale]
+
+    def invalidate(self, name: str, endpoint: str):
+        """Forget a prefix the provider no longer has; the next get() recreates it"""
+        with self._create_lock:
+            stale = [key for key, entry in self._entries.items()
+                     if entry.prefix is not None and entry.prefix.name == name]
+            for key in stale:
+                del self._entries[key]
+        if stale:
+            self._count(endpoint, "invalidated")
+            logger.warning(f"⚠️ Cached {endpoint} prompt {name} is gone at the provider; recreating it")
+
+    def call_with_prefix(self, name: Optional[str], endpoint: str, call: Callable[[Optional[str]], T]) -> T:
+        """
+        Run call(name), falling back to call(None) once if the prefix has vanished
+
+        Args:
+            name: cached_content name from get(), or None
+            endpoint: Label for metrics
+            call: Makes the request; None means send the prompt inline
+        """
+        try:
+            return call(name)
+        except Exception as e:
+            if name is None or not is_missing_prefix(e):
+                raise
+        self.invalidate(name, endpoint)
+        return call(None)
+
+    async def acall_with_prefix(
+        self, name: Optional[str], endpoint: str, call: Callable[[Optional[str]], Awaitable[T]]
+    ) -> T:
+        """call_with_prefix() for coroutine functions"""
+        try:
+            return await call(name)
+        except Exception as e:
+            if name is None or not is_missing_prefix(e):
+                raise
+        await asyncio.to_thread(self.invalidate, name, endpoint)
+        return await call(None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(
+            enabled=self.enabled,
+            ttl_seconds=self.ttl_seconds,
+            min_tokens=self.min_tokens,
+            live_prefixes=sum(1 for entry in list(self._entries.values()) if entry.prefix is not None),
+        )
+        return stats
+
+
+_prompt_cache: Optional[PromptCache] = None
+_prompt_cache_lock = threading.Lock()
+
+
+def get_prompt_cache() -> PromptCache:
+    """Process-wide prompt cache, configured from MODEL_CONTEXT_CACHE_* env vars"""
+    global _prompt_cache
+    with _prompt_cache_lock:
+        if _prompt_cache is None:
+            _prompt_cache = PromptCache()
+        return _prompt_cache
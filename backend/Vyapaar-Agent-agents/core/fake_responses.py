@@ -0,0 +1,285 @@
+"""
+Rule-generated responses for the fake model backend
+
+Each responder takes (contents, config, rng) and returns response text, or
+None if the request is not one it understands. The rng is seeded from the
+request so the same input always gets the same answer.
+"""
+
+import re
+import json
+import string
+import typing
+from datetime import date, timedelta
+from enum import Enum
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, ValidationError
+
+from invoice_agent.schemas import (
+    GST_INVOICE_SCHEMA,
+    BILL_OF_SUPPLY_SCHEMA,
+    QUOTATION_SCHEMA,
+    PAYMENT_RECEIPT_SCHEMA
+)
+
+VENDORS = ["Sharma Traders", "Gupta Hardware", "Balaji Stores", "Shree Ganesh Cement", "Patel Electricals"]
+PEOPLE = ["Rahul Verma", "Priya Singh", "Amit Kumar", "Sunita Devi", "Mohd Irfan"]
+PAYMENT_APPS = ["PhonePe", "GPay", "Paytm", "BHIM"]
+ITEMS = ["Cement 50kg bag", "Steel rod 12mm", "Wire bundle", "Wall paint 20L", "Red bricks"]
+
+# Materials the transaction prompt knows HSN codes for
+MATERIALS = {
+    "cement": ("Cement", "2523", "bag"),
+    "wire": ("Electrical wire", "8536", "bundle"),
+    "switch": ("Electrical switch", "8536", "piece"),
+    "steel": ("Steel rod", "7214", "kg"),
+    "sariya": ("Steel rod", "7214", "kg"),
+    "rod": ("Steel rod", "7214", "kg"),
+    "paint": ("Paint", "3208", "litre"),
+    "int": ("Bricks", "6901", "piece"),
+    "brick": ("Bricks", "6901", "piece"),
+}
+
+
+def _text_parts(contents) -> List[str]:
+    parts = contents if isinstance(contents, list) else [contents]
+    return [part for part in parts if isinstance(part, str)]
+
+
+# ---------- structured output (response_schema) ----------
+
+def _gstin(rng) -> str:
+    letters = "".join(rng.choice(string.ascii_uppercase) for _ in range(5))
+    return (
+        f"{rng.randint(10, 36)}{letters}{rng.randint(1000, 9999)}"
+        f"{rng.choice(string.ascii_uppercase)}{rng.randint(1, 9)}Z{rng.choice(string.ascii_uppercase)}"
+    )
+
+
+FIELD_HINTS = {
+    "amount": lambda rng: round(rng.uniform(50, 25000), 2),
+    "date": lambda rng: (date.today() - timedelta(days=rng.randint(0, 90))).strftime("%d/%m/%Y"),
+    "vendor_name": lambda rng: rng.choice(VENDORS),
+    "gstin": _gstin,
+    "items": lambda rng: rng.sample(ITEMS, rng.randint(1, 3)),
+    "invoice_number": lambda rng: f"INV-{rng.randint(1000, 9999)}",
+    "utr_number": lambda rng: str(rng.randint(10 ** 11, 10 ** 12 - 1)),
+    "sender_name": lambda rng: rng.choice(PEOPLE),
+    "receiver_name": lambda rng: rng.choice(VENDORS),
+    "payment_app": lambda rng: rng.choice(PAYMENT_APPS),
+    "description": lambda rng: "Payment for goods",
+}
+
+
+def _value_for(annotation, rng) -> Any:
+    """A plausible value for a type annotation"""
+    origin = typing.get_origin(annotation)
+    if origin is typing.Union:
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        return _value_for(args[0], rng) if args else None
+    if origin in (list, List):
+        (item_type,) = typing.get_args(annotation) or (str,)
+        return [_value_for(item_type, rng) for _ in range(rng.randint(1, 3))]
+    if isinstance(annotation, type):
+        if issubclass(annotation, Enum):
+            # "unknown"-style catch-alls make poor test data
+            members = [m for m in annotation if str(m.value).lower() != "unknown"] or list(annotation)
+            return rng.choice(members).value
+        if issubclass(annotation, BaseModel):
+            return _fill_model(annotation, rng)
+        if annotation is bool:
+            return rng.random() < 0.5
+        if annotation is int:
+            return rng.randint(1, 100)
+        if annotation is float:
+            return round(rng.uniform(1, 1000), 2)
+    return "Sample"
+
+
+def _fill_model(model: type, rng) -> Dict[str, Any]:
+    data = {}
+    for name, info in model.model_fields.items():
+        hint = FIELD_HINTS.get(name)
+        data[name] = hint(rng) if hint else _value_for(info.annotation, rng)
+    return data
+
+
+def structured_response(contents, config: Dict[str, Any], rng) -> Optional[str]:
+    """Instance of a pydantic response_schema, validated before it is returned"""
+    schema = config.get("response_schema")
+    if not (isinstance(schema, type) and issubclass(schema, BaseModel)):
+        return None
+
+    data = _fill_model(schema, rng)
+    try:
+        instance = schema.model_validate(data)
+    except ValidationError as e:
+        # Drop whatever the hints got wrong and let defaults take over
+        for error in e.errors():
+            if error["loc"]:
+                data.pop(error["loc"][0], None)
+        instance = schema.model_validate(data)
+    return instance.model_dump_json()
+
+
+# ---------- invoice agent ----------
+
+def _number_before(pattern: str, text: str) -> Optional[float]:
+    match = re.search(r"(\d+(?:\.\d+)?)\s*(?:" + pattern + r")", text)
+    return float(match.group(1)) if match else None
+
+
+def _customer(text: str) -> str:
+    match = re.search(r"([A-Z][a-z]+)\s+(?:ko|se|ke|ka|ki)\b", text) or re.search(r"\bfor\s+([A-Z][\w.]*)", text)
+    return match.group(1) if match else ""
+
+
+def _line_item(text: str, rng) -> Dict[str, Any]:
+    lowered = text.lower()
+    description, hsn, unit = next(
+        (spec for key, spec in MATERIALS.items() if re.search(r"\b" + key, lowered)),
+        ("Goods", "9999", "piece"),
+    )
+    quantity = _number_before(r"bags?|bori|kg|piece|pcs|litre|l\b|bundle|nos", lowered)
+    rate = _number_before(r"(?:rs|rupay|rupees|₹)?\s*(?:per|/|ka rate|rate)", lowered)
+    numbers = [float(n) for n in re.findall(r"\d+(?:\.\d+)?", lowered)]
+    # Like the prompt asks: what the command does not say is left at 0
+    quantity = quantity or (numbers[0] if numbers else 0)
+    rate = rate or (numbers[1] if len(numbers) > 1 else 0)
+    return {
+        "description": description,
+        "hsn_code": hsn,
+        "quantity": quantity,
+        "unit": unit,
+        "rate": rate,
+        "amount": round(quantity * rate, 2),
+    }
+
+
+def invoice_response(contents, config: Dict[str, Any], rng) -> Optional[str]:
+    """Document JSON for the transaction prompt, following its rules"""
+    system = config.get("system_instruction") or ""
+    if "transaction documents" not in str(system):
+        return None
+
+    text = " ".join(_text_parts(contents))
+    lowered = text.lower()
+    today = date.today()
+    number = rng.randint(1, 9999)
+
+    if any(word in lowered for word in ("receipt", "parchi", "mila", "received", "payment")):
+        doc = dict(PAYMENT_RECEIPT_SCHEMA)
+        numbers = [float(n) for n in re.findall(r"\d+(?:\.\d+)?", lowered)]
+        amount = max(numbers) if numbers else 0
+        previous = float(rng.randint(int(amount), int(amount) * 2))
+        mode = next((m for m in ("upi", "cash", "cheque", "neft") if m in lowered), "")
+        doc.update(
+            receipt_number=f"RCP-{number:04d}",
+            receipt_date=today.isoformat(),
+            received_from=_customer(text),
+            amount_received=amount,
+            payment_mode=mode.upper() if mode in ("upi", "neft") else mode.capitalize(),
+            payment_for="Udhaar payment" if "udhaar" in lowered else "Goods",
+            previous_balance=previous,
+            current_balance=previous - amount,
+        )
+        return _with_questions(doc)
+
+    item = _line_item(text, rng)
+    customer = _customer(text)
+
+    if any(word in lowered for word in ("quotation", "estimate")):
+        doc = dict(QUOTATION_SCHEMA)
+        item.pop("hsn_code")
+        doc.update(
+            quotation_number=f"QT-{number:04d}",
+            quotation_date=today.isoformat(),
+            valid_until=(today + timedelta(days=14)).isoformat(),
+            customer_name=customer,
+            items=[item],
+            subtotal=item["amount"],
+            total_estimate=item["amount"],
+        )
+    elif any(word in lowered for word in ("kachha", "cash memo", "bill of supply")):
+        doc = dict(BILL_OF_SUPPLY_SCHEMA)
+        item.pop("hsn_code")
+        item.pop("rate")
+        doc.update(
+            bill_number=f"BOS-{number:04d}",
+            bill_date=today.isoformat(),
+            customer_name=customer,
+            items=[item],
+            total=item["amount"],
+        )
+    else:
+        doc = dict(GST_INVOICE_SCHEMA)
+        subtotal = item["amount"]
+        tax = round(subtotal * 0.09, 2)
+        doc.update(
+            invoice_number=f"INV-{number:04d}",
+            invoice_date=today.isoformat(),
+            customer_name=customer,
+            items=[item],
+            subtotal=subtotal,
+            cgst_amount=tax,
+            sgst_amount=tax,
+            total=round(subtotal + 2 * tax, 2),
+        )
+    return _with_questions(doc)
+
+
+def _with_questions(doc: Dict[str, Any]) -> str:
+    """Document JSON plus the clarification_questions the prompt asks for"""
+    questions = {}
+    doc_type = doc["document_type"]
+    if doc_type == "payment_receipt":
+        if not doc["amount_received"]:
+            questions["amount_received"] = "Kitne rupaye mile?"
+        if not doc["payment_mode"]:
+            questions["payment_mode"] = "Cash mila ya UPI?"
+    else:
+        if not doc["customer_name"]:
+            questions["customer_name"] = "Kiske naam pe bill banana hai?"
+        item = doc["items"][0]
+        if not item.get("quantity"):
+            questions["items[0].quantity"] = f"{item['description']} kitna diya?"
+        if doc_type == "bill_of_supply":
+            if not doc["total"]:
+                questions["total"] = "Kul kitne ka bill hai?"
+        elif not item.get("rate"):
+            key = "items[0].rate_or_amount" if doc_type == "quotation" else "items[0].rate"
+            questions[key] = f"{item['description']} kis rate pe diya?"
+    if questions:
+        doc["clarification_questions"] = questions
+    return json.dumps(doc, ensure_ascii=False)
+
+
+def patch_response(contents, config: Dict[str, Any], rng) -> Optional[str]:
+    """Patch JSON for the invoice follow-up prompt: numbers fill numeric fields in order"""
+    text = " ".join(_text_parts(contents))
+    if not text.startswith("Fill missing fields"):
+        return None
+    fields = re.findall(r"^- (\S+?)(?::|$)", text, re.MULTILINE)
+    answer = text.split("Answer:", 1)[1].split("\n", 1)[0].strip()
+    numbers = [float(n) for n in re.findall(r"\d+(?:\.\d+)?", answer)]
+    words = re.findall(r"[A-Za-z][\w.&']*", answer)
+    patch: Dict[str, Any] = {}
+    for field in fields:
+        if field == "customer_name":
+            names = [word for word in words if word[0].isupper()]
+            if names:
+                patch[field] = " ".join(names)
+        elif field == "payment_mode":
+            mode = next((m for m in ("upi", "cash", "cheque", "neft") if m in answer.lower()), None)
+            if mode:
+                patch[field] = mode.upper() if mode in ("upi", "neft") else mode.capitalize()
+        elif field == "items":
+            patch[field] = [_line_item(answer, rng)]
+        elif numbers:
+            value = numbers.pop(0)
+            patch[field] = str(int(value)) if field.endswith("hsn_code") else value
+    return json.dumps(patch, ensure_ascii=False)
+
+
+DEFAULT_RESPONDERS = [structured_response, invoice_response, patch_response]
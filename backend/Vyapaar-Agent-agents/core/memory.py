@@ -0,0 +1,295 @@
+"""
+Memory profiling and a soft memory budget
+
+Profiling mode (MEMORY_PROFILE=1, or --memory-profile on the CLIs) runs
+tracemalloc and records:
+
+  - per stage (memory_stage): calls, memory still held when the stage
+    returns (net growth) and the peak reached inside it; peaks are only
+    measured when the stage did not overlap another one
+  - per checkpoint: a snapshot with the top allocation sites and the growth
+    by site since the previous checkpoint
+
+Soft budget (MEMORY_SOFT_LIMIT_MB; works without profiling): process RSS is
+compared with the limit. Crossing it logs one warning, makes batch runs drop to
+one image in flight until usage falls back, and lets the API answer new OCR
+uploads with 503.
+"""
+
+import gc
+import os
+import sys
+import time
+import logging
+import threading
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Optional
+
+from core.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+_SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def rss_bytes() -> int:
+    """Current resident set size (peak RSS where /proc is unavailable)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KiB, macOS bytes
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _site(frame: tracemalloc.Frame) -> str:
+    parts = frame.filename.replace("\\", "/").split("/")
+    return f"{'/'.join(parts[-3:])}:{frame.lineno}"
+
+
+class MemoryMonitor:
+    """
+    tracemalloc stage/checkpoint bookkeeping plus the soft RSS budget
+    """
+
+    def __init__(
+        self,
+        enabled: Optional[bool] = None,
+        frames: Optional[int] = None,
+        top_n: Optional[int] = None,
+        soft_limit_mb: Optional[float] = None,
+    ):
+        self.enabled = (
+            enabled if enabled is not None
+            else os.getenv("MEMORY_PROFILE", "0").strip().lower() in ("1", "true", "yes")
+        )
+        self.frames = frames or int(os.getenv("MEMORY_PROFILE_FRAMES", 5))
+        self.top_n = top_n or int(os.getenv("MEMORY_TOP_N", 10))
+        limit_mb = soft_limit_mb if soft_limit_mb is not None else float(os.getenv("MEMORY_SOFT_LIMIT_MB", 0))
+        self.soft_limit_bytes = int(limit_mb * MB)
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Dict[str, Any]] = {}
+        self._active_stages = 0
+        self._checkpoints: deque = deque(maxlen=20)
+        self._last_snapshot: Optional[tracemalloc.Snapshot] = None
+        self._over_budget = False
+        self._budget_events = {"crossings": 0, "rejected": 0, "paused": 0}
+        if self.enabled:
+            self.start()
+
+    # ---------- tracemalloc ----------
+
+    def start(self):
+        """Turn on profiling mode (idempotent)"""
+        self.enabled = True
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            logger.info(f"🧠 Memory profiling on (tracemalloc, {self.frames} frames)")
+
+    def stage(self, name: str):
+        """Context manager recording memory growth and peak for one stage"""
+        if not self.enabled:
+            return nullcontext()
+        return self._stage(name)
+
+    @contextmanager
+    def _stage(self, name: str):
+        with self._lock:
+            self._active_stages += 1
+            alone = self._active_stages == 1
+            if alone:
+                tracemalloc.reset_peak()
+            start, _ = tracemalloc.get_traced_memory()
+        try:
+            yield
+        finally:
+            with self._lock:
+                current, peak = tracemalloc.get_traced_memory()
+                alone = alone and self._active_stages == 1
+                self._active_stages -= 1
+                stats = self._stages.setdefault(
+                    name, {"calls": 0, "net_bytes": 0, "max_net_bytes": 0, "max_peak_bytes": None}
+                )
+                net = current - start
+                stats["calls"] += 1
+                stats["net_bytes"] += net
+                stats["max_net_bytes"] = max(stats["max_net_bytes"], net)
+                if alone:
+                    stats["max_peak_bytes"] = max(stats["max_peak_bytes"] or 0, peak - start)
+
+    def checkpoint(self, label: str) -> Optional[Dict[str, Any]]:
+        """
+        Snapshot allocations, log the top sites and the growth since the
+        previous checkpoint
+
+        Returns:
+            The checkpoint record, or None when profiling is off
+        """
+        if not self.enabled:
+            return None
+        snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+        with self._lock:
+            previous, self._last_snapshot = self._last_snapshot, snapshot
+
+        current, peak = tracemalloc.get_traced_memory()
+        record = {
+            "label": label,
+            "time": time.time(),
+            "traced_bytes": current,
+            "traced_peak_bytes": peak,
+            "rss_bytes": rss_bytes(),
+            "top": [
+                {"site": _site(stat.traceback[0]), "bytes": stat.size, "count": stat.count}
+                for stat in snapshot.statistics("lineno")[:self.top_n]
+            ],
+            "growth": [],
+        }
+        if previous is not None:
+            record["growth"] = [
+                {"site": _site(stat.traceback[0]), "bytes": stat.size_diff, "count": stat.count_diff}
+                for stat in snapshot.compare_to(previous, "lineno")[:self.top_n]
+                if stat.size_diff
+            ]
+
+        with self._lock:
+            self._checkpoints.append(record)
+        logger.info(
+            f"🧠 [{label}] traced {current / MB:.1f} MB, RSS {record['rss_bytes'] / MB:.1f} MB"
+            + (f"; biggest growth {record['growth'][0]['site']} "
+               f"{record['growth'][0]['bytes'] / 1024:+.0f} KiB" if record["growth"] else "")
+        )
+        return record
+
+    # ---------- soft budget ----------
+
+    def over_budget(self) -> bool:
+        """
+        Whether RSS is above the soft limit (always False without one)
+
+        The first reading over the limit runs a GC pass and re-checks, and
+        logs a warning if usage is still too high.
+        """
+        if not self.soft_limit_bytes:
+            return False
+        rss = rss_bytes()
+        if rss <= self.soft_limit_bytes:
+            if self._over_budget:
+                self._over_budget = False
+                logger.info(f"🧠 Memory back under budget ({rss / MB:.0f} MB)")
+            return False
+        if not self._over_budget:
+            gc.collect()
+            rss = rss_bytes()
+            if rss <= self.soft_limit_bytes:
+                return False
+            self._over_budget = True
+            with self._lock:
+                self._budget_events["crossings"] += 1
+            logger.warning(
+                f"⚠️ RSS {rss / MB:.0f} MB is over the soft memory budget of "
+                f"{self.soft_limit_bytes / MB:.0f} MB; applying backpressure"
+            )
+        return True
+
+    def count(self, event: str):
+        """Count a budget action ("rejected" request or "paused" batch)"""
+        with self._lock:
+            self._budget_events[event] += 1
+
+    # ---------- reporting ----------
+
+    def report(self) -> Dict[str, Any]:
+        """Stage table, recent checkpoints, current usage and budget state"""
+        traced = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (None, None)
+        with self._lock:
+            return {
+                "profiling": self.enabled,
+                "rss_bytes": rss_bytes(),
+                "traced_bytes": traced[0],
+                "traced_peak_bytes": traced[1],
+                "soft_limit_bytes": self.soft_limit_bytes or None,
+                "over_budget": self._over_budget,
+                "budget_events": dict(self._budget_events),
+                "stages": {name: dict(stats) for name, stats in self._stages.items()},
+                "checkpoints": list(self._checkpoints),
+            }
+
+    def format_report(self) -> str:
+        """Human-readable report for the CLIs"""
+        report = self.report()
+        lines = [f"🧠 Memory report — RSS {report['rss_bytes'] / MB:.1f} MB"]
+        if report["traced_bytes"] is not None:
+            lines[0] += (
+                f", traced {report['traced_bytes'] / MB:.1f} MB "
+                f"(peak {report['traced_peak_bytes'] / MB:.1f} MB)"
+            )
+        if report["stages"]:
+            lines.append("\nStage                         calls   net MB   max net MB   max peak MB")
+            for name, stats in sorted(report["stages"].items()):
+                peak = stats["max_peak_bytes"]
+                lines.append(
+                    f"{name:<28}{stats['calls']:>7}{stats['net_bytes'] / MB:>9.2f}"
+                    f"{stats['max_net_bytes'] / MB:>13.2f}"
+                    f"{(peak / MB if peak is not None else float('nan')):>14.2f}"
+                )
+        if report["checkpoints"]:
+            last = report["checkpoints"][-1]
+            lines.append(f"\nTop allocation sites at '{last['label']}':")
+            lines.extend(f"  {site['bytes'] / 1024:>10.0f} KiB  {site['site']}" for site in last["top"])
+            if last["growth"]:
+                lines.append("Growth since the previous checkpoint:")
+                lines.extend(f"  {site['bytes'] / 1024:>+10.0f} KiB  {site['site']}" for site in last["growth"])
+        return "\n".join(lines)
+
+
+_monitor: Optional[MemoryMonitor] = None
+_monitor_lock = threading.Lock()
+
+
+def get_memory_monitor() -> MemoryMonitor:
+    """Process-wide monitor, configured from MEMORY_* env vars"""
+    global _monitor
+    if _monitor is None:
+        with _monitor_lock:
+            if _monitor is None:
+                _monitor = MemoryMonitor()
+    return _monitor
+
+
+def memory_stage(name: str):
+    """Shorthand for get_memory_monitor().stage(name)"""
+    return get_memory_monitor().stage(name)
+
+
+def _collect_metrics():
+    """Scrape-time export of RSS, traced memory and budget actions for /metrics"""
+    monitor = get_memory_monitor()
+    report = monitor.report()
+    yield ("vyapaar_process_rss_bytes", "gauge", "Resident set size of this process", [({}, report["rss_bytes"])])
+    yield (
+        "vyapaar_memory_traced_bytes", "gauge", "Memory traced by tracemalloc (profiling mode only)",
+        [({}, report["traced_bytes"])],
+    )
+    yield (
+        "vyapaar_memory_soft_limit_bytes", "gauge", "Soft memory budget (MEMORY_SOFT_LIMIT_MB)",
+        [({}, report["soft_limit_bytes"])],
+    )
+    yield (
+        "vyapaar_memory_budget_events_total", "counter",
+        "Soft budget crossings, rejected requests and paused batch submissions",
+        [({"event": event}, count) for event, count in report["budget_events"].items()],
+    )
+
+
+REGISTRY.register_collector(_collect_metrics)
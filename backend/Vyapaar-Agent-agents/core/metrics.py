@@ -0,0 +1,396 @@
+"""
+Prometheus-format metrics without external dependencies
+
+Counters, gauges and histograms with labels, rendered in the Prometheus
+text exposition format by GET /metrics. Label sets are bound once with
+.labels(...) and the child is reused, so recording on the hot path is a
+lock plus an add (histograms also bisect into the bucket list).
+
+Statistics that other components already keep (cache, resilience, job
+queue) are pulled at scrape time through register_collector, so they
+cost nothing per request.
+"""
+
+import time
+import bisect
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Seconds; spans sub-millisecond local stages up to slow model calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# (name, type, help, [(labels, value)]) as produced by collectors
+Sample = Tuple[Dict[str, str], float]
+Family = Tuple[str, str, str, List[Sample]]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Timer:
+    """Context manager observing elapsed seconds into a histogram child"""
+    __slots__ = ("_child", "_started")
+
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._child.observe(time.perf_counter() - self._started)
+        return False
+
+
+class _CounterChild:
+    __slots__ = ("_lock", "value")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        with self._lock:
+            self.value = value
+
+
+class _HistogramChild:
+    __slots__ = ("_lock", "_bounds", "counts", "sum")
+
+    def __init__(self, bounds: Sequence[float]):
+        self._lock = threading.Lock()
+        self._bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self) -> _Timer:
+        return _Timer(self)
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._unlabelled = self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **kwargs):
+        """Child for one label set; bind once and reuse on hot paths"""
+        if kwargs:
+            values = tuple(str(kwargs[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(value) for value in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _items(self):
+        with self._lock:
+            return list(self._children.items())
+
+    def render(self) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._unlabelled.inc(amount)
+
+    def render(self):
+        for values, child in self._items():
+            yield f"{self.name}{_format_labels(dict(zip(self.labelnames, values)))} {_format_value(child.value)}"
+
+
+class Gauge(Counter):
+    """Value that goes up and down"""
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def dec(self, amount: float = 1.0):
+        self._unlabelled.dec(amount)
+
+    def set(self, value: float):
+        self._unlabelled.set(value)
+
+
+class Histogram(_Metric):
+    """Bucketed distribution of observed values"""
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._unlabelled.observe(value)
+
+    def time(self) -> _Timer:
+        return self._unlabelled.time()
+
+    def render(self):
+        for values, child in self._items():
+            labels = dict(zip(self.labelnames, values))
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                bucket_labels = dict(labels, le=_format_value(bound) if bound != float("inf") else "+Inf")
+                yield f"{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(labels)} {cumulative}"
+
+
+class MetricsRegistry:
+    """Holds metrics and scrape-time collectors, renders the exposition text"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                # Module reloads re-declare metrics; keep the live one
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector: Callable[[], Iterable[Family]]):
+        """
+        Add a callable run at scrape time, returning (name, type, help, samples)
+        families; samples are (labels dict, value) pairs
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Everything in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.render())
+
+        for collector in collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                lines.append(f"# collector {getattr(collector, '__name__', collector)} failed: {e}")
+                continue
+            for name, type_name, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {type_name}")
+                for labels, value in samples:
+                    if value is not None:
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# ---------- shared metrics ----------
+
+OCR_STAGE_SECONDS = REGISTRY.histogram(
+    "vyapaar_ocr_stage_seconds",
+    "Time spent in each financial OCR stage",
+    ["stage"],
+)
+INVOICE_STAGE_SECONDS = REGISTRY.histogram(
+    "vyapaar_invoice_stage_seconds",
+    "Time spent in each invoice generation stage",
+    ["stage"],
+)
+OCR_RESULTS = REGISTRY.counter(
+    "vyapaar_ocr_results_total",
+    "Financial OCR outcomes by status and source (model, memory, disk, near_duplicate)",
+    ["status", "source"],
+)
+INVOICE_RESULTS = REGISTRY.counter(
+    "vyapaar_invoice_results_total",
+    "Invoice generation outcomes by status",
+    ["status"],
+)
+INVOICE_FAST_PATH = REGISTRY.counter(
+    "vyapaar_invoice_fast_path_total",
+    "Invoice commands handled by the local parser (label: document type) or sent to the LLM (label: reason)",
+    ["outcome", "detail"],
+)
+INVOICE_CLARIFICATION = REGISTRY.counter(
+    "vyapaar_invoice_clarification_questions_total",
+    "Clarification questions by source (model: asked in the generation response, template: local fallback)",
+    ["source"],
+)
+INVOICE_STREAM_FIRST_CONTENT = REGISTRY.histogram(
+    "vyapaar_invoice_stream_first_content_seconds",
+    "Time from a /invoice/stream request to its first header, item or totals event",
+)
+INVOICE_PATCHES = REGISTRY.counter(
+    "vyapaar_invoice_patches_total",
+    "Follow-up answers applied to a session's document (local: parsed, model: patch call, failed: unusable)",
+    ["source"],
+)
+INVOICE_CACHE = REGISTRY.counter(
+    "vyapaar_invoice_cache_events_total",
+    "Invoice response cache lookups and maintenance events",
+    ["event"],
+)
+INVOICE_CACHE_ENTRIES = REGISTRY.gauge(
+    "vyapaar_invoice_cache_entries",
+    "Documents held in the invoice response cache",
+)
+MODEL_TOKENS = REGISTRY.counter(
+    "vyapaar_model_tokens_total",
+    "Model token usage by endpoint and kind (prompt, output, cached, thoughts)",
+    ["endpoint", "kind"],
+)
+MODEL_CONTEXT_CACHE = REGISTRY.counter(
+    "vyapaar_model_context_cache_total",
+    "Provider-side prompt prefix caching by endpoint and event (created, reused, inline, failed, invalidated)",
+    ["endpoint", "event"],
+)
+MODEL_CALLS_IN_FLIGHT = REGISTRY.gauge(
+    "vyapaar_model_calls_in_flight",
+    "Model calls currently running, per endpoint",
+    ["endpoint"],
+)
+HTTP_REQUESTS = REGISTRY.counter(
+    "vyapaar_http_requests_total",
+    "HTTP requests by method, route and status code",
+    ["method", "route", "status"],
+)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "vyapaar_http_request_seconds",
+    "HTTP request latency until the response starts, by route",
+    ["route"],
+)
+HTTP_IN_FLIGHT = REGISTRY.gauge(
+    "vyapaar_http_requests_in_flight",
+    "HTTP requests currently being handled",
+)
+
+_TOKEN_KINDS = {
+    "prompt_token_count": "prompt",
+    "candidates_token_count": "output",
+    "cached_content_token_count": "cached",
+    "thoughts_token_count": "thoughts",
+}
+
+
+def record_token_usage(endpoint: str, usage: Optional[Dict[str, int]]):
+    """Add a ModelResponse.usage dict to the token counters"""
+    for field, kind in _TOKEN_KINDS.items():
+        value = (usage or {}).get(field)
+        if value:
+            MODEL_TOKENS.labels(endpoint, kind).inc(value)
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware counting requests, in-flight requests and latency
+    per route template (so /jobs/{job_id} is one series, not one per job)
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                route = scope.get("route")
+                path = getattr(route, "path", None) or "unmatched"
+                HTTP_REQUEST_SECONDS.labels(path).observe(time.perf_counter() - started)
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUESTS.labels(scope["method"], path, status["code"]).inc()
@@ -0,0 +1,428 @@
+"""
+Model backends used by the invoice and financial agents
+
+Agents talk to a ModelBackend instead of google.genai directly:
+
+  - GeminiBackend: the real API, through the registry's shared client
+  - FakeBackend: offline stand-in returning schema-valid responses after a
+    simulated latency, with injectable errors, for load tests and CI
+
+Select one with MODEL_BACKEND=gemini|fake (default gemini).
+
+generate_stream yields the response as it is produced, one ModelResponse
+per chunk holding the new text; the last chunk carries the token usage.
+
+Both support provider-side context caching: create_cache stores a static
+prompt prefix (system instruction and/or leading contents) and returns a
+CachedPrefix whose name is passed as config["cached_content"]; the request
+then carries only what follows the prefix (see core.context_cache).
+"""
+
+import os
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from dotenv import load_dotenv
+from google.genai import errors, types
+
+from core import fake_responses
+
+# MODEL_BACKEND and the FAKE_MODEL_* knobs may live in .env
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ModelResponse:
+    """Text of a model response plus its token usage"""
+    text: str
+    model: str
+    usage: Dict[str, int] = field(default_factory=dict)
+
+
+@dataclass
+class CachedPrefix:
+    """Handle to a prompt prefix cached by the provider"""
+    name: str
+    model: str
+    token_count: int
+    expires_at: float
+
+
+def usage_from_metadata(metadata) -> Dict[str, int]:
+    """Token counts from a genai usage_metadata object (missing fields dropped)"""
+    if metadata is None:
+        return {}
+    usage = {}
+    for name in (
+        "prompt_token_count",
+        "candidates_token_count",
+        "cached_content_token_count",
+        "thoughts_token_count",
+        "total_token_count",
+    ):
+        value = getattr(metadata, name, None)
+        if value is not None:
+            usage[name] = value
+    return usage
+
+
+class ModelBackend:
+    """
+    Interface: generate content for a model from contents and a config dict
+    """
+    name = "base"
+
+    def generate(self, model: str, contents: Any, config: Optional[Dict[str, Any]] = None) -> ModelResponse:
+        raise NotImplementedError
+
+    async def agenerate(self, model: str, contents: Any, config: Optional[Dict[str, Any]] = None) -> ModelResponse:
+        raise NotImplementedError
+
+    def generate_stream(
+        self, model: str, contents: Any, config: Optional[Dict[str, Any]] = None
+    ) -> Iterator[ModelResponse]:
+        """Response chunks as they arrive (backends without streaming send one chunk)"""
+        yield self.generate(model, contents, config)
+
+    def create_cache(
+        self,
+        model: str,
+        system_instruction: Optional[str] = None,
+        contents: Optional[list] = None,
+        ttl_seconds: float = 3600,
+        display_name: Optional[str] = None,
+    ) -> CachedPrefix:
+        """Cache a prompt prefix with the provider (raises if unsupported)"""
+        raise NotImplementedError
+
+    def delete_cache(self, name: str):
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+
+class GeminiBackend(ModelBackend):
+    """Real Gemini calls through a shared genai.Client"""
+    name = "gemini"
+
+    def __init__(self, client_factory: Callable[[], Any]):
+        """
+        Args:
+            client_factory: Returns the genai.Client to call (looked up per call
+                so a registry swap takes effect immediately)
+        """
+        self._client_factory = client_factory
+
+    def generate(self, model, contents, config=None):
+        response = self._client_factory().models.generate_content(
+            model=model, contents=contents, config=config
+        )
+        return ModelResponse(response.text, model, usage_from_metadata(response.usage_metadata))
+
+    async def agenerate(self, model, contents, config=None):
+        response = await self._client_factory().aio.models.generate_content(
+            model=model, contents=contents, config=config
+        )
+        return ModelResponse(response.text, model, usage_from_metadata(response.usage_metadata))
+
+    def generate_stream(self, model, contents, config=None):
+        stream = self._client_factory().models.generate_content_stream(
+            model=model, contents=contents, config=config
+        )
+        try:
+            for chunk in stream:
+                yield ModelResponse(chunk.text or "", model, usage_from_metadata(chunk.usage_metadata))
+        finally:
+            # Closing this generator early must also release the HTTP response
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+
+    def create_cache(self, model, system_instruction=None, contents=None, ttl_seconds=3600, display_name=None):
+        cache = self._client_factory().caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                system_instruction=system_instruction,
+                contents=contents,
+                ttl=f"{int(ttl_seconds)}s",
+                display_name=display_name,
+            ),
+        )
+        usage = getattr(cache, "usage_metadata", None)
+        return CachedPrefix(
+            name=cache.name,
+            model=model,
+            token_count=getattr(usage, "total_token_count", None) or 0,
+            expires_at=cache.expire_time.timestamp() if cache.expire_time else time.time() + ttl_seconds,
+        )
+
+    def delete_cache(self, name):
+        self._client_factory().caches.delete(name=name)
+
+
+class FakeBackend(ModelBackend):
+    """
+    Offline backend for capacity planning and CI performance tests
+
+    Latency is log-normal around FAKE_MODEL_LATENCY_MS (spread
+    FAKE_MODEL_LATENCY_SIGMA); a FAKE_MODEL_ERROR_RATE fraction of calls raise
+    an APIError with a code drawn from FAKE_MODEL_ERROR_CODES. Responses come
+    from the first responder that recognises the request (see
+    core.fake_responses), and are deterministic for a given input.
+
+    FAKE_MODEL_PREFILL_MS_PER_1K_TOKENS adds latency per 1,000 prompt tokens
+    that are not served from a cached prefix, so the effect of context
+    caching shows up in load tests. FAKE_MODEL_MS_PER_OUTPUT_TOKEN adds
+    decoding time per output token; generate_stream spreads it over chunks
+    of FAKE_MODEL_STREAM_CHUNK_TOKENS, so streaming shows its earlier first
+    chunk.
+    """
+    name = "fake"
+
+    def __init__(
+        self,
+        latency_ms: Optional[float] = None,
+        latency_sigma: Optional[float] = None,
+        error_rate: Optional[float] = None,
+        error_codes: Optional[List[int]] = None,
+        seed: Optional[int] = None,
+        responders: Optional[List[Callable]] = None,
+        prefill_ms_per_1k_tokens: Optional[float] = None,
+        ms_per_output_token: Optional[float] = None,
+        stream_chunk_tokens: Optional[int] = None,
+    ):
+        self.latency_ms = latency_ms if latency_ms is not None else float(os.getenv("FAKE_MODEL_LATENCY_MS", 800))
+        self.latency_sigma = (
+            latency_sigma if latency_sigma is not None else float(os.getenv("FAKE_MODEL_LATENCY_SIGMA", 0.3))
+        )
+        self.error_rate = error_rate if error_rate is not None else float(os.getenv("FAKE_MODEL_ERROR_RATE", 0))
+        self.error_codes = error_codes or [
+            int(code) for code in os.getenv("FAKE_MODEL_ERROR_CODES", "429,503").split(",") if code.strip()
+        ]
+        seed = seed if seed is not None else os.getenv("FAKE_MODEL_SEED")
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self.responders = responders or fake_responses.DEFAULT_RESPONDERS
+        self.prefill_ms_per_1k_tokens = (
+            prefill_ms_per_1k_tokens if prefill_ms_per_1k_tokens is not None
+            else float(os.getenv("FAKE_MODEL_PREFILL_MS_PER_1K_TOKENS", 0))
+        )
+        self.ms_per_output_token = (
+            ms_per_output_token if ms_per_output_token is not None
+            else float(os.getenv("FAKE_MODEL_MS_PER_OUTPUT_TOKEN", 0))
+        )
+        self.stream_chunk_tokens = stream_chunk_tokens or int(os.getenv("FAKE_MODEL_STREAM_CHUNK_TOKENS", 8))
+        self._caches: Dict[str, tuple] = {}
+        self._stats_lock = threading.Lock()
+        self._stats = {"calls": 0, "errors": 0, "caches_created": 0}
+
+    def _draw(self):
+        """(latency seconds, error code or None) for one call"""
+        with self._rng_lock:
+            latency = 0.0
+            if self.latency_ms > 0:
+                latency = self._rng.lognormvariate(0, self.latency_sigma) * self.latency_ms / 1000
+            code = None
+            if self.error_codes and self._rng.random() < self.error_rate:
+                code = self._rng.choice(self.error_codes)
+        with self._stats_lock:
+            self._stats["calls"] += 1
+            if code is not None:
+                self._stats["errors"] += 1
+        return latency, code
+
+    def _resolve(self, model, contents, config):
+        """
+        Expand a cached_content reference into the full request
+
+        Returns:
+            (contents, config, cached prefix tokens)
+        """
+        config = dict(config or {})
+        name = config.pop("cached_content", None)
+        if name is None:
+            return content_parts(contents), config, 0
+        with self._stats_lock:
+            cached = self._caches.get(name)
+        if cached is None or cached[0].expires_at < time.time():
+            raise errors.APIError(404, {"error": {"code": 404, "message": f"Cached content {name} not found"}})
+        prefix, cached_request = cached
+        if prefix.model != model:
+            raise errors.APIError(400, {"error": {"code": 400, "message": "Cached content is for another model"}})
+        if cached_request["system_instruction"] is not None:
+            config["system_instruction"] = cached_request["system_instruction"]
+        return cached_request["contents"] + content_parts(contents), config, prefix.token_count
+
+    def _respond(self, model, contents, config, cached_tokens: int = 0) -> ModelResponse:
+        seed = _request_seed(model, contents)
+        for responder in self.responders:
+            text = responder(contents, config, random.Random(seed))
+            if text is not None:
+                break
+        else:
+            text = "{}"
+        prompt_tokens = _prompt_tokens(contents, config.get("system_instruction"))
+        output_tokens = max(len(text) // 4, 1)
+        usage = {
+            "prompt_token_count": prompt_tokens,
+            "candidates_token_count": output_tokens,
+            "total_token_count": prompt_tokens + output_tokens,
+        }
+        if cached_tokens:
+            usage["cached_content_token_count"] = cached_tokens
+        return ModelResponse(text, model, usage)
+
+    def _prefill_seconds(self, contents, config, cached_tokens: int) -> float:
+        if not self.prefill_ms_per_1k_tokens:
+            return 0.0
+        uncached = _prompt_tokens(contents, config.get("system_instruction")) - cached_tokens
+        return max(uncached, 0) * self.prefill_ms_per_1k_tokens / 1_000_000
+
+    @staticmethod
+    def _error(code: int) -> errors.APIError:
+        return errors.APIError(code, {"error": {"code": code, "message": "Simulated error from fake backend"}})
+
+    def _decode_seconds(self, response: ModelResponse) -> float:
+        return response.usage["candidates_token_count"] * self.ms_per_output_token / 1000
+
+    def generate(self, model, contents, config=None):
+        latency, code = self._draw()
+        contents, config, cached_tokens = self._resolve(model, contents, config)
+        time.sleep(latency + self._prefill_seconds(contents, config, cached_tokens))
+        if code is not None:
+            raise self._error(code)
+        response = self._respond(model, contents, config, cached_tokens)
+        time.sleep(self._decode_seconds(response))
+        return response
+
+    async def agenerate(self, model, contents, config=None):
+        latency, code = self._draw()
+        contents, config, cached_tokens = self._resolve(model, contents, config)
+        await asyncio.sleep(latency + self._prefill_seconds(contents, config, cached_tokens))
+        if code is not None:
+            raise self._error(code)
+        response = self._respond(model, contents, config, cached_tokens)
+        await asyncio.sleep(self._decode_seconds(response))
+        return response
+
+    def generate_stream(self, model, contents, config=None):
+        latency, code = self._draw()
+        contents, config, cached_tokens = self._resolve(model, contents, config)
+        time.sleep(latency + self._prefill_seconds(contents, config, cached_tokens))
+        if code is not None:
+            raise self._error(code)
+        response = self._respond(model, contents, config, cached_tokens)
+        # ~4 characters per token, as in _respond's usage
+        size = self.stream_chunk_tokens * 4
+        chunks = [response.text[i:i + size] for i in range(0, len(response.text), size)] or [""]
+        for i, text in enumerate(chunks):
+            time.sleep(self._decode_seconds(response) * len(text) / max(len(response.text), 1))
+            yield ModelResponse(text, model, response.usage if i == len(chunks) - 1 else {})
+
+    def create_cache(self, model, system_instruction=None, contents=None, ttl_seconds=3600, display_name=None):
+        contents = content_parts(contents) if contents is not None else []
+        token_count = _prompt_tokens(contents, system_instruction)
+        with self._stats_lock:
+            self._stats["caches_created"] += 1
+            # Expired entries are dropped here, as the provider would
+            now = time.time()
+            for name in [name for name, (prefix, _) in self._caches.items() if prefix.expires_at < now]:
+                del self._caches[name]
+            prefix = CachedPrefix(
+                name=f"cachedContents/fake-{self._stats['caches_created']}",
+                model=model,
+                token_count=token_count,
+                expires_at=now + ttl_seconds,
+            )
+            self._caches[prefix.name] = (prefix, {"system_instruction": system_instruction, "contents": contents})
+        return prefix
+
+    def delete_cache(self, name):
+        with self._stats_lock:
+            self._caches.pop(name, None)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats["caches_live"] = len(self._caches)
+        stats.update(
+            backend=self.name,
+            latency_ms=self.latency_ms,
+            latency_sigma=self.latency_sigma,
+            error_rate=self.error_rate,
+            ms_per_output_token=self.ms_per_output_token,
+        )
+        return stats
+
+
+def content_parts(contents) -> list:
+    return contents if isinstance(contents, list) else [contents]
+
+
+def part_bytes(part) -> bytes:
+    """Stable bytes for a content part (text, genai Part or PIL image)"""
+    if isinstance(part, str):
+        return part.encode("utf-8")
+    inline = getattr(part, "inline_data", None)
+    if inline is not None and inline.data is not None:
+        return inline.data
+    if hasattr(part, "tobytes"):
+        return part.tobytes()
+    return repr(part).encode("utf-8")
+
+
+def _request_seed(model: str, contents) -> int:
+    digest = hashlib.sha256(model.encode("utf-8"))
+    for part in content_parts(contents):
+        digest.update(part_bytes(part))
+    return int.from_bytes(digest.digest()[:8], "big")
+
+
+def _token_estimate(part) -> int:
+    if isinstance(part, str):
+        return max(len(part) // 4, 1)
+    # Gemini bills an image at roughly 258 tokens per tile
+    return 258
+
+
+def _prompt_tokens(contents, system_instruction: Optional[str] = None) -> int:
+    tokens = sum(_token_estimate(part) for part in content_parts(contents))
+    if system_instruction:
+        tokens += _token_estimate(system_instruction)
+    return tokens
+
+
+def backend_name() -> str:
+    """Backend selected by MODEL_BACKEND"""
+    return os.getenv("MODEL_BACKEND", "gemini").strip().lower()
+
+
+def requires_api_key() -> bool:
+    """Whether the selected backend needs GEMINI_API_KEY (not when fake or replay-only)"""
+    replay_only = os.getenv("MODEL_CASSETTE_MODE", "off").strip().lower() == "replay"
+    return backend_name() == "gemini" and not replay_only
+
+
+def create_backend(name: str, client_factory: Callable[[], Any]) -> ModelBackend:
+    """
+    Build the backend called name
+
+    Args:
+        name: "gemini" or "fake"
+        client_factory: Supplies the genai.Client for the Gemini backend
+    """
+    if name == "gemini":
+        return GeminiBackend(client_factory)
+    if name == "fake":
+        logger.info("Using the offline fake model backend")
+        return FakeBackend()
+    raise ValueError(f"Unknown MODEL_BACKEND: {name}")
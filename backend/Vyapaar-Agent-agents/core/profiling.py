@@ -0,0 +1,304 @@
+"""
+On-demand CPU profiling for live workers
+
+Two modes, both off unless switched on:
+
+  - Request sampling: a PROFILE_SAMPLE_RATE fraction of calls to endpoints
+    decorated with @profiled run under cProfile. Sync endpoints are profiled
+    in their worker thread; for async endpoints the blocking stages they hand
+    to asyncio.to_thread are profiled through ProfilingExecutor (the event
+    loop thread only interleaves I/O, and profiling it would mix in other
+    requests). Stats are merged per endpoint into PROFILE_DIR/<endpoint>.prof
+    (call graph via snakeviz or gprof2dot) and <endpoint>.txt (top functions
+    by cumulative time, with their callers).
+  - Process window: a sampler walks every thread's stack each
+    PROFILE_INTERVAL_MS for a fixed number of seconds and writes collapsed
+    stacks (window-<time>.folded) for flamegraph.pl or speedscope. Samples
+    are wall-clock; threads parked waiting for work are skipped.
+
+The admin endpoints in app.py require PROFILE_ADMIN_TOKEN and are disabled
+when it is not set.
+"""
+
+import io
+import os
+import sys
+import time
+import pstats
+import random
+import asyncio
+import cProfile
+import hmac
+import inspect
+import logging
+import functools
+import threading
+import contextvars
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+MAX_WINDOW_SECONDS = 300
+# Leaf frames of threads parked waiting for work; dropped from windows
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+
+class EndpointProfile:
+    """cProfile stats merged across the sampled calls of one endpoint"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.requests = 0
+        self._stats: Optional[pstats.Stats] = None
+        self._lock = threading.Lock()
+
+    def add(self, profile: cProfile.Profile):
+        profile.create_stats()
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+
+    def write(self, directory: Path) -> Optional[Dict[str, str]]:
+        """
+        Write <name>.prof and <name>.txt
+
+        Returns:
+            Paths written, or None before the first sample
+        """
+        with self._lock:
+            if self._stats is None:
+                return None
+            directory.mkdir(parents=True, exist_ok=True)
+            prof_path = directory / f"{self.name}.prof"
+            text_path = directory / f"{self.name}.txt"
+            self._stats.dump_stats(str(prof_path))
+
+            report = io.StringIO()
+            self._stats.stream = report
+            report.write(f"{self.name}: {self.requests} sampled requests\n\n")
+            self._stats.sort_stats("cumulative").print_stats(40)
+            self._stats.print_callers(20)
+        text_path.write_text(report.getvalue(), encoding="utf-8")
+        return {"prof": str(prof_path), "text": str(text_path)}
+
+
+_active: ContextVar[Optional[EndpointProfile]] = ContextVar("active_profile", default=None)
+_thread_state = threading.local()
+
+
+def _run_profiled(target: EndpointProfile, fn, *args, **kwargs):
+    """Run fn under cProfile in this thread and merge into target"""
+    if getattr(_thread_state, "busy", False) or sys.getprofile() is not None:
+        # Another profiler owns this thread; do not clobber it
+        return fn(*args, **kwargs)
+    profile = cProfile.Profile()
+    _thread_state.busy = True
+    try:
+        return profile.runcall(fn, *args, **kwargs)
+    finally:
+        _thread_state.busy = False
+        target.add(profile)
+
+
+class ProfilingExecutor(ThreadPoolExecutor):
+    """
+    Default loop executor that profiles asyncio.to_thread work submitted
+    from a sampled request
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        # to_thread submits functools.partial(context.run, func, ...)
+        bound = fn.func if isinstance(fn, functools.partial) else fn
+        context = getattr(bound, "__self__", None)
+        if isinstance(context, contextvars.Context):
+            target = context.get(_active)
+            if target is not None:
+                return super().submit(_run_profiled, target, fn, *args, **kwargs)
+        return super().submit(fn, *args, **kwargs)
+
+
+class Profiler:
+    """
+    Sampling decisions, per-endpoint stats and process windows
+    """
+
+    def __init__(
+        self,
+        sample_rate: Optional[float] = None,
+        directory: Optional[Path] = None,
+        admin_token: Optional[str] = None,
+        interval_ms: Optional[float] = None,
+    ):
+        self.sample_rate = sample_rate if sample_rate is not None else float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+        self.directory = Path(directory or os.getenv("PROFILE_DIR", "profiles"))
+        self.admin_token = admin_token if admin_token is not None else os.getenv("PROFILE_ADMIN_TOKEN", "")
+        self.interval_ms = interval_ms if interval_ms is not None else float(os.getenv("PROFILE_INTERVAL_MS", 5))
+        self._endpoints: Dict[str, EndpointProfile] = {}
+        self._lock = threading.Lock()
+        self._window_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """Whether sampling can happen now or be switched on by an admin"""
+        return self.sample_rate > 0 or bool(self.admin_token)
+
+    def check_token(self, token: Optional[str]) -> bool:
+        return bool(self.admin_token) and token is not None and hmac.compare_digest(token, self.admin_token)
+
+    def set_sample_rate(self, rate: float):
+        if not 0 <= rate <= 1:
+            raise ValueError("Sample rate must be between 0 and 1")
+        self.sample_rate = rate
+        logger.info(f"🔬 Profiling sample rate set to {rate}")
+
+    def should_sample(self) -> bool:
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def endpoint(self, name: str) -> EndpointProfile:
+        target = self._endpoints.get(name)
+        if target is None:
+            with self._lock:
+                target = self._endpoints.setdefault(name, EndpointProfile(name))
+        with self._lock:
+            target.requests += 1
+        return target
+
+    def write(self, target: EndpointProfile):
+        try:
+            target.write(self.directory)
+        except Exception as e:
+            logger.warning(f"Could not write profile for {target.name}: {e}")
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            endpoints = {name: target.requests for name, target in self._endpoints.items()}
+        return {
+            "sample_rate": self.sample_rate,
+            "directory": str(self.directory),
+            "sampled_requests": endpoints,
+            "window_running": self._window_lock.locked(),
+        }
+
+    def sample_window(self, seconds: float) -> Dict[str, Any]:
+        """
+        Sample every thread's stack for a fixed window
+
+        Args:
+            seconds: Window length (capped at MAX_WINDOW_SECONDS)
+
+        Returns:
+            Dict with the folded stacks path, sample counts and the
+            functions most often on top of the stack
+        """
+        seconds = min(max(seconds, 0.1), MAX_WINDOW_SECONDS)
+        if not self._window_lock.acquire(blocking=False):
+            raise RuntimeError("A profiling window is already running")
+        try:
+            interval = self.interval_ms / 1000
+            own = threading.get_ident()
+            stacks: Counter = Counter()
+            leaves: Counter = Counter()
+            ticks = 0
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    leaf = (Path(frame.f_code.co_filename).name, frame.f_code.co_name)
+                    if leaf in IDLE_FRAMES:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    stack.append(names.get(ident, str(ident)))
+                    stacks[";".join(reversed(stack))] += 1
+                    leaves[stack[0]] += 1
+                ticks += 1
+                time.sleep(interval)
+        finally:
+            self._window_lock.release()
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"window-{datetime.now().strftime('%Y%m%d-%H%M%S')}.folded"
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        total = sum(leaves.values())
+        logger.info(f"🔬 Profiling window of {seconds}s written to {path}")
+        return {
+            "path": str(path),
+            "seconds": seconds,
+            "ticks": ticks,
+            "busy_samples": total,
+            "top_functions": [
+                {"function": name, "samples": count, "percent": round(100 * count / total, 1)}
+                for name, count in leaves.most_common(15)
+            ],
+        }
+
+
+_profiler: Optional[Profiler] = None
+
+
+def get_profiler() -> Profiler:
+    """Process-wide profiler, configured from PROFILE_* env vars"""
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler()
+    return _profiler
+
+
+def profiled(name: Optional[str] = None):
+    """
+    Decorator sampling an endpoint under the process profiler
+
+    Args:
+        name: Endpoint name for the output files (defaults to the function name)
+    """
+    def decorate(fn):
+        endpoint = name or fn.__name__
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                profiler = get_profiler()
+                if not profiler.should_sample():
+                    return await fn(*args, **kwargs)
+                target = profiler.endpoint(endpoint)
+                token = _active.set(target)
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    _active.reset(token)
+                    await asyncio.to_thread(profiler.write, target)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            profiler = get_profiler()
+            if not profiler.should_sample():
+                return fn(*args, **kwargs)
+            target = profiler.endpoint(endpoint)
+            try:
+                return _run_profiled(target, fn, *args, **kwargs)
+            finally:
+                profiler.write(target)
+        return wrapper
+    return decorate
@@ -0,0 +1,663 @@
+"""
+Resilient call layer for model requests
+
+Wraps a model call with:
+  - a per-attempt deadline
+  - jittered exponential retry on transient errors (429, 5xx, network, timeout)
+  - a circuit breaker that fails fast while the recent error rate is high
+  - optional hedging: once an attempt runs past the observed p95 latency a
+    duplicate request is started and whichever finishes first wins
+  - streaming (ResilientCaller.stream): the above while opening the stream,
+    then a per-chunk deadline while reading it
+
+Attempts and stream reads that need a deadline run on two separate bounded
+thread pools (RESILIENCE_MAX_THREADS, RESILIENCE_STREAM_THREADS). A full
+pool rejects the call with CallRejectedError rather than queueing it, and
+deadlines run from when an attempt starts, so local overload is never
+mistaken for upstream timeouts by the retry loop or the breaker.
+
+Each endpoint gets its own named ResilientCaller whose CallPolicy can be
+tuned through RESILIENCE_<NAME>_<FIELD> environment variables, e.g.
+RESILIENCE_FINANCIAL_OCR_DEADLINE_SECONDS=45 or RESILIENCE_INVOICE_GENERATE_HEDGE=true.
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, fields, replace
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional
+
+import httpx
+from google.genai import errors
+
+from core.metrics import MODEL_CALLS_IN_FLIGHT, REGISTRY
+from core.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineExceeded(TimeoutError):
+    """A model call attempt ran past its deadline"""
+
+
+class CircuitOpenError(RuntimeError):
+    """The circuit breaker is open; the call was not attempted"""
+
+
+class CallRejectedError(RuntimeError):
+    """Every model-call thread is busy; the call was not attempted"""
+
+
+def is_transient_error(exc: BaseException) -> bool:
+    """True for rate limiting (429), server errors (5xx), network failures and timeouts"""
+    if isinstance(exc, errors.APIError):
+        return exc.code == 429 or (exc.code or 0) >= 500
+    return isinstance(exc, (httpx.TransportError, TimeoutError, asyncio.TimeoutError))
+
+
+@dataclass
+class CallPolicy:
+    """Tuning for one endpoint's model calls"""
+    deadline_seconds: Optional[float] = 60.0  # Per attempt; None = no deadline
+    max_retries: int = 2
+    backoff_base_seconds: float = 0.5
+    backoff_max_seconds: float = 10.0
+    hedge: bool = False
+    hedge_percentile: float = 0.95
+    hedge_min_samples: int = 20
+    latency_window: int = 200
+    breaker_window: int = 20  # Recent attempts the error rate is computed over
+    breaker_min_calls: int = 10
+    breaker_failure_rate: float = 0.5
+    breaker_cooldown_seconds: float = 30.0
+
+    @classmethod
+    def from_env(cls, name: str, **defaults) -> "CallPolicy":
+        """
+        Build a policy from defaults overridden by RESILIENCE_<NAME>_<FIELD> env vars
+        """
+        policy = cls(**defaults)
+        prefix = f"RESILIENCE_{name.upper()}_"
+        overrides = {}
+        for field in fields(cls):
+            raw = os.getenv(prefix + field.name.upper())
+            if raw is None:
+                continue
+            if field.type in (bool, "bool"):
+                overrides[field.name] = raw.strip().lower() in ("1", "true", "yes", "on")
+            elif field.type in (int, "int"):
+                overrides[field.name] = int(raw)
+            elif raw.strip().lower() in ("", "none"):
+                overrides[field.name] = None
+            else:
+                overrides[field.name] = float(raw)
+        return replace(policy, **overrides)
+
+
+@dataclass(frozen=True)
+class Admission:
+    """A call let through by the breaker: the breaker epoch it belongs to and whether it is the probe"""
+    epoch: int
+    probe: bool = False
+
+
+class CircuitBreaker:
+    """
+    Closed -> open when the failure rate over the recent window is too high;
+    open -> half-open after the cooldown, letting one probe call through
+
+    Each open/close starts a new epoch. Outcomes are only counted for calls
+    admitted in the current epoch, so a slow call that started before the
+    breaker opened cannot close or reopen it later.
+    """
+
+    def __init__(self, window: int, min_calls: int, failure_rate: float, cooldown_seconds: float):
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown_seconds = cooldown_seconds
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+        self._epoch = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.cooldown_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> Optional[Admission]:
+        """An Admission if a call may be attempted now, else None"""
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return Admission(self._epoch)
+            if state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return Admission(self._epoch, probe=True)
+            return None
+
+    def record(self, admission: Admission, success: bool):
+        with self._lock:
+            if admission.epoch != self._epoch:
+                # Admitted before the breaker last opened or closed
+                return
+            if self._opened_at is not None:
+                if not admission.probe:
+                    return
+                # Outcome of the half-open probe decides the next state
+                self._probe_in_flight = False
+                self._epoch += 1
+                if success:
+                    self._opened_at = None
+                    self._outcomes.clear()
+                else:
+                    self._opened_at = time.monotonic()
+                return
+
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+                self._opened_at = time.monotonic()
+                self._epoch += 1
+                logger.warning(f"Circuit opened after {failures}/{len(self._outcomes)} failed calls")
+
+    def release(self, admission: Admission):
+        """
+        Hand back a probe that ended without an outcome (e.g. cancelled), so
+        the next call can probe; a no-op once the outcome was recorded
+        """
+        with self._lock:
+            if admission.probe and admission.epoch == self._epoch:
+                self._probe_in_flight = False
+
+
+class ResilientCaller:
+    """
+    Applies a CallPolicy to sync or async model calls and keeps metrics
+    """
+
+    def __init__(self, name: str, policy: CallPolicy):
+        self.name = name
+        self.policy = policy
+        self.breaker = CircuitBreaker(
+            policy.breaker_window,
+            policy.breaker_min_calls,
+            policy.breaker_failure_rate,
+            policy.breaker_cooldown_seconds,
+        )
+        self._latencies = deque(maxlen=policy.latency_window)
+        self._in_flight = MODEL_CALLS_IN_FLIGHT.labels(name)
+        self._lock = threading.Lock()
+        self._metrics = {
+            "calls": 0,
+            "successes": 0,
+            "failures": 0,
+            "retries": 0,
+            "timeouts": 0,
+            "short_circuited": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+            "rejected": 0,
+        }
+
+    # ---------- metrics ----------
+
+    def _count(self, key: str, amount: int = 1):
+        with self._lock:
+            self._metrics[key] += amount
+
+    def _observe(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        """Latency at the given percentile (0-1) over the recent window, in seconds"""
+        with self._lock:
+            if not self._latencies:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(int(percentile * len(ordered)), len(ordered) - 1)]
+
+    def _hedge_delay(self) -> Optional[float]:
+        if not self.policy.hedge:
+            return None
+        with self._lock:
+            if len(self._latencies) < self.policy.hedge_min_samples:
+                return None
+        return self.latency_percentile(self.policy.hedge_percentile)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._metrics)
+        p50 = self.latency_percentile(0.5)
+        p95 = self.latency_percentile(0.95)
+        stats["latency_p50_ms"] = round(p50 * 1000, 1) if p50 is not None else None
+        stats["latency_p95_ms"] = round(p95 * 1000, 1) if p95 is not None else None
+        stats["breaker_state"] = self.breaker.state
+        return stats
+
+    def http_options(self) -> Optional[Dict[str, Any]]:
+        """
+        HTTP options that make the client itself give up at the deadline,
+        so an abandoned attempt does not hold a connection open
+        """
+        if self.policy.deadline_seconds is None:
+            return None
+        return {"timeout": int(self.policy.deadline_seconds * 1000)}
+
+    # ---------- retry loop ----------
+
+    def _backoff(self, attempt: int) -> float:
+        ceiling = min(self.policy.backoff_max_seconds, self.policy.backoff_base_seconds * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+    def _before_attempt(self) -> Admission:
+        admission = self.breaker.allow()
+        if admission is None:
+            self._count("short_circuited")
+            raise CircuitOpenError(f"Circuit open for '{self.name}'; failing fast")
+        return admission
+
+    def _after_failure(self, exc: BaseException, attempt: int, max_retries: int, admission: Admission) -> bool:
+        """Record a failed attempt; True if it should be retried"""
+        transient = is_transient_error(exc)
+        if isinstance(exc, TimeoutError):
+            self._count("timeouts")
+        # Only upstream trouble counts against the breaker; a bad request does not
+        self.breaker.record(admission, not transient)
+        if not transient or attempt >= max_retries:
+            self._count("failures")
+            return False
+        self._count("retries")
+        logger.warning(f"[{self.name}] transient error ({exc}); retry {attempt + 1}/{max_retries}")
+        return True
+
+    def call(
+        self,
+        fn: Callable[[], Any],
+        max_retries: Optional[int] = None,
+        discard: Optional[Callable[[Any], None]] = None,
+    ) -> Any:
+        """
+        Run a blocking call under the policy
+
+        Args:
+            fn: Zero-argument callable making one model request
+            max_retries: Override the policy's retry count
+            discard: Called with the result of an attempt that completes
+                after being abandoned (a losing hedge, or one past its
+                deadline) to release what it holds, e.g. an open stream
+
+        Returns:
+            fn's return value
+        """
+        max_retries = self.policy.max_retries if max_retries is None else max_retries
+        self._count("calls")
+        self._in_flight.inc()
+        with span(f"model_call.{self.name}", endpoint=self.name) as current:
+            attempt = 0
+            try:
+                while True:
+                    admission = self._before_attempt()
+                    started = time.perf_counter()
+                    try:
+                        result = self._attempt(fn, discard)
+                    except CallRejectedError:
+                        # Local overload, not upstream trouble: no retry, no breaker outcome
+                        self._count("rejected")
+                        raise
+                    except Exception as e:
+                        if not self._after_failure(e, attempt, max_retries, admission):
+                            raise
+                        time.sleep(self._backoff(attempt))
+                        attempt += 1
+                        continue
+                    else:
+                        self._observe(time.perf_counter() - started)
+                        self.breaker.record(admission, True)
+                    finally:
+                        # Cancellation skips record(); do not leave the probe slot taken
+                        self.breaker.release(admission)
+                    self._count("successes")
+                    return result
+            finally:
+                current.set_attribute("attempts", attempt + 1)
+                self._in_flight.dec()
+
+    def _attempt(self, fn: Callable[[], Any], discard: Optional[Callable[[Any], None]] = None) -> Any:
+        deadline = self.policy.deadline_seconds
+        hedge_delay = self._hedge_delay()
+        if deadline is None and hedge_delay is None:
+            return fn()
+
+        # A request that outlives its deadline keeps its thread until the HTTP
+        # timeout fires; callers also pass the deadline to the client for that.
+        # The pool never queues, so the deadline runs from when fn starts.
+        task = _Started(fn)
+        primary = _attempt_pool().submit(task)
+        attempts = [primary]
+        pending = {primary}
+        task.started.wait()
+        started = task.at
+        if hedge_delay is not None and (deadline is None or hedge_delay < deadline):
+            done, _ = wait(pending, timeout=hedge_delay)
+            if not done:
+                try:
+                    attempts.append(_attempt_pool().submit(_Started(fn)))
+                    pending.add(attempts[-1])
+                    self._count("hedges")
+                except CallRejectedError:
+                    pass  # No spare thread: keep waiting on the primary alone
+
+        winner = None
+        try:
+            while pending:
+                remaining = None if deadline is None else deadline - (time.monotonic() - started)
+                if remaining is not None and remaining <= 0:
+                    break
+                done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                if not done:
+                    break
+                for future in done:
+                    if future.exception() is None:
+                        if future is not primary:
+                            self._count("hedge_wins")
+                        winner = future
+                        return future.result()
+                    if not pending:
+                        raise future.exception()
+            raise DeadlineExceeded(f"[{self.name}] no response within {deadline}s")
+        finally:
+            for future in attempts:
+                if future is winner:
+                    continue
+                future.cancel()
+                if discard is not None:
+                    future.add_done_callback(lambda f: _discard_result(f, discard))
+
+    def stream(self, open_stream: Callable[[], Iterator[Any]], max_retries: Optional[int] = None) -> Iterator[Any]:
+        """
+        Run a streaming call under the policy, yielding its chunks
+
+        Opening the stream (up to its first chunk) goes through call(), with
+        its retries, breaker and hedging; after that every chunk must arrive
+        within deadline_seconds of the previous one, or DeadlineExceeded is
+        raised. Streams from abandoned attempts are closed, as is this one
+        when the caller stops early, and the in-flight gauge stays raised
+        until the stream ends.
+
+        Args:
+            open_stream: Zero-argument callable starting one streamed request
+            max_retries: Override the policy's retry count
+        """
+        def open_first():
+            chunks = open_stream()
+            try:
+                return next(chunks, _END), chunks
+            except BaseException:
+                _close_stream(chunks)
+                raise
+
+        first, chunks = self.call(open_first, max_retries, discard=lambda opened: _close_stream(opened[1]))
+        deadline = self.policy.deadline_seconds
+        reading: Optional[Future] = None
+        self._in_flight.inc()
+        try:
+            chunk = first
+            while chunk is not _END:
+                yield chunk
+                if deadline is None:
+                    chunk = next(chunks, _END)
+                    continue
+                task = _Started(lambda: next(chunks, _END))
+                try:
+                    reading = _stream_pool().submit(task)
+                except CallRejectedError:
+                    self._count("rejected")
+                    raise
+                task.started.wait()
+                done, _ = wait([reading], timeout=deadline)
+                if not done:
+                    self._count("timeouts")
+                    raise DeadlineExceeded(f"[{self.name}] stream stalled for {deadline}s")
+                chunk = reading.result()
+        finally:
+            self._in_flight.dec()
+            if reading is not None and not reading.done():
+                # A generator cannot be closed while another thread is inside next()
+                reading.add_done_callback(lambda _: _close_stream(chunks))
+            else:
+                _close_stream(chunks)
+
+    async def acall(self, factory: Callable[[], Awaitable[Any]], max_retries: Optional[int] = None) -> Any:
+        """
+        Run an async call under the policy
+
+        Args:
+            factory: Zero-argument callable returning a fresh awaitable per attempt
+            max_retries: Override the policy's retry count
+
+        Returns:
+            The awaited result
+        """
+        max_retries = self.policy.max_retries if max_retries is None else max_retries
+        self._count("calls")
+        self._in_flight.inc()
+        with span(f"model_call.{self.name}", endpoint=self.name) as current:
+            attempt = 0
+            try:
+                while True:
+                    admission = self._before_attempt()
+                    started = time.perf_counter()
+                    try:
+                        result = await self._aattempt(factory)
+                    except Exception as e:
+                        if not self._after_failure(e, attempt, max_retries, admission):
+                            raise
+                        await asyncio.sleep(self._backoff(attempt))
+                        attempt += 1
+                        continue
+                    else:
+                        self._observe(time.perf_counter() - started)
+                        self.breaker.record(admission, True)
+                    finally:
+                        # Cancellation skips record(); do not leave the probe slot taken
+                        self.breaker.release(admission)
+                    self._count("successes")
+                    return result
+            finally:
+                current.set_attribute("attempts", attempt + 1)
+                self._in_flight.dec()
+
+    async def _aattempt(self, factory: Callable[[], Awaitable[Any]]) -> Any:
+        deadline = self.policy.deadline_seconds
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is None:
+            try:
+                return await asyncio.wait_for(factory(), timeout=deadline)
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded(f"[{self.name}] no response within {deadline}s")
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        primary = asyncio.ensure_future(factory())
+        tasks = {primary}
+        try:
+            if deadline is None or hedge_delay < deadline:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+                if not done:
+                    self._count("hedges")
+                    tasks.add(asyncio.ensure_future(factory()))
+
+            while tasks:
+                remaining = None if deadline is None else deadline - (loop.time() - started)
+                if remaining is not None and remaining <= 0:
+                    break
+                done, _ = await asyncio.wait(tasks, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    tasks.discard(task)
+                    if task.exception() is None:
+                        if task is not primary:
+                            self._count("hedge_wins")
+                        return task.result()
+                    if not tasks:
+                        raise task.exception()
+            raise DeadlineExceeded(f"[{self.name}] no response within {deadline}s")
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+_END = object()
+
+
+def _close_stream(chunks: Any):
+    close = getattr(chunks, "close", None)
+    if close is None:
+        return
+    try:
+        close()
+    except Exception as e:
+        logger.debug(f"Closing an abandoned stream failed: {e}")
+
+
+def _discard_result(future: Future, discard: Callable[[Any], None]):
+    """Pass an abandoned attempt's result to discard once it completes"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    try:
+        discard(future.result())
+    except Exception as e:
+        logger.debug(f"Discarding an abandoned attempt failed: {e}")
+
+
+class _Started:
+    """
+    fn wrapped to run in a pool thread, recording when it starts
+
+    Worker threads do not inherit contextvars, so the submitter's context
+    (with the active span) is carried over.
+    """
+
+    def __init__(self, fn: Callable[[], Any]):
+        self.fn = fn
+        self.context = contextvars.copy_context()
+        self.started = threading.Event()
+        self.at = 0.0
+
+    def __call__(self) -> Any:
+        self.at = time.monotonic()
+        self.started.set()
+        return self.context.run(self.fn)
+
+
+class _BoundedPool:
+    """
+    Thread pool that rejects work when every thread is busy instead of
+    queueing it, so queued attempts never burn their deadline waiting
+    """
+
+    def __init__(self, max_workers: int, thread_name_prefix: str):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self.name = thread_name_prefix
+        self.max_workers = max_workers
+
+    def submit(self, fn: Callable[[], Any]) -> Future:
+        if not self._slots.acquire(blocking=False):
+            raise CallRejectedError(f"All {self.max_workers} {self.name} threads are busy")
+        try:
+            future = self._pool.submit(fn)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+
+_pools: Dict[str, _BoundedPool] = {}
+_callers: Dict[str, ResilientCaller] = {}
+_lock = threading.Lock()
+
+
+def _bounded_pool(name: str, env_var: str, default: int) -> _BoundedPool:
+    with _lock:
+        if name not in _pools:
+            _pools[name] = _BoundedPool(int(os.getenv(env_var, default)), name)
+        return _pools[name]
+
+
+def _attempt_pool() -> _BoundedPool:
+    """Threads for blocking call attempts that need a deadline or a hedge"""
+    return _bounded_pool("model-call", "RESILIENCE_MAX_THREADS", 64)
+
+
+def _stream_pool() -> _BoundedPool:
+    """Threads reading streamed chunks under the per-chunk deadline"""
+    return _bounded_pool("model-stream", "RESILIENCE_STREAM_THREADS", 64)
+
+
+def get_caller(name: str, **defaults) -> ResilientCaller:
+    """
+    Named caller for an endpoint, created on first use
+
+    Args:
+        name: Endpoint name, e.g. "financial_ocr"
+        **defaults: CallPolicy defaults for this endpoint (env vars still win)
+    """
+    with _lock:
+        caller = _callers.get(name)
+        if caller is None:
+            caller = ResilientCaller(name, CallPolicy.from_env(name, **defaults))
+            _callers[name] = caller
+        return caller
+
+
+def resilience_stats() -> Dict[str, Dict[str, Any]]:
+    """Metrics for every caller created so far"""
+    with _lock:
+        callers = list(_callers.values())
+    return {caller.name: caller.stats() for caller in callers}
+
+
+def _collect_metrics():
+    """Scrape-time export of every caller's counters for /metrics"""
+    stats = resilience_stats()
+    counters = {
+        "calls": "Model calls started",
+        "successes": "Model calls that returned a response",
+        "failures": "Model calls that failed after all retries",
+        "retries": "Retries after transient model errors",
+        "timeouts": "Model call attempts that hit their deadline",
+        "short_circuited": "Model calls rejected by an open circuit breaker",
+        "hedges": "Hedged duplicate model requests started",
+        "hedge_wins": "Hedged requests that finished first",
+    }
+    for key, documentation in counters.items():
+        yield (
+            f"vyapaar_model_call_{key}_total", "counter", documentation,
+            [({"endpoint": name}, values[key]) for name, values in stats.items()],
+        )
+    yield (
+        "vyapaar_model_circuit_open", "gauge", "1 while the endpoint's circuit breaker is open or half-open",
+        [({"endpoint": name}, int(values["breaker_state"] != "closed")) for name, values in stats.items()],
+    )
+
+
+REGISTRY.register_collector(_collect_metrics)
@@ -0,0 +1,405 @@
+"""
+Request-scoped tracing
+
+Spans are kept in a contextvar, so nesting follows the call stack and
+survives asyncio tasks and asyncio.to_thread. The API middleware opens one
+root span per request (reusing an incoming W3C traceparent or X-Trace-Id)
+and returns the id in the X-Trace-Id response header; pipeline functions
+open child spans with the span() context manager or the @traced decorator.
+
+Finished spans are exported off the request path by a background thread:
+
+  TRACE_EXPORTER=off|jsonl|otlp  (default off: spans cost one contextvar read)
+  TRACE_JSONL_PATH               JSONL file, one span per line
+  TRACE_OTLP_ENDPOINT            OTLP/HTTP JSON collector, e.g. http://localhost:4318/v1/traces
+  TRACE_SAMPLE_RATE              Fraction of new traces recorded (default 1.0)
+
+`python -m core.tracing show <trace_id>` prints a recorded trace as a tree.
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import inspect
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "vyapaar-agents"
+
+
+class Span:
+    """One timed operation within a trace"""
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start", "end", "attributes", "status", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.attributes = attributes
+        self.status = "ok"
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        return round((self.end - self.start) * 1000, 3) if self.end is not None else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "end": self.end,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    """Stand-in while tracing is off or the trace was not sampled"""
+    trace_id = None
+    span_id = None
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+_current: ContextVar[Optional[Any]] = ContextVar("current_span", default=None)
+
+
+# ---------- exporters ----------
+
+class SpanExporter:
+    """
+    Buffers finished spans and flushes them from a daemon thread
+    """
+
+    def __init__(self, flush_interval: float = 1.0, max_batch: int = 512):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._queue: "queue.SimpleQueue[Optional[Span]]" = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
+
+    def export(self, span: Span):
+        self._queue.put(span)
+
+    def _run(self):
+        while True:
+            batch: List[Span] = []
+            stop = False
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+                if item is None:
+                    stop = True
+                else:
+                    batch.append(item)
+                while len(batch) < self.max_batch:
+                    item = self._queue.get_nowait()
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+            except queue.Empty:
+                pass
+            if batch:
+                try:
+                    self.write(batch)
+                except Exception as e:
+                    logger.warning(f"Dropped {len(batch)} spans: {e}")
+            if stop:
+                return
+
+    def shutdown(self):
+        """Flush what is buffered and stop the thread"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+    def write(self, spans: List[Span]):
+        raise NotImplementedError
+
+
+class JsonlExporter(SpanExporter):
+    """Appends spans to a local JSONL file"""
+
+    def __init__(self, path: Path, **kwargs):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        super().__init__(**kwargs)
+
+    def write(self, spans):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for span in spans:
+                f.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n")
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OtlpExporter(SpanExporter):
+    """Posts spans to an OTLP/HTTP collector using the JSON encoding"""
+
+    def __init__(self, endpoint: str, **kwargs):
+        self.endpoint = endpoint
+        self._client = httpx.Client(timeout=5.0)
+        super().__init__(**kwargs)
+
+    def write(self, spans):
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+                "scopeSpans": [{
+                    "scope": {"name": "core.tracing"},
+                    "spans": [
+                        {
+                            "traceId": span.trace_id,
+                            "spanId": span.span_id,
+                            "parentSpanId": span.parent_id or "",
+                            "name": span.name,
+                            "kind": 1,
+                            "startTimeUnixNano": str(int(span.start * 1e9)),
+                            "endTimeUnixNano": str(int(span.end * 1e9)),
+                            "attributes": [
+                                {"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()
+                            ],
+                            "status": {"code": 2, "message": span.error or ""} if span.status == "error" else {"code": 1},
+                        }
+                        for span in spans
+                    ],
+                }],
+            }]
+        }
+        self._client.post(self.endpoint, json=payload).raise_for_status()
+
+
+_exporter: Optional[SpanExporter] = None
+_exporter_loaded = False
+_exporter_lock = threading.Lock()
+_sample_rate = 1.0
+
+
+def get_exporter() -> Optional[SpanExporter]:
+    """Exporter built from TRACE_* env vars on first use (None when off)"""
+    global _exporter, _exporter_loaded, _sample_rate
+    if _exporter_loaded:
+        return _exporter
+    with _exporter_lock:
+        if not _exporter_loaded:
+            kind = os.getenv("TRACE_EXPORTER", "off").strip().lower()
+            _sample_rate = float(os.getenv("TRACE_SAMPLE_RATE", 1.0))
+            if kind == "jsonl":
+                _exporter = JsonlExporter(Path(os.getenv("TRACE_JSONL_PATH", "traces/spans.jsonl")))
+            elif kind == "otlp":
+                _exporter = OtlpExporter(os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces"))
+            elif kind not in ("", "off"):
+                raise ValueError(f"Unknown TRACE_EXPORTER: {kind}")
+            _exporter_loaded = True
+    return _exporter
+
+
+def set_exporter(exporter: Optional[SpanExporter], sample_rate: float = 1.0):
+    """Install an exporter directly (None turns tracing off)"""
+    global _exporter, _exporter_loaded, _sample_rate
+    with _exporter_lock:
+        _exporter, _exporter_loaded, _sample_rate = exporter, True, sample_rate
+
+
+# ---------- spans ----------
+
+def current_trace_id() -> Optional[str]:
+    """Trace id of the active span, if any"""
+    active = _current.get()
+    return active.trace_id if active is not None else None
+
+
+def annotate(**attributes):
+    """Set attributes on the active span (no-op when not recording)"""
+    active = _current.get()
+    if active is not None and active is not NOOP_SPAN:
+        active.attributes.update(attributes)
+
+
+@contextmanager
+def span(name: str, trace_id: Optional[str] = None, **attributes):
+    """
+    Time a block as a child of the active span
+
+    Without an active span a new trace is started (subject to sampling),
+    using trace_id when one is supplied, e.g. from an incoming header.
+
+    Yields:
+        The Span, or a no-op stand-in when not recording
+    """
+    parent = _current.get()
+    if parent is NOOP_SPAN:
+        yield NOOP_SPAN
+        return
+
+    exporter = get_exporter()
+    if exporter is None:
+        yield NOOP_SPAN
+        return
+
+    if parent is None:
+        if trace_id is None and random.random() >= _sample_rate:
+            token = _current.set(NOOP_SPAN)
+            try:
+                yield NOOP_SPAN
+            finally:
+                _current.reset(token)
+            return
+        current = Span(name, trace_id or f"{random.getrandbits(128):032x}", None, attributes)
+    else:
+        current = Span(name, parent.trace_id, parent.span_id, attributes)
+
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = "error"
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.end = time.time()
+        _current.reset(token)
+        exporter.export(current)
+
+
+def traced(name: Optional[str] = None):
+    """Decorator running a sync or async function inside span(name)"""
+    def decorate(fn):
+        span_name = name or f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__name__}"
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _incoming_trace_id(headers: Dict[bytes, bytes]) -> Optional[str]:
+    traceparent = headers.get(b"traceparent")
+    if traceparent:
+        parts = traceparent.decode("latin-1").split("-")
+        if len(parts) == 4 and len(parts[1]) == 32:
+            return parts[1]
+    trace_id = headers.get(b"x-trace-id")
+    return trace_id.decode("latin-1") if trace_id else None
+
+
+class TracingMiddleware:
+    """
+    Pure ASGI middleware opening the root span of each HTTP request
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or get_exporter() is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        with span(
+            f"{scope['method']} {scope['path']}",
+            trace_id=_incoming_trace_id(headers),
+            **{"http.method": scope["method"], "http.target": scope["path"]}
+        ) as root:
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start" and root.trace_id:
+                    root.set_attribute("http.status_code", message["status"])
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"x-trace-id", root.trace_id.encode("latin-1"))
+                    ]
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+            route = scope.get("route")
+            if root is not NOOP_SPAN and getattr(route, "path", None):
+                root.name = f"{scope['method']} {route.path}"
+
+
+# ---------- viewer ----------
+
+def _print_tree(spans: List[Dict[str, Any]]):
+    children: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    ids = {s["span_id"] for s in spans}
+    for s in sorted(spans, key=lambda s: s["start"]):
+        parent = s["parent_id"] if s["parent_id"] in ids else None
+        children.setdefault(parent, []).append(s)
+    origin = min(s["start"] for s in spans)
+
+    def walk(parent_id, depth):
+        for s in children.get(parent_id, []):
+            offset = (s["start"] - origin) * 1000
+            flag = f"  ❌ {s['error']}" if s["status"] == "error" else ""
+            attrs = {k: v for k, v in s["attributes"].items() if not k.startswith("http.")}
+            extra = f"  {attrs}" if attrs else ""
+            print(f"{'  ' * depth}{s['name']}  {s['duration_ms']:.1f}ms  (+{offset:.1f}ms){extra}{flag}")
+            walk(s["span_id"], depth + 1)
+
+    walk(None, 0)
+
+
+def main(argv: List[str]):
+    if len(argv) < 2 or argv[0] != "show":
+        print("Usage: python -m core.tracing show <trace_id> [spans.jsonl]")
+        return 1
+    trace_id = argv[1]
+    path = Path(argv[2] if len(argv) > 2 else os.getenv("TRACE_JSONL_PATH", "traces/spans.jsonl"))
+    spans = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record["trace_id"] == trace_id:
+                spans.append(record)
+    if not spans:
+        print(f"No spans for trace {trace_id} in {path}")
+        return 1
+    _print_tree(spans)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -4,6 +4,8 @@ Command Line Interface for Financial Document Agent
 """
 
 import argparse
+import multiprocessing
+import signal
 import sys
 from pathlib import Path
 from tabulate import tabulate
@@ -12,8 +14,10 @@ from tabulate import tabulate
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from financial_analyser.miscFiles.financial_agent import FinancialDocumentAgent
-from financial_analyser.miscFiles.utils import format_currency, generate_summary_report
+from financial_analyser.miscFiles.utils import format_currency, format_summary_report, SummaryAccumulator
 from financial_analyser.miscFiles.config import settings
+from financial_analyser.miscFiles.batch_manifest import BatchManifest
+from core.memory import get_memory_monitor
 
 
 def process_single(args):
@@ -69,9 +73,27 @@ def process_single(args):
     print("\n💾 JSON output saved automatically to `outputs/` directory\n")
 
 
+def print_progress(done: int, total: int, failed: int, elapsed: float):
+    """Single-line live throughput display for batch runs"""
+    rate = done / elapsed if elapsed > 0 else 0.0
+    eta = (total - done) / rate if rate > 0 else 0.0
+    sys.stdout.write(
+        f"\r⏳ {done}/{total} done • {rate:.2f} img/s • {failed} failed • ETA {eta:.0f}s   "
+    )
+    sys.stdout.flush()
+
+
 def process_batch(args):
     agent = FinancialDocumentAgent()
 
+    manifest = None
+    if args.resume:
+        try:
+            manifest = BatchManifest.load(args.resume)
+        except FileNotFoundError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+
     # Collect images
     if args.directory:
         image_dir = Path(args.directory)
@@ -82,20 +104,71 @@ def process_batch(args):
         images = []
         for ext in settings.SUPPORTED_FORMATS:
             images.extend(image_dir.glob(f"*.{ext}"))
-    else:
+    elif args.images:
         images = [Path(p) for p in args.images]
+    elif manifest is not None:
+        images = [Path(p) for p in manifest.files()]
+    else:
+        print("❌ Provide --directory, --images or --resume")
+        sys.exit(1)
 
     if not images:
         print("❌ No images found to process")
         return
 
-    print(f"📂 Processing {len(images)} images...\n")
+    if manifest is None:
+        manifest = BatchManifest.create(images)
+
+    workers = args.workers or settings.BATCH_WORKERS
+    action = "Resuming" if args.resume else "Processing"
+    print(f"📂 {action} {len(images)} images with {workers} workers (run {manifest.run_id})...\n")
 
-    results = agent.batch_process(images)
+    summary = SummaryAccumulator()
+    for _, result in agent.iter_batch(images, workers=workers, progress=print_progress, manifest=manifest):
+        summary.add(result)
+    print()
 
-    print("\n" + generate_summary_report(results))
+    print("\n" + format_summary_report(summary.summary()))
     print("\n💾 Individual JSON files saved to `outputs/`")
-    print("💾 Batch summary saved to `logs/`\n")
+    print(f"💾 Batch results saved to {manifest.path}")
+    print(f"↩️  Resume with: cli.py batch --resume {manifest.run_id}\n")
+
+
+def _worker_process(poll_interval, stop_event):
+    from financial_analyser.miscFiles.job_queue import run_worker
+
+    # Ctrl+C reaches the whole process group; let the parent stop us cleanly
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    run_worker(poll_interval=poll_interval, stop_event=stop_event)
+
+
+def run_workers(args):
+    count = max(args.processes, 1)
+    print(f"👷 Starting {count} OCR worker process(es) on {settings.JOBS_DIR}")
+    print("Press Ctrl+C to stop\n")
+
+    stop_event = multiprocessing.Event()
+    workers = [
+        multiprocessing.Process(
+            target=_worker_process,
+            args=(args.poll_interval, stop_event),
+            name=f"ocr-worker-{i}",
+        )
+        for i in range(count)
+    ]
+    for worker in workers:
+        worker.start()
+
+    def stop(signum, frame):
+        print("\n🛑 Stopping workers (finishing in-flight jobs)...")
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for worker in workers:
+        worker.join()
 
 
 def main():
@@ -103,6 +176,11 @@ def main():
         description="Financial Document AI Agent – Extract structured data from receipts & UPI screenshots"
     )
 
+    parser.add_argument(
+        "--memory-profile", action="store_true",
+        help="Trace allocations with tracemalloc and print a per-stage memory report on exit"
+    )
+
     subparsers = parser.add_subparsers(dest="command")
 
     # Single image
@@ -111,9 +189,25 @@ def main():
 
     # Batch
     batch_parser = subparsers.add_parser("batch", help="Process multiple images")
-    batch_group = batch_parser.add_mutually_exclusive_group(required=True)
+    batch_group = batch_parser.add_mutually_exclusive_group()
     batch_group.add_argument("--directory", "-d", help="Directory containing images")
     batch_group.add_argument("--images", "-i", nargs="+", help="List of image paths")
+    batch_parser.add_argument(
+        "--workers", "-w", type=int, default=None,
+        help=f"Images processed concurrently (default: {settings.BATCH_WORKERS})"
+    )
+    batch_parser.add_argument(
+        "--resume", "-r", metavar="RUN_ID",
+        help="Resume a batch run, skipping images that already succeeded"
+    )
+
+    # Queue workers
+    worker_parser = subparsers.add_parser("worker", help="Run OCR job queue workers")
+    worker_parser.add_argument("--processes", "-p", type=int, default=1, help="Number of worker processes")
+    worker_parser.add_argument(
+        "--poll-interval", type=float, default=settings.JOB_POLL_INTERVAL_SECONDS,
+        help="Seconds to wait when the queue is empty"
+    )
 
     args = parser.parse_args()
 
@@ -121,10 +215,22 @@ def main():
         parser.print_help()
         sys.exit(1)
 
-    if args.command == "process":
-        process_single(args)
-    elif args.command == "batch":
-        process_batch(args)
+    memory = get_memory_monitor()
+    if args.memory_profile:
+        memory.start()
+    memory.checkpoint("start")
+
+    try:
+        if args.command == "process":
+            process_single(args)
+        elif args.command == "batch":
+            process_batch(args)
+        elif args.command == "worker":
+            run_workers(args)
+    finally:
+        if memory.enabled:
+            memory.checkpoint("end")
+            print("\n" + memory.format_report())
 
 
 if __name__ == "__main__":
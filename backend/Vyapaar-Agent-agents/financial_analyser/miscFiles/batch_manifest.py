@@ -0,0 +1,116 @@
+"""
+Checkpoint manifest for resumable batch runs
+
+Every batch run gets a directory under LOGS_DIR/runs/<run_id>/ with:
+  run.json        - the input file list, written when the run starts
+  manifest.jsonl  - one line per finished image, appended as it completes
+
+Resuming a run skips images whose path and content hash already have a
+successful entry, so a crash at image 800 of 1,000 only re-bills the rest.
+"""
+
+import json
+import uuid
+import hashlib
+import threading
+from pathlib import Path
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from financial_analyser.miscFiles.config import settings
+
+
+def file_sha256(data: bytes) -> str:
+    """SHA-256 of file contents"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class BatchManifest:
+    """
+    Append-only record of per-image outcomes for one batch run
+    """
+
+    def __init__(self, run_id: str, runs_dir: Optional[Path] = None):
+        self.run_id = run_id
+        self.run_dir = Path(runs_dir or settings.LOGS_DIR / "runs") / run_id
+        self.path = self.run_dir / "manifest.jsonl"
+        self._lock = threading.Lock()
+        # (file, sha256) -> byte offset of its success line; results are
+        # re-read on demand so memory does not grow with the run size
+        self._completed: Dict[Tuple[str, str], int] = {}
+
+    @classmethod
+    def create(cls, files: List, runs_dir: Optional[Path] = None) -> "BatchManifest":
+        """
+        Start a new run
+
+        Args:
+            files: Input image paths, stored so the run can be resumed later
+        """
+        run_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        manifest = cls(run_id, runs_dir)
+        manifest.run_dir.mkdir(parents=True, exist_ok=True)
+        with open(manifest.run_dir / "run.json", "w", encoding="utf-8") as f:
+            json.dump({
+                "run_id": run_id,
+                "created_at": datetime.now().isoformat(),
+                "files": [str(p) for p in files]
+            }, f, indent=2)
+        manifest.path.touch()
+        return manifest
+
+    @classmethod
+    def load(cls, run_id: str, runs_dir: Optional[Path] = None) -> "BatchManifest":
+        """
+        Reopen an existing run, reading back the entries written so far
+
+        Raises:
+            FileNotFoundError: If the run does not exist
+        """
+        manifest = cls(run_id, runs_dir)
+        if not manifest.path.exists():
+            raise FileNotFoundError(f"No batch run found: {run_id}")
+
+        with open(manifest.path, "rb") as f:
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn last line from a crash mid-write
+                    continue
+                # Failures are not kept: they are retried on resume
+                if entry["status"] == "success" and entry.get("sha256"):
+                    manifest._completed[(entry["file"], entry["sha256"])] = offset
+        return manifest
+
+    def files(self) -> List[str]:
+        """Input file list recorded when the run was created"""
+        with open(self.run_dir / "run.json", encoding="utf-8") as f:
+            return json.load(f)["files"]
+
+    def completed_result(self, file: str, sha256: str) -> Optional[Dict[str, Any]]:
+        """Stored result for an image that already succeeded in this run"""
+        offset = self._completed.get((file, sha256))
+        if offset is None:
+            return None
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.readline())["result"]
+
+    def record(self, file: str, sha256: Optional[str], result: Dict[str, Any]):
+        """Append the outcome for one image and flush it to disk"""
+        entry = {
+            "file": file,
+            "sha256": sha256,
+            "status": result.get("status"),
+            "finished_at": datetime.now().isoformat(),
+            "result": result
+        }
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
@@ -0,0 +1,282 @@
+"""
+Content-addressed cache for extraction results
+
+Results are keyed on the SHA-256 of the image bytes plus the prompt version
+and model name, so a re-forwarded screenshot is answered without a model
+call while any prompt or model change naturally misses. Two tiers: an
+in-process LRU in front of a SQLite table shared by every worker.
+"""
+
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from PIL import Image
+
+from financial_analyser.miscFiles.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(image: Union[bytes, Image.Image]) -> str:
+    """
+    SHA-256 of the image content
+
+    Args:
+        image: Raw file bytes, or a decoded PIL image
+
+    Returns:
+        Hex digest
+    """
+    if isinstance(image, Image.Image):
+        digest = hashlib.sha256(f"{image.mode}:{image.size}".encode())
+        digest.update(image.tobytes())
+        return digest.hexdigest()
+    return hashlib.sha256(image).hexdigest()
+
+
+def make_cache_key(image_hash: str, prompt_version: str, model_name: str) -> str:
+    """Combine image hash, prompt version and model into one cache key"""
+    return hashlib.sha256(f"{image_hash}|{prompt_version}|{model_name}".encode()).hexdigest()
+
+
+class ExtractionCache:
+    """
+    Two-tier (memory LRU + SQLite) store for successful extraction results
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[Path] = None,
+        memory_items: int = 1024,
+        ttl_seconds: float = 7 * 24 * 3600,
+        max_disk_entries: int = 100_000,
+    ):
+        """
+        Args:
+            db_path: SQLite file for the persistent tier (None = memory only)
+            memory_items: Maximum entries kept in the LRU tier
+            ttl_seconds: Age after which an entry is treated as missing
+            max_disk_entries: Oldest-accessed entries beyond this are evicted
+        """
+        self.memory_items = memory_items
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_entries = max_disk_entries
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._removal_listeners: List[Callable[[List[str]], None]] = []
+        self._removed: List[str] = []  # Removed keys not yet passed to the listeners
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "expired": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+        }
+
+        self.db_path = Path(db_path) if db_path else None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._disk_count = 0
+        if self.db_path:
+            self._open_db()
+
+    def _open_db(self):
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS extraction_cache (
+                key TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_extraction_cache_access ON extraction_cache(last_access)"
+        )
+        self._conn.commit()
+        self._disk_count = self._conn.execute("SELECT COUNT(*) FROM extraction_cache").fetchone()[0]
+
+    def add_removal_listener(self, callback: Callable[[List[str]], None]):
+        """
+        Call callback(keys) whenever entries expire or are evicted for good
+
+        An entry leaving only the memory tier is not removed while the disk
+        tier still holds it.
+        """
+        with self._lock:
+            if callback not in self._removal_listeners:
+                self._removal_listeners.append(callback)
+
+    def _notify_removed(self, keys: List[str]):
+        """Tell listeners about removed keys (caller must not hold the lock)"""
+        if not keys:
+            return
+        for callback in list(self._removal_listeners):
+            try:
+                callback(keys)
+            except Exception as e:
+                logger.warning(f"Cache removal listener failed: {e}")
+
+    def get(self, key: str) -> Optional[Tuple[Dict[str, Any], str]]:
+        """
+        Look up a cached entry
+
+        Returns:
+            (entry, tier) where tier is "memory" or "disk", or None on a miss
+        """
+        hit = self._get(key)
+        if hit is None:
+            self._notify_removed(self._pending_removals())
+        return hit
+
+    def _get(self, key: str) -> Optional[Tuple[Dict[str, Any], str]]:
+        now = time.time()
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None:
+                created_at, entry = cached
+                if now - created_at <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return entry, "memory"
+                del self._memory[key]
+                self._stats["expired"] += 1
+                if self._conn is None:
+                    self._removed.append(key)
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT payload, created_at FROM extraction_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    payload, created_at = row
+                    if now - created_at <= self.ttl_seconds:
+                        self._conn.execute(
+                            "UPDATE extraction_cache SET last_access = ? WHERE key = ?", (now, key)
+                        )
+                        self._conn.commit()
+                        entry = json.loads(payload)
+                        self._remember(key, created_at, entry)
+                        self._stats["disk_hits"] += 1
+                        return entry, "disk"
+                    self._conn.execute("DELETE FROM extraction_cache WHERE key = ?", (key,))
+                    self._conn.commit()
+                    self._disk_count -= 1
+                    self._stats["expired"] += 1
+                    self._removed.append(key)
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key: str, entry: Dict[str, Any]):
+        """Store an entry in both tiers"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, entry)
+            self._stats["stores"] += 1
+
+            if self._conn is not None:
+                # A replaced row must not count twice, or eviction starts early
+                exists = self._conn.execute(
+                    "SELECT 1 FROM extraction_cache WHERE key = ?", (key,)
+                ).fetchone() is not None
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO extraction_cache (key, payload, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(entry, ensure_ascii=False), now, now),
+                )
+                if not exists:
+                    self._disk_count += 1
+                if self._disk_count > self.max_disk_entries:
+                    self._evict_disk(now)
+                self._conn.commit()
+        self._notify_removed(self._pending_removals())
+
+    def _pending_removals(self) -> List[str]:
+        with self._lock:
+            removed, self._removed = self._removed, []
+            return removed
+
+    def _remember(self, key: str, created_at: float, entry: Dict[str, Any]):
+        """Insert into the LRU tier (caller holds the lock)"""
+        self._memory[key] = (created_at, entry)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            evicted, _ = self._memory.popitem(last=False)
+            self._stats["memory_evictions"] += 1
+            if self._conn is None:
+                self._removed.append(evicted)
+
+    def _evict_disk(self, now: float):
+        """Drop expired rows, then the least recently used ones (caller holds the lock)"""
+        expired = [
+            key for (key,) in self._conn.execute(
+                "SELECT key FROM extraction_cache WHERE created_at < ?", (now - self.ttl_seconds,)
+            )
+        ]
+        self._delete_rows(expired)
+        self._disk_count = self._conn.execute("SELECT COUNT(*) FROM extraction_cache").fetchone()[0]
+
+        # Evict an extra 10% so we are not back here on the next insert
+        overflow = self._disk_count - int(self.max_disk_entries * 0.9)
+        if overflow > 0:
+            evicted = [
+                key for (key,) in self._conn.execute(
+                    "SELECT key FROM extraction_cache ORDER BY last_access LIMIT ?", (overflow,)
+                )
+            ]
+            self._delete_rows(evicted)
+            self._disk_count -= len(evicted)
+            self._stats["disk_evictions"] += len(evicted)
+
+    def _delete_rows(self, keys: List[str]):
+        """Delete keys from both tiers and queue them for the listeners (caller holds the lock)"""
+        self._conn.executemany("DELETE FROM extraction_cache WHERE key = ?", [(key,) for key in keys])
+        for key in keys:
+            self._memory.pop(key, None)
+        self._removed.extend(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and tier sizes"""
+        with self._lock:
+            stats = dict(self._stats)
+            lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+            stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+            stats["memory_entries"] = len(self._memory)
+            stats["disk_entries"] = self._disk_count
+            return stats
+
+
+_cache: Optional[ExtractionCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_extraction_cache() -> Optional[ExtractionCache]:
+    """Process-wide cache built from settings (None when disabled)"""
+    global _cache
+    if not settings.OCR_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ExtractionCache(
+                db_path=settings.OCR_CACHE_DB_PATH or settings.CACHE_DIR / "extractions.sqlite3",
+                memory_items=settings.OCR_CACHE_MEMORY_ITEMS,
+                ttl_seconds=settings.OCR_CACHE_TTL_SECONDS,
+                max_disk_entries=settings.OCR_CACHE_MAX_DISK_ENTRIES,
+            )
+            logger.info(f"Extraction cache opened at {_cache.db_path}")
+        return _cache
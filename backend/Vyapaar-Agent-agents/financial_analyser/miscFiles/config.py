@@ -7,6 +7,8 @@ from pathlib import Path
 from pydantic_settings import BaseSettings
 from typing import Optional
 
+from core.model_backend import requires_api_key
+
 
 class Settings(BaseSettings):
     """
@@ -28,14 +30,50 @@ class Settings(BaseSettings):
     UPLOAD_DIR: Path = BASE_DIR / "uploads"
     LOGS_DIR: Path = BASE_DIR / "logs"
     OUTPUT_DIR: Path = BASE_DIR / "outputs"
+    CACHE_DIR: Path = BASE_DIR / "cache"
+    JOBS_DIR: Path = BASE_DIR / "jobs"  # Use a shared volume for multi-host workers
     
     # Processing settings
     MAX_IMAGE_SIZE_MB: int = 10
+    OCR_INMEMORY_UPLOAD_LIMIT_MB: int = 8  # Larger uploads spill to a spool file
     SUPPORTED_FORMATS: list = ["jpg", "jpeg", "png", "webp", "heic", "heif"]
+    OCR_MAX_CONCURRENCY: int = 32  # Async model calls in flight per agent
+    OCR_BATCH_CONCURRENCY: int = 8  # Files processed at once per batch request
+    OCR_BATCH_MAX_FILES: int = 50
+    
+    # Extraction result cache
+    OCR_CACHE_ENABLED: bool = True
+    OCR_CACHE_MEMORY_ITEMS: int = 1024
+    OCR_CACHE_DB_PATH: Optional[Path] = None  # Defaults to CACHE_DIR/extractions.sqlite3
+    OCR_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    OCR_CACHE_MAX_DISK_ENTRIES: int = 100_000
+    
+    # Near-duplicate detection: "off", "flag" (call the model, mark the match)
+    # or "serve" (reuse the earlier extraction without a model call, only when
+    # a same-size image passes the thumbnail comparison; otherwise flag)
+    OCR_NEAR_DUPLICATE_MODE: str = "flag"
+    OCR_NEAR_DUPLICATE_DISTANCE: int = 4  # Max differing bits out of 64
+    OCR_NEAR_DUPLICATE_MAX_TILE_DIFF: int = 12  # Max mean grey-level change of any 4x4 thumbnail tile when serving
+    
+    # Pre-processing before the model call
+    OCR_PREPROCESS_ENABLED: bool = True
+    OCR_PREPROCESS_MAX_EDGE: int = 1600  # Target long edge in pixels
+    OCR_PREPROCESS_GRAYSCALE: bool = False
+    OCR_PREPROCESS_FORMAT: str = "JPEG"  # JPEG or WEBP
+    OCR_PREPROCESS_QUALITY: int = 85
+    
+    # Durable job queue
+    JOB_QUEUE_DB_PATH: Optional[Path] = None  # Defaults to JOBS_DIR/queue.sqlite3
+    JOB_LEASE_SECONDS: float = 120.0
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_RETRY_DELAY_SECONDS: float = 10.0
+    JOB_POLL_INTERVAL_SECONDS: float = 1.0
     
     # Batch processing
-    BATCH_SIZE: int = 10
-    BATCH_DELAY_SECONDS: float = 0.5  # Delay between requests
+    BATCH_SIZE: int = 10  # Burst size of the batch rate limiter
+    BATCH_DELAY_SECONDS: float = 0.5  # Delay between requests (0 = unthrottled)
+    BATCH_WORKERS: int = 4
+    BATCH_MAX_RETRIES: int = 4  # Retries on 429/5xx/timeouts per image (backoff per RESILIENCE_FINANCIAL_OCR_*)
     
     # Logging
     LOG_LEVEL: str = "INFO"
@@ -55,6 +93,7 @@ class Settings(BaseSettings):
         self.UPLOAD_DIR.mkdir(exist_ok=True)
         self.LOGS_DIR.mkdir(exist_ok=True)
         self.OUTPUT_DIR.mkdir(exist_ok=True)
+        self.CACHE_DIR.mkdir(exist_ok=True)
 
 
 # Global settings instance
@@ -66,7 +105,7 @@ def validate_settings():
     """Validate that required settings are configured"""
     errors = []
     
-    if not settings.GEMINI_API_KEY:
+    if requires_api_key() and not settings.GEMINI_API_KEY:
         errors.append("GEMINI_API_KEY not set in .env file")
     
     if errors:
@@ -4,23 +4,53 @@ Extracts structured data from UPI screenshots, bills, and invoices
 """
 
 from google import genai
+from google.genai import types
 from PIL import Image
+import asyncio
 import json
+import os
+import time
 import logging
 from pathlib import Path
-from typing import Union, Dict, Any
+from typing import Union, Dict, Any, Optional, Callable, Iterator, Tuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime
 import base64
 from io import BytesIO
+from core.clients import get_registry
+from core.context_cache import get_prompt_cache
+from core.memory import get_memory_monitor, memory_stage
+from core.metrics import OCR_RESULTS, OCR_STAGE_SECONDS, record_token_usage
+from core.model_backend import GeminiBackend, ModelBackend, requires_api_key
+from core.resilience import get_caller
+from core.tracing import annotate, span, traced
 from financial_analyser.miscFiles.schemas import ExtractedData, DocType
 from financial_analyser.miscFiles.config import settings
+from financial_analyser.miscFiles.cache import (
+    ExtractionCache,
+    content_hash,
+    get_extraction_cache,
+    make_cache_key
+)
+from financial_analyser.miscFiles.near_duplicates import (
+    dhash,
+    fingerprint,
+    get_near_duplicate_index,
+    same_content
+)
+from financial_analyser.miscFiles.preprocess import preprocess_image, preprocess_stats
+from financial_analyser.miscFiles.rate_limit import TokenBucket
+from financial_analyser.miscFiles.batch_manifest import BatchManifest, file_sha256
 from financial_analyser.miscFiles.utils import (
     save_json_output,
     validate_image,
     sanitize_filename,
     save_extraction_log
 )
-from financial_analyser.prompts.financial_extraction import FINANCIAL_DOCUMENT_PROMPT
+from financial_analyser.prompts.financial_extraction import (
+    FINANCIAL_DOCUMENT_PROMPT,
+    FINANCIAL_PROMPT_VERSION
+)
 
 # Setup logging
 logging.basicConfig(
@@ -29,42 +59,342 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Stage latency histograms, bound once so the hot path only observes
+STAGE_TIMERS = {
+    stage: OCR_STAGE_SECONDS.labels(stage)
+    for stage in ("load", "preprocess", "model", "parse", "score", "save")
+}
+
 
+def _result_source(result: Dict[str, Any]) -> str:
+    """Where a result came from: model, or the cache tier that served it"""
+    return (result.get("cache") or {}).get("hit", "model")
+
+
+def record_outcome(result: Optional[Dict[str, Any]]):
+    """Count a process_image outcome by status and where the answer came from"""
+    if result is None:
+        OCR_RESULTS.labels("exception", "model").inc()
+        return
+    OCR_RESULTS.labels(result.get("status", "unknown"), _result_source(result)).inc()
 
     
 class FinancialDocumentAgent:
-    def __init__(self, api_key: str = None):
+    def __init__(
+        self,
+        api_key: str = None,
+        client: Optional[genai.Client] = None,
+        cache: Optional[ExtractionCache] = None,
+        backend: Optional[ModelBackend] = None
+    ):
         self.api_key = api_key or settings.GEMINI_API_KEY
-        if not self.api_key:
-            raise ValueError("API key not provided")
+        registry = get_registry()
 
-        self.client = genai.Client(api_key=self.api_key)
-        logger.info(f"Agent initialized with model: {settings.MODEL_NAME}")
+        if backend is not None:
+            self.backend = backend
+        elif client is not None:
+            self.backend = GeminiBackend(lambda: client)
+        elif api_key:
+            # Explicit key: keep a private client for this agent
+            private_client = genai.Client(api_key=self.api_key)
+            self.backend = GeminiBackend(lambda: private_client)
+        else:
+            if requires_api_key() and not self.api_key:
+                raise ValueError("API key not provided")
+            self.backend = registry.get_backend()
+        self.cache = cache if cache is not None else get_extraction_cache()
+        self.near_duplicates = get_near_duplicate_index() if self.cache is not None else None
+        if self.near_duplicates is not None:
+            # Keep the index in step with the extractions it points at
+            self.cache.add_removal_listener(self.near_duplicates.remove)
+        # Caps concurrent async model calls made through this agent
+        self._model_slots = asyncio.Semaphore(settings.OCR_MAX_CONCURRENCY)
+        # Deadline, retries, circuit breaker and hedging for the model call
+        self._caller = get_caller("financial_ocr", deadline_seconds=60.0, max_retries=2)
+        logger.info(f"Agent initialized with model: {settings.MODEL_NAME} ({self.backend.name} backend)")
     
 
-    def process_image(self, image_input):
-        image = self.load_image(image_input)
-        
-        # Get filename if available
-        filename = None
-        if isinstance(image_input, (str, Path)):
-            filename = Path(image_input).name
+    def process_image(
+        self,
+        image_input,
+        filename: Optional[str] = None,
+        rate_limiter: Optional[TokenBucket] = None,
+        max_retries: Optional[int] = None
+    ):
+        with span("ocr.process_image", filename=filename or self._input_filename(image_input) or ""):
+            try:
+                result = self._process_image(image_input, filename, rate_limiter, max_retries)
+            except Exception:
+                record_outcome(None)
+                raise
+            record_outcome(result)
+            annotate(status=result.get("status"), source=_result_source(result))
+            return result
 
-        prompt = FINANCIAL_DOCUMENT_PROMPT
+    def _process_image(self, image_input, filename, rate_limiter, max_retries):
+        filename = filename or self._input_filename(image_input)
+        payload, cache_key, cached = self._lookup(image_input, filename)
+        if cached is not None:
+            return cached
 
+        prepared = self._prepare(payload, filename, cache_key)
+        if prepared["served"] is not None:
+            return prepared["served"]
 
-        response = self.client.models.generate_content(
-            model=settings.MODEL_NAME,
-            contents=[prompt, image],
-            config={
-                "response_mime_type": "application/json",
-                "response_schema": ExtractedData,
-                "temperature": 0.1,
-            }
+        cached_content = get_prompt_cache().get(
+            self.backend, settings.MODEL_NAME, "financial_ocr", contents=[FINANCIAL_DOCUMENT_PROMPT]
+        )
+
+        def call_model(prefix):
+            request = self._build_request(prepared["image"], prefix)
+
+            def attempt():
+                if rate_limiter is not None:
+                    rate_limiter.acquire()
+                return self.backend.generate(**request)
+
+            return self._caller.call(attempt, max_retries=max_retries)
+
+        started = time.perf_counter()
+        response = get_prompt_cache().call_with_prefix(cached_content, "financial_ocr", call_model)
+        model_ms = (time.perf_counter() - started) * 1000
+        STAGE_TIMERS["model"].observe(model_ms / 1000)
+        record_token_usage("financial_ocr", response.usage)
+
+        return self._build_result(response.text, filename, cache_key, prepared, model_ms)
+
+    async def aprocess_image(self, image_input, filename: Optional[str] = None):
+        """
+        Async variant of process_image for use inside an event loop
+
+        The model call goes through the async Gemini client and the blocking
+        file work (image load, JSON save) is pushed to worker threads, so the
+        loop stays free while the request is in flight.
+        """
+        with span("ocr.process_image", filename=filename or self._input_filename(image_input) or ""):
+            try:
+                result = await self._aprocess_image(image_input, filename)
+            except Exception:
+                record_outcome(None)
+                raise
+            record_outcome(result)
+            annotate(status=result.get("status"), source=_result_source(result))
+            return result
+
+    async def _aprocess_image(self, image_input, filename: Optional[str]):
+        filename = filename or self._input_filename(image_input)
+        payload, cache_key, cached = await asyncio.to_thread(self._lookup, image_input, filename)
+        if cached is not None:
+            return cached
+
+        prepared = await asyncio.to_thread(self._prepare, payload, filename, cache_key)
+        if prepared["served"] is not None:
+            return prepared["served"]
+
+        cached_content = await get_prompt_cache().aget(
+            self.backend, settings.MODEL_NAME, "financial_ocr", contents=[FINANCIAL_DOCUMENT_PROMPT]
+        )
+        async with self._model_slots:
+            started = time.perf_counter()
+
+            async def call_model(prefix):
+                request = self._build_request(prepared["image"], prefix)
+                return await self._caller.acall(lambda: self.backend.agenerate(**request))
+
+            response = await get_prompt_cache().acall_with_prefix(cached_content, "financial_ocr", call_model)
+            model_ms = (time.perf_counter() - started) * 1000
+        STAGE_TIMERS["model"].observe(model_ms / 1000)
+        record_token_usage("financial_ocr", response.usage)
+
+        return await asyncio.to_thread(
+            self._build_result, response.text, filename, cache_key, prepared, model_ms
         )
 
+    @traced("ocr.lookup")
+    def _lookup(self, image_input, filename: Optional[str]):
+        """
+        Read the input and check the extraction cache
+
+        Returns:
+            (payload, cache_key, cached_result) - payload is the raw bytes
+            (or the PIL image passed in), cached_result is None on a miss
+        """
+        if isinstance(image_input, (str, Path)):
+            path = Path(image_input)
+            if not path.exists():
+                raise FileNotFoundError(f"Image not found: {path}")
+            payload = path.read_bytes()
+        else:
+            payload = image_input
+
+        if self.cache is None:
+            return payload, None, None
+
+        cache_key = make_cache_key(
+            content_hash(payload), FINANCIAL_PROMPT_VERSION, settings.MODEL_NAME
+        )
+        hit = self.cache.get(cache_key)
+        if hit is None:
+            return payload, cache_key, None
+
+        entry, tier = hit
+        logger.info(f"⚡ Cache hit ({tier}) for {filename or cache_key[:12]}")
+        return payload, cache_key, {
+            "status": "success",
+            "filename": filename,
+            "timestamp": datetime.now().isoformat(),
+            "data": entry["data"],
+            "confidence_score": entry["confidence_score"],
+            "perceptual_hash": entry.get("perceptual_hash"),
+            "cache": {"hit": tier, "extracted_at": entry["timestamp"]}
+        }
+
+    @traced("ocr.prepare")
+    def _prepare(self, payload, filename: Optional[str], cache_key: Optional[str]) -> Dict[str, Any]:
+        """
+        Load the image, check for near-duplicates and pre-process it
+
+        Returns:
+            Dict with "image" (PIL image or encoded Part for the model),
+            "phash", "near_duplicate", "preprocessing" report and "served"
+            (a ready result when a near-duplicate was served, else None)
+        """
+        image, near_duplicate, served = self._load_and_match(payload, filename, cache_key)
+        prepared = {
+            "image": image,
+            "phash": image.info.get("dhash"),
+            "fingerprint": image.info.get("fingerprint"),
+            "near_duplicate": near_duplicate,
+            "preprocessing": None,
+            "served": served
+        }
+        if served is not None or not settings.OCR_PREPROCESS_ENABLED:
+            return prepared
+
+        original_bytes = len(payload) if isinstance(payload, bytes) else None
+        with STAGE_TIMERS["preprocess"].time(), memory_stage("ocr.preprocess"):
+            encoded, mime_type, report = preprocess_image(image, original_bytes)
+        prepared["image"] = types.Part.from_bytes(data=encoded, mime_type=mime_type)
+        prepared["preprocessing"] = report
+        if not isinstance(payload, Image.Image):
+            # We opened this image ourselves; release the decoded pixels now
+            image.close()
+        return prepared
+
+    def _load_and_match(self, payload, filename: Optional[str], cache_key: Optional[str]):
+        """
+        Load the image and look for a near-duplicate of an earlier extraction
+
+        Returns:
+            (image, near_duplicate, served_result) - near_duplicate describes
+            the match (or is None); served_result is set only when
+            OCR_NEAR_DUPLICATE_MODE is "serve", the earlier result is cached
+            and the two images pass same_content()
+        """
+        with STAGE_TIMERS["load"].time(), memory_stage("ocr.load_image"):
+            image = self.load_image(payload)
+        phash = image.info.get("dhash")
+        if self.near_duplicates is None or phash is None:
+            return image, None, None
+
+        match = self.near_duplicates.find(phash)
+        if match is None:
+            return image, None, None
+
+        matched_key, distance = match
+        hit = self.cache.get(matched_key)
+        if hit is None:
+            # Expired or evicted (possibly by another worker); nothing to point at
+            self.near_duplicates.remove([matched_key])
+            return image, None, None
+
+        entry = hit[0]
+        near_duplicate = {
+            "distance": distance,
+            "filename": entry.get("filename"),
+            "extracted_at": entry["timestamp"]
+        }
+
+        if settings.OCR_NEAR_DUPLICATE_MODE != "serve":
+            logger.info(f"🔁 Near-duplicate of {near_duplicate['filename']} (distance {distance})")
+            return image, near_duplicate, None
+
+        stored = self.near_duplicates.fingerprint(matched_key)
+        current = image.info.get("fingerprint")
+        if stored is None or current is None or not same_content(
+            stored, current, settings.OCR_NEAR_DUPLICATE_MAX_TILE_DIFF
+        ):
+            # Same layout, different content (another amount or UTR): extract it
+            near_duplicate["verified"] = False
+            logger.info(
+                f"🔁 Near-duplicate of {near_duplicate['filename']} (distance {distance}) "
+                f"differs in content; not serving"
+            )
+            return image, near_duplicate, None
+
+        near_duplicate["verified"] = True
+
+        logger.info(f"⚡ Serving near-duplicate of {near_duplicate['filename']} (distance {distance})")
+        if cache_key is not None:
+            # Exact repeats of this copy now hit directly; the hash itself is
+            # not indexed so matches cannot drift away from the original
+            self.cache.put(cache_key, entry)
+        return image, near_duplicate, {
+            "status": "success",
+            "filename": filename,
+            "timestamp": datetime.now().isoformat(),
+            "data": entry["data"],
+            "confidence_score": entry["confidence_score"],
+            "perceptual_hash": f"{phash:016x}",
+            "near_duplicate": near_duplicate,
+            "cache": {"hit": "near_duplicate", "extracted_at": entry["timestamp"]}
+        }
+
+    def _input_filename(self, image_input) -> Optional[str]:
+        """Get filename if available"""
+        if isinstance(image_input, (str, Path)):
+            return Path(image_input).name
+        return None
+
+    def _build_request(
+        self,
+        image: Union[Image.Image, types.Part],
+        cached_content: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Keyword arguments for generate_content
+
+        Args:
+            image: The prepared image part
+            cached_content: Name of the cached FINANCIAL_DOCUMENT_PROMPT
+                prefix; the prompt is sent inline when None
+        """
+        config = {
+            "response_mime_type": "application/json",
+            "response_schema": ExtractedData,
+            "temperature": 0.1,
+            "http_options": self._caller.http_options(),
+        }
+        if cached_content:
+            config["cached_content"] = cached_content
+            contents = [image]
+        else:
+            contents = [FINANCIAL_DOCUMENT_PROMPT, image]
+        return {"model": settings.MODEL_NAME, "contents": contents, "config": config}
+
+    @traced("ocr.build_result")
+    def _build_result(
+        self,
+        response_text: str,
+        filename: Optional[str],
+        cache_key: Optional[str] = None,
+        prepared: Optional[Dict[str, Any]] = None,
+        model_ms: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """Parse the model response, score it, save and cache the individual result"""
         try:
-            data = json.loads(response.text)
+            with STAGE_TIMERS["parse"].time():
+                data = json.loads(response_text)
         except Exception as e:
             return {
                 "status": "error",
@@ -79,34 +409,76 @@ class FinancialDocumentAgent:
             "filename": filename,
             "timestamp": datetime.now().isoformat(),
             "data": data,
-            "confidence_score": self._calculate_confidence(data)
         }
+        with STAGE_TIMERS["score"].time():
+            result["confidence_score"] = self._calculate_confidence(data)
+        prepared = prepared or {}
+        phash = prepared.get("phash")
+        if phash is not None:
+            result["perceptual_hash"] = f"{phash:016x}"
+        if prepared.get("near_duplicate") is not None:
+            result["near_duplicate"] = prepared["near_duplicate"]
+        if prepared.get("preprocessing") is not None:
+            result["preprocessing"] = prepared["preprocessing"]
+        if model_ms is not None:
+            result["model_latency_ms"] = round(model_ms, 2)
+            preprocess_stats.record_model_latency(model_ms, prepared.get("preprocessing") is not None)
         
         # SAVE INDIVIDUAL RESULT
-
-
-        output_path = save_json_output(
-            result=result,
-            output_dir=settings.OUTPUT_DIR,
-            filename=filename
-        )
+        with STAGE_TIMERS["save"].time():
+            output_path = save_json_output(
+                result=result,
+                output_dir=settings.OUTPUT_DIR,
+                filename=filename
+            )
 
         logger.info(f"💾 Saved result to: {output_path}")
+
+        if cache_key is not None:
+            self.cache.put(cache_key, {
+                "data": data,
+                "confidence_score": result["confidence_score"],
+                "timestamp": result["timestamp"],
+                "filename": filename,
+                "perceptual_hash": result.get("perceptual_hash")
+            })
+            if phash is not None and self.near_duplicates is not None:
+                self.near_duplicates.add(cache_key, phash, prepared.get("fingerprint"))
         
         return result
+
     def load_image(self, image_input: Union[str, Path, Image.Image, bytes]) -> Image.Image:
-        """Load image from various input types"""
+        """
+        Load image from various input types
+
+        When near-duplicate detection is on, the image's perceptual hash is
+        computed here and stored in image.info["dhash"]; in "serve" mode its
+        fingerprint() goes in image.info["fingerprint"] as well.
+        """
         if isinstance(image_input, Image.Image):
-            return image_input
+            image = image_input
         elif isinstance(image_input, bytes):
-            return Image.open(BytesIO(image_input))
+            image = Image.open(BytesIO(image_input))
         elif isinstance(image_input, (str, Path)):
             path = Path(image_input)
             if not path.exists():
                 raise FileNotFoundError(f"Image not found: {path}")
-            return Image.open(path)
+            image = Image.open(path)
         else:
             raise TypeError(f"Unsupported image input type: {type(image_input)}")
+
+        source_size = image.size
+        if settings.OCR_PREPROCESS_ENABLED and image is not image_input and image.format == "JPEG":
+            # Let the JPEG decoder scale down while decoding; we downscale anyway
+            edge = settings.OCR_PREPROCESS_MAX_EDGE
+            image.draft(image.mode, (edge, edge))
+
+        if self.near_duplicates is not None and "dhash" not in image.info:
+            image.info["dhash"] = dhash(image)
+        if (self.near_duplicates is not None and settings.OCR_NEAR_DUPLICATE_MODE == "serve"
+                and "fingerprint" not in image.info):
+            image.info["fingerprint"] = fingerprint(image, source_size)
+        return image
     
     def _calculate_confidence(self, data: Dict) -> float:
         """
@@ -140,39 +512,134 @@ class FinancialDocumentAgent:
     def batch_process(
         self, 
         image_paths: list,
-        output_format: str = "json"
+        output_format: str = "json",
+        workers: Optional[int] = None,
+        progress: Optional[Callable[[int, int, int, float], None]] = None,
+        manifest: Optional[BatchManifest] = None
     ) -> list:
         """
         Process multiple images in batch
         
+        Collects iter_batch into a list; prefer iter_batch for large runs,
+        which keeps memory flat.
+        
         Args:
             image_paths: List of image file paths
             output_format: 'json' or 'csv'
+            workers: Concurrent images (defaults to BATCH_WORKERS)
+            progress: See iter_batch
+            manifest: See iter_batch
             
         Returns:
-            List of extraction results
+            List of extraction results, in the same order as image_paths
+        """
+        results = [None] * len(image_paths)
+        with memory_stage("ocr.batch_process"):
+            for idx, result in self.iter_batch(image_paths, workers, progress, manifest):
+                results[idx] = result
+        return results
+
+    def iter_batch(
+        self,
+        image_paths: list,
+        workers: Optional[int] = None,
+        progress: Optional[Callable[[int, int, int, float], None]] = None,
+        manifest: Optional[BatchManifest] = None
+    ) -> Iterator[Tuple[int, Dict[str, Any]]]:
         """
-        results = []
+        Process images concurrently, yielding each result as it completes
         
-        logger.info(f"Starting batch processing of {len(image_paths)} images")
+        Images run on a thread pool with at most 2 x workers submitted at a
+        time, so neither futures nor results pile up in memory. Model calls
+        are throttled by a token bucket built from BATCH_SIZE /
+        BATCH_DELAY_SECONDS and retried with exponential backoff on 429/5xx
+        errors. Each outcome is appended to the run's NDJSON manifest as soon
+        as it finishes; images that already succeeded in a resumed manifest
+        (same path and content hash) are returned from it without another
+        model call. While RSS is over MEMORY_SOFT_LIMIT_MB the run drops to
+        one image in flight.
         
-        for idx, img_path in enumerate(image_paths, 1):
-            logger.info(f"Processing {idx}/{len(image_paths)}: {img_path}")
-            result = self.process_image(img_path)
-            results.append({
-                "file": str(img_path),
-                **result
-            })
+        Args:
+            image_paths: List of image file paths
+            workers: Concurrent images (defaults to BATCH_WORKERS)
+            progress: Called as progress(done, total, failed, elapsed_seconds)
+                after each image completes
+            manifest: Run manifest to checkpoint into (a new run is created
+                when omitted); pass BatchManifest.load(run_id) to resume
+            
+        Yields:
+            (index into image_paths, result) in completion order
+        """
+        workers = workers or settings.BATCH_WORKERS
+        manifest = manifest or BatchManifest.create(image_paths)
+        rate_limiter = TokenBucket.from_settings(settings)
+        memory = get_memory_monitor()
+        checkpoint_every = int(os.getenv("MEMORY_CHECKPOINT_EVERY", 50))
+        total = len(image_paths)
+        done = failed = 0
+        started = time.perf_counter()
         
-        # Save batch results
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_path = Path(settings.LOGS_DIR) / f"batch_results_{timestamp}.json"
+        logger.info(
+            f"Starting batch run {manifest.run_id}: {total} images with {workers} workers"
+        )
         
-        with open(output_path, 'w') as f:
-            json.dump(results, f, indent=2)
+        def run(img_path):
+            sha256 = None
+            try:
+                image_bytes = Path(img_path).read_bytes()
+                sha256 = file_sha256(image_bytes)
+                previous = manifest.completed_result(str(img_path), sha256)
+                if previous is not None:
+                    return sha256, {**previous, "resumed": True}
+                return sha256, self.process_image(
+                    image_bytes,
+                    filename=Path(img_path).name,
+                    rate_limiter=rate_limiter,
+                    max_retries=settings.BATCH_MAX_RETRIES
+                )
+            except Exception as e:
+                logger.error(f"Failed to process {img_path}: {e}")
+                return sha256, {"status": "error", "error": str(e), "data": None}
         
-        logger.info(f"Batch processing complete. Results saved to {output_path}")
-        return results
+        queued = iter(enumerate(image_paths))
+        
+        memory.checkpoint(f"batch {manifest.run_id} start")
+        
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as pool:
+            pending = {}
+            
+            def refill():
+                while len(pending) < workers * 2:
+                    if pending and memory.over_budget():
+                        # Let in-flight images finish before taking more
+                        memory.count("paused")
+                        return
+                    item = next(queued, None)
+                    if item is None:
+                        return
+                    pending[pool.submit(run, item[1])] = item
+            
+            refill()
+            
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    idx, img_path = pending.pop(future)
+                    sha256, result = future.result()
+                    if not result.get("resumed"):
+                        manifest.record(str(img_path), sha256, result)
+                    done += 1
+                    if result.get("status") != "success":
+                        failed += 1
+                    if progress:
+                        progress(done, total, failed, time.perf_counter() - started)
+                    if done % checkpoint_every == 0:
+                        memory.checkpoint(f"batch {manifest.run_id} {done}/{total}")
+                    refill()
+                    yield idx, {"file": str(img_path), **result}
+        
+        memory.checkpoint(f"batch {manifest.run_id} end")
+        logger.info(f"Batch processing complete. Results saved to {manifest.path}")
 
 
 def main():
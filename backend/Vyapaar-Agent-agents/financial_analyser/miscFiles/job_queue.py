@@ -0,0 +1,331 @@
+"""
+Durable SQLite-backed OCR job queue
+
+The API stores the image and enqueues a job; worker processes (started with
+`cli.py worker`) claim jobs under a time-limited lease, run process_image and
+record the result. A job whose worker dies becomes visible again once its
+lease expires, and failed attempts are retried after a delay until
+max_attempts is reached. Point JOBS_DIR at a shared volume to run workers on
+several hosts.
+
+The queue database uses SQLite's rollback journal rather than WAL: WAL keeps
+its index in shared memory, which processes on different hosts cannot see,
+so a WAL database on a network filesystem is unsafe. The shared volume must
+still provide working POSIX byte-range locks (NFSv4 with locking enabled,
+not a mount with nolock).
+"""
+
+import os
+import json
+import shutil
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+from financial_analyser.miscFiles.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """
+    Submit/claim/complete operations over a SQLite jobs table
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[Path] = None,
+        jobs_dir: Optional[Path] = None,
+        lease_seconds: Optional[float] = None,
+        max_attempts: Optional[int] = None,
+        retry_delay_seconds: Optional[float] = None,
+    ):
+        """
+        Args:
+            db_path: SQLite file holding the jobs table
+            jobs_dir: Directory the submitted images are stored in
+            lease_seconds: How long a claimed job stays invisible to other workers
+            max_attempts: Attempts before a job is marked failed
+            retry_delay_seconds: Delay before a failed attempt is retried
+        """
+        self.jobs_dir = Path(jobs_dir or settings.JOBS_DIR)
+        self.db_path = Path(db_path or settings.JOB_QUEUE_DB_PATH or self.jobs_dir / "queue.sqlite3")
+        self.lease_seconds = lease_seconds or settings.JOB_LEASE_SECONDS
+        self.max_attempts = max_attempts or settings.JOB_MAX_ATTEMPTS
+        self.retry_delay_seconds = (
+            retry_delay_seconds if retry_delay_seconds is not None else settings.JOB_RETRY_DELAY_SECONDS
+        )
+
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # Autocommit mode; claims take an explicit IMMEDIATE transaction
+        self._conn = sqlite3.connect(
+            str(self.db_path), check_same_thread=False, timeout=30.0, isolation_level=None
+        )
+        self._conn.row_factory = sqlite3.Row
+        # Rollback journal: WAL does not work across hosts (see module docstring)
+        self._conn.execute("PRAGMA journal_mode=DELETE")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ocr_jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                filename TEXT,
+                image_path TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                available_at REAL NOT NULL,
+                lease_until REAL,
+                worker_id TEXT,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_ocr_jobs_ready ON ocr_jobs(status, available_at)"
+        )
+
+    def enqueue(self, image: Union[bytes, str, Path], filename: Optional[str] = None) -> str:
+        """
+        Store the image and enqueue a job for it
+
+        Args:
+            image: Image bytes, or path of a file to move into JOBS_DIR (it
+                may be on another filesystem; the caller still owns it if
+                enqueue raises)
+            filename: Original filename (used for output naming)
+
+        Returns:
+            The new job id
+        """
+        job_id = uuid.uuid4().hex
+        suffix = Path(filename).suffix.lower() if filename else ""
+        image_path = self.jobs_dir / f"{job_id}{suffix}"
+
+        # Write under a temporary name so a worker never sees a partial file
+        partial_path = image_path.with_name(image_path.name + ".part")
+        try:
+            if isinstance(image, bytes):
+                partial_path.write_bytes(image)
+            else:
+                # Copies and unlinks when JOBS_DIR is on another filesystem
+                shutil.move(str(image), str(partial_path))
+            os.replace(partial_path, image_path)
+
+            now = time.time()
+            with self._lock:
+                self._conn.execute(
+                    "INSERT INTO ocr_jobs (id, status, filename, image_path, max_attempts, "
+                    "available_at, created_at, updated_at) VALUES (?, 'queued', ?, ?, ?, ?, ?, ?)",
+                    (job_id, filename, str(image_path), self.max_attempts, now, now, now),
+                )
+        except BaseException:
+            partial_path.unlink(missing_ok=True)
+            image_path.unlink(missing_ok=True)
+            raise
+        logger.info(f"📥 Enqueued job {job_id} ({filename})")
+        return job_id
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Lease the oldest runnable job
+
+        A job is runnable when it is queued and its retry delay has passed, or
+        when it is running under an expired lease (its worker died).
+
+        Returns:
+            The claimed job row as a dict, or None if nothing is runnable
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Expired leases on the final attempt are not retried
+                self._conn.execute(
+                    "UPDATE ocr_jobs SET status = 'failed', error = 'Lease expired on final attempt', "
+                    "updated_at = ? WHERE status = 'running' AND lease_until < ? AND attempts >= max_attempts",
+                    (now, now),
+                )
+                row = self._conn.execute(
+                    "SELECT id FROM ocr_jobs WHERE (status = 'queued' AND available_at <= ?) "
+                    "OR (status = 'running' AND lease_until < ?) ORDER BY created_at LIMIT 1",
+                    (now, now),
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+
+                self._conn.execute(
+                    "UPDATE ocr_jobs SET status = 'running', worker_id = ?, lease_until = ?, "
+                    "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (worker_id, now + self.lease_seconds, now, row["id"]),
+                )
+                job = self._conn.execute("SELECT * FROM ocr_jobs WHERE id = ?", (row["id"],)).fetchone()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return dict(job)
+
+    def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        """
+        Extend the lease on a job this worker still owns
+
+        Returns:
+            False if the lease was lost to another worker
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE ocr_jobs SET lease_until = ?, updated_at = ? "
+                "WHERE id = ? AND worker_id = ? AND status = 'running'",
+                (now + self.lease_seconds, now, job_id, worker_id),
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id: str, worker_id: str, result: Dict[str, Any]) -> bool:
+        """Record a successful result and remove the stored image"""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE ocr_jobs SET status = 'succeeded', result = ?, error = NULL, lease_until = NULL, "
+                "updated_at = ? WHERE id = ? AND worker_id = ? AND status = 'running'",
+                (json.dumps(result, ensure_ascii=False), now, job_id, worker_id),
+            )
+            row = self._conn.execute("SELECT image_path FROM ocr_jobs WHERE id = ?", (job_id,)).fetchone()
+        if cursor.rowcount == 1 and row is not None:
+            Path(row["image_path"]).unlink(missing_ok=True)
+        return cursor.rowcount == 1
+
+    def fail(self, job_id: str, worker_id: str, error: str) -> str:
+        """
+        Record a failed attempt
+
+        Returns:
+            The job's new status: "queued" (will be retried) or "failed"
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT attempts, max_attempts FROM ocr_jobs WHERE id = ? AND worker_id = ?",
+                (job_id, worker_id),
+            ).fetchone()
+            if row is None:
+                return "lost"
+
+            status = "failed" if row["attempts"] >= row["max_attempts"] else "queued"
+            # Back off linearly with the attempt number
+            available_at = now + self.retry_delay_seconds * row["attempts"]
+            self._conn.execute(
+                "UPDATE ocr_jobs SET status = ?, error = ?, available_at = ?, lease_until = NULL, "
+                "updated_at = ? WHERE id = ? AND worker_id = ? AND status = 'running'",
+                (status, error, available_at, now, job_id, worker_id),
+            )
+        return status
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Job status and result, or None if the id is unknown"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM ocr_jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        job = dict(row)
+        return {
+            "job_id": job["id"],
+            "status": job["status"],
+            "filename": job["filename"],
+            "attempts": job["attempts"],
+            "max_attempts": job["max_attempts"],
+            "error": job["error"],
+            "result": json.loads(job["result"]) if job["result"] else None,
+            "created_at": job["created_at"],
+            "updated_at": job["updated_at"],
+        }
+
+    def counts(self) -> Dict[str, int]:
+        """Number of jobs per status"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM ocr_jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+def run_worker(
+    queue: Optional[JobQueue] = None,
+    worker_id: Optional[str] = None,
+    poll_interval: Optional[float] = None,
+    stop_event=None,
+):
+    """
+    Claim and execute jobs until stop_event is set
+
+    Args:
+        queue: Queue to pull from (defaults to one built from settings)
+        worker_id: Identifier stored on claimed jobs (defaults to host:pid)
+        poll_interval: Seconds to sleep when the queue is empty
+        stop_event: threading/multiprocessing Event that ends the loop
+    """
+    from financial_analyser.miscFiles.financial_agent import FinancialDocumentAgent
+
+    queue = queue or JobQueue()
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    poll_interval = poll_interval or settings.JOB_POLL_INTERVAL_SECONDS
+    agent = FinancialDocumentAgent()
+
+    logger.info(f"👷 Worker {worker_id} started")
+    while stop_event is None or not stop_event.is_set():
+        job = queue.claim(worker_id)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+
+        logger.info(f"⚙️  Job {job['id']} attempt {job['attempts']}/{job['max_attempts']}")
+
+        # Keep the lease alive while the model call runs
+        done = threading.Event()
+
+        def keep_leased():
+            while not done.wait(queue.lease_seconds / 3):
+                if not queue.heartbeat(job["id"], worker_id):
+                    logger.warning(f"Lost lease on job {job['id']}")
+                    return
+
+        heartbeat = threading.Thread(target=keep_leased, daemon=True)
+        heartbeat.start()
+        try:
+            result = agent.process_image(job["image_path"], filename=job["filename"])
+            if result.get("status") == "success":
+                queue.complete(job["id"], worker_id, result)
+                logger.info(f"✅ Job {job['id']} succeeded")
+            else:
+                status = queue.fail(job["id"], worker_id, result.get("error") or "Unknown error")
+                logger.warning(f"Job {job['id']} attempt failed ({status}): {result.get('error')}")
+        except Exception as e:
+            status = queue.fail(job["id"], worker_id, str(e))
+            logger.warning(f"Job {job['id']} attempt failed ({status}): {e}")
+        finally:
+            done.set()
+            heartbeat.join()
+
+    logger.info(f"👷 Worker {worker_id} stopped")
+
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Process-wide queue built from settings"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
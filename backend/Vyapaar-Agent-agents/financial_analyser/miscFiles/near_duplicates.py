@@ -0,0 +1,305 @@
+"""
+Perceptual-hash near-duplicate detection for document images
+
+A re-captured, cropped or WhatsApp-recompressed screenshot has different
+bytes but almost the same 64-bit difference hash (dHash). Hashes are kept in
+a multi-index table: the hash is split into max_distance + 1 bands and, by
+the pigeonhole principle, any hash within max_distance bits of a query
+matches it exactly on at least one band. A lookup is therefore a handful of
+dict probes plus popcounts on the few candidates, independent of how many
+images are stored.
+
+A 64-bit dHash only sees the layout of a document, not its text: two
+payment screenshots from the same app with different amounts and UTRs are
+usually within a bit or two. A match is therefore only good enough to flag.
+Before an earlier extraction is served in its place, the match is confirmed
+with fingerprint(): a grayscale thumbnail large enough that a changed digit
+shows up in at least one small tile, compared by same_content().
+"""
+
+import time
+import zlib
+import struct
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from PIL import Image, ImageChops
+
+from financial_analyser.miscFiles.config import settings
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+FINGERPRINT_EDGE = 384  # Long edge of the verification thumbnail
+FINGERPRINT_TILE = 4  # Side of the tiles compared by same_content
+_FINGERPRINT_HEADER = struct.Struct(">IIHH")  # Source width/height, thumbnail width/height
+
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """
+    Difference hash of an image
+
+    Args:
+        image: PIL Image object
+        hash_size: Hash is hash_size x hash_size bits
+
+    Returns:
+        Hash as an unsigned integer
+    """
+    small = image.resize(
+        (hash_size + 1, hash_size),
+        Image.Resampling.BILINEAR,
+        reducing_gap=2.0
+    ).convert("L")
+    pixels = small.tobytes()
+    width = hash_size + 1
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * width
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """Number of differing bits between two hashes"""
+    return (a ^ b).bit_count()
+
+
+def fingerprint(image: Image.Image, source_size: Optional[Tuple[int, int]] = None) -> bytes:
+    """
+    Content fingerprint used to confirm a near-duplicate before serving it
+
+    Args:
+        image: PIL Image object
+        source_size: Size of the original image when image was decoded at a
+            reduced scale (JPEG draft mode); defaults to image.size
+
+    Returns:
+        Source size, thumbnail size and the compressed grayscale thumbnail
+    """
+    width, height = source_size or image.size
+    scale = FINGERPRINT_EDGE / max(width, height)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    thumbnail = image.convert("L").resize(size, Image.Resampling.BOX)
+    return _FINGERPRINT_HEADER.pack(width, height, *size) + zlib.compress(thumbnail.tobytes())
+
+
+def same_content(a: bytes, b: bytes, max_tile_diff: int = 12) -> bool:
+    """
+    Whether two fingerprints show the same document
+
+    The source images must have identical dimensions (a crop or rescale is
+    never served), and no FINGERPRINT_TILE-sized tile of the thumbnails may
+    differ by more than max_tile_diff grey levels on average. Recompression
+    noise stays in the low single digits; a changed amount, UTR digit or
+    name letter does not.
+    """
+    header = _FINGERPRINT_HEADER.size
+    if len(a) < header or len(b) < header or a[:header] != b[:header]:
+        return False
+    _, _, width, height = _FINGERPRINT_HEADER.unpack(a[:header])
+    try:
+        first = Image.frombytes("L", (width, height), zlib.decompress(a[header:]))
+        second = Image.frombytes("L", (width, height), zlib.decompress(b[header:]))
+    except (zlib.error, ValueError):
+        return False
+    tiles = ImageChops.difference(first, second).reduce(FINGERPRINT_TILE)
+    return tiles.getextrema()[1] <= max_tile_diff
+
+
+class NearDuplicateIndex:
+    """
+    Multi-index Hamming-distance lookup over stored perceptual hashes
+    """
+
+    def __init__(self, db_path: Optional[Path] = None, max_distance: int = 4, ttl_seconds: Optional[float] = None):
+        """
+        Args:
+            db_path: SQLite file the hashes are persisted in (None = memory only)
+            max_distance: Largest Hamming distance treated as a near-duplicate
+            ttl_seconds: Ignore stored hashes older than this
+        """
+        self.max_distance = max_distance
+        self.ttl_seconds = ttl_seconds
+
+        bands = max_distance + 1
+        base, extra = divmod(HASH_BITS, bands)
+        # (shift, mask) for each band; earlier bands take the leftover bits
+        self._bands: List[Tuple[int, int]] = []
+        shift = HASH_BITS
+        for i in range(bands):
+            width = base + (1 if i < extra else 0)
+            shift -= width
+            self._bands.append((shift, (1 << width) - 1))
+
+        self._lock = threading.Lock()
+        self._tables: List[Dict[int, List[str]]] = [{} for _ in self._bands]
+        self._hashes: Dict[str, int] = {}
+        self._fingerprints: Dict[str, bytes] = {}  # Memory-only index; otherwise read from the DB
+        self._stats = {"lookups": 0, "matches": 0, "added": 0, "removed": 0}
+
+        self.db_path = Path(db_path) if db_path else None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._last_rowid = 0
+        self._last_sync = 0.0
+        if self.db_path:
+            self._open_db()
+
+    def _open_db(self):
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS perceptual_hashes (
+                key TEXT PRIMARY KEY,
+                phash TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                fingerprint BLOB
+            )
+            """
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(perceptual_hashes)")}
+        if "fingerprint" not in columns:
+            self._conn.execute("ALTER TABLE perceptual_hashes ADD COLUMN fingerprint BLOB")
+        self._conn.commit()
+        with self._lock:
+            self._sync()
+        logger.info(f"Near-duplicate index loaded {len(self._hashes)} hashes")
+
+    def _sync(self):
+        """Pull rows added since the last sync, including other processes' (caller holds the lock)"""
+        min_created = time.time() - self.ttl_seconds if self.ttl_seconds else 0
+        rows = self._conn.execute(
+            "SELECT rowid, key, phash FROM perceptual_hashes WHERE rowid > ? AND created_at >= ? ORDER BY rowid",
+            (self._last_rowid, min_created),
+        ).fetchall()
+        for rowid, key, phash in rows:
+            self._insert(key, int(phash, 16))
+            self._last_rowid = rowid
+        self._last_sync = time.monotonic()
+
+    def _insert(self, key: str, value: int):
+        if key in self._hashes:
+            return
+        self._hashes[key] = value
+        for table, (shift, mask) in zip(self._tables, self._bands):
+            table.setdefault((value >> shift) & mask, []).append(key)
+
+    def add(self, key: str, value: int, content: Optional[bytes] = None):
+        """
+        Store a hash
+
+        Args:
+            key: Extraction cache key the hash belongs to
+            value: Perceptual hash
+            content: fingerprint() of the image, needed to serve matches
+        """
+        with self._lock:
+            if key in self._hashes:
+                return
+            self._insert(key, value)
+            self._stats["added"] += 1
+            if self._conn is None:
+                if content is not None:
+                    self._fingerprints[key] = content
+                return
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO perceptual_hashes (key, phash, created_at, fingerprint) VALUES (?, ?, ?, ?)",
+                (key, f"{value:016x}", time.time(), content),
+            )
+            self._conn.commit()
+            self._last_rowid = max(self._last_rowid, cursor.lastrowid or 0)
+
+    def fingerprint(self, key: str) -> Optional[bytes]:
+        """The stored fingerprint() for key, or None when it was not recorded"""
+        with self._lock:
+            if self._conn is None:
+                return self._fingerprints.get(key)
+            row = self._conn.execute(
+                "SELECT fingerprint FROM perceptual_hashes WHERE key = ?", (key,)
+            ).fetchone()
+            return row[0] if row else None
+
+    def remove(self, keys: Iterable[str]):
+        """
+        Forget hashes whose extraction is gone
+
+        Registered with ExtractionCache.add_removal_listener so the index never
+        points at expired or evicted extractions.
+        """
+        keys = list(keys)
+        with self._lock:
+            for key in keys:
+                value = self._hashes.pop(key, None)
+                self._fingerprints.pop(key, None)
+                if value is None:
+                    continue
+                self._stats["removed"] += 1
+                for table, (shift, mask) in zip(self._tables, self._bands):
+                    band = (value >> shift) & mask
+                    bucket = table.get(band)
+                    if bucket is not None and key in bucket:
+                        bucket.remove(key)
+                        if not bucket:
+                            del table[band]
+            if self._conn is not None:
+                self._conn.executemany("DELETE FROM perceptual_hashes WHERE key = ?", [(key,) for key in keys])
+                self._conn.commit()
+
+    def find(self, value: int, max_distance: Optional[int] = None) -> Optional[Tuple[str, int]]:
+        """
+        Closest stored hash within max_distance
+
+        Returns:
+            (key, distance) of the best match, or None
+        """
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+
+        with self._lock:
+            if self._conn is not None and time.monotonic() - self._last_sync > 5.0:
+                self._sync()
+            self._stats["lookups"] += 1
+
+            seen: Set[str] = set()
+            best = None
+            for table, (shift, mask) in zip(self._tables, self._bands):
+                for key in table.get((value >> shift) & mask, ()):
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    distance = hamming_distance(value, self._hashes[key])
+                    if distance <= max_distance and (best is None or distance < best[1]):
+                        best = (key, distance)
+
+            if best is not None:
+                self._stats["matches"] += 1
+            return best
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "stored": len(self._hashes), "max_distance": self.max_distance}
+
+
+_index: Optional[NearDuplicateIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_near_duplicate_index() -> Optional[NearDuplicateIndex]:
+    """Process-wide index built from settings (None when disabled)"""
+    global _index
+    if settings.OCR_NEAR_DUPLICATE_MODE == "off" or not settings.OCR_CACHE_ENABLED:
+        return None
+    with _index_lock:
+        if _index is None:
+            _index = NearDuplicateIndex(
+                db_path=settings.OCR_CACHE_DB_PATH or settings.CACHE_DIR / "extractions.sqlite3",
+                max_distance=settings.OCR_NEAR_DUPLICATE_DISTANCE,
+                ttl_seconds=settings.OCR_CACHE_TTL_SECONDS,
+            )
+        return _index
@@ -0,0 +1,56 @@
+"""
+Rate limiting for model calls made in bulk
+
+Retries live in core.resilience so batch calls get the same deadline,
+backoff and circuit breaker as the API endpoints.
+"""
+
+import time
+import threading
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket
+
+    Allows bursts of up to `capacity` calls, refilled at `rate` tokens per
+    second.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        """
+        Args:
+            rate: Tokens added per second
+            capacity: Maximum tokens held (burst size)
+        """
+        if rate <= 0 or capacity < 1:
+            raise ValueError("rate must be > 0 and capacity >= 1")
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings) -> Optional["TokenBucket"]:
+        """
+        Bucket driven by BATCH_SIZE (burst) and BATCH_DELAY_SECONDS (one
+        token per delay); None when the delay is 0, i.e. unthrottled
+        """
+        if settings.BATCH_DELAY_SECONDS <= 0:
+            return None
+        return cls(rate=1.0 / settings.BATCH_DELAY_SECONDS, capacity=max(settings.BATCH_SIZE, 1))
+
+    def acquire(self):
+        """Block until a token is available, then take it"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
@@ -135,6 +135,62 @@ def format_currency(amount: float) -> str:
     return f"₹{formatted}"
 
 
+class SummaryAccumulator:
+    """
+    Batch summary aggregates updated one result at a time
+    
+    Lets streaming batch runs report the same figures as summarize_results
+    without keeping every result in memory.
+    """
+    
+    def __init__(self):
+        self.total = 0
+        self.successful = 0
+        self.doc_types = {}
+        self.total_amount = 0
+    
+    def add(self, result: Dict[str, Any]):
+        """Fold one processing result into the aggregates"""
+        self.total += 1
+        if result.get('status') != 'success':
+            return
+        
+        self.successful += 1
+        data = result.get('data') or {}
+        doc_type = data.get('document_type', 'unknown')
+        self.doc_types[doc_type] = self.doc_types.get(doc_type, 0) + 1
+        
+        if data.get('amount'):
+            self.total_amount += data['amount']
+    
+    def summary(self) -> Dict[str, Any]:
+        """Current aggregates, in the summarize_results format"""
+        return {
+            'total': self.total,
+            'successful': self.successful,
+            'failed': self.total - self.successful,
+            'success_rate': round(self.successful / self.total * 100, 1) if self.total else 0.0,
+            'by_document_type': dict(self.doc_types),
+            'total_amount': self.total_amount
+        }
+
+
+def summarize_results(results: list) -> Dict[str, Any]:
+    """
+    Aggregate batch processing results
+    
+    Args:
+        results: List of processing results
+        
+    Returns:
+        Dictionary with counts, success rate, per-type counts and total amount
+    """
+    accumulator = SummaryAccumulator()
+    for result in results:
+        accumulator.add(result)
+    return accumulator.summary()
+
+
 def generate_summary_report(results: list) -> str:
     """
     Generate a summary report from batch processing results
@@ -145,41 +201,37 @@ def generate_summary_report(results: list) -> str:
     Returns:
         Formatted summary string
     """
-    total = len(results)
-    successful = sum(1 for r in results if r.get('status') == 'success')
-    failed = total - successful
-    
-    # Count by document type
-    doc_types = {}
-    total_amount = 0
-    
-    for result in results:
-        if result.get('status') == 'success':
-            data = result.get('data', {})
-            doc_type = data.get('document_type', 'unknown')
-            doc_types[doc_type] = doc_types.get(doc_type, 0) + 1
-            
-            if data.get('amount'):
-                total_amount += data['amount']
+    return format_summary_report(summarize_results(results))
+
+
+def format_summary_report(stats: Dict[str, Any]) -> str:
+    """
+    Format batch summary aggregates as a printable report
     
+    Args:
+        stats: Aggregates from summarize_results / SummaryAccumulator.summary
+        
+    Returns:
+        Formatted summary string
+    """
     summary = f"""
 ╔══════════════════════════════════════════╗
 ║     BATCH PROCESSING SUMMARY             ║
 ╚══════════════════════════════════════════╝
 
 📊 Overall Statistics:
-   • Total Processed: {total}
-   • Successful: {successful}
-   • Failed: {failed}
-   • Success Rate: {(successful/total*100):.1f}%
+   • Total Processed: {stats['total']}
+   • Successful: {stats['successful']}
+   • Failed: {stats['failed']}
+   • Success Rate: {stats['success_rate']:.1f}%
 
 📄 Document Types:
 """
     
-    for doc_type, count in doc_types.items():
+    for doc_type, count in stats['by_document_type'].items():
         summary += f"   • {doc_type}: {count}\n"
     
-    summary += f"\n💰 Total Amount Extracted: {format_currency(total_amount)}\n"
+    summary += f"\n💰 Total Amount Extracted: {format_currency(stats['total_amount'])}\n"
     summary += f"\n⏰ Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
     
     return summary
@@ -2,6 +2,9 @@
 Prompt templates for Financial Document Agent
 """
 
+# Bump whenever FINANCIAL_DOCUMENT_PROMPT changes so cached extractions miss
+FINANCIAL_PROMPT_VERSION = "1"
+
 FINANCIAL_DOCUMENT_PROMPT = """
 You are an expert Indian financial document analyzer with deep knowledge of UPI systems, GST invoices, and billing formats.
 
@@ -16,6 +16,9 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 from invoice_agent.miscFiles.invoice_agent import process_user_input
 from invoice_agent.miscFiles.normaliser import normalize_document
 from invoice_agent.miscFiles.pdf_generator import generate_pdf, update_business_config
+from invoice_agent.miscFiles.sessions import new_session_id
+from core.memory import get_memory_monitor
+from core.model_backend import requires_api_key
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -34,7 +37,8 @@ def interactive_mode():
     print("Supports: GST Invoice, Bill of Supply, Quotation, Receipt")
     print("Type 'quit' to exit, 'config' to update business details\n")
     
-    conversation_history = []
+    # Answers to clarification questions continue this session's document
+    session_id = new_session_id()
     
     while True:
         user_input = input("📝 Enter command: ").strip()
@@ -62,11 +66,8 @@ def interactive_mode():
         if not user_input:
             continue
         
-        # Add to conversation history
-        conversation_history.append(user_input)
-        
         # Process input
-        result = process_user_input(user_input)
+        result = process_user_input(user_input, session_id=session_id)
         
         if "error" in result:
             print("\n❌ Error:")
@@ -84,7 +85,7 @@ def interactive_mode():
             print("\n📄 Partial Document Generated:")
             print_json(result['partial_document'])
             
-            print("\n💡 Tip: Provide the missing info and try again")
+            print("\n💡 Tip: Just answer the questions (e.g. '380 rate, CJ Traders') - only the missing fields are updated")
             print()
             
         elif result.get("status") == "complete":
@@ -120,9 +121,9 @@ def interactive_mode():
             print()
 
 
-def single_command_mode(command: str, generate_pdf_flag: bool = False):
+def single_command_mode(command: str, generate_pdf_flag: bool = False, session_id: str = None):
     """Process single command and output JSON"""
-    result = process_user_input(command)
+    result = process_user_input(command, session_id=session_id)
     print_json(result)
     
     # Generate PDF if requested and document is complete
@@ -140,7 +141,7 @@ def main():
 
 
     # Check for API key
-    if not os.getenv('GEMINI_API_KEY'):
+    if requires_api_key() and not os.getenv('GEMINI_API_KEY'):
         print(json.dumps({
             "error": "GEMINI_API_KEY not found in environment",
             "help": "Create a .env file with: GEMINI_API_KEY=your_api_key_here"
@@ -152,13 +153,37 @@ def main():
     if generate_pdf_flag:
         sys.argv.remove('--pdf')
     
-    # Check if command provided as argument
-    if len(sys.argv) > 1:
-        command = ' '.join(sys.argv[1:])
-        single_command_mode(command, generate_pdf_flag)
-    else:
-        # Interactive mode
-        interactive_mode()
+    # Check for --session ID: answers across separate runs continue one document
+    session_id = None
+    if '--session' in sys.argv:
+        index = sys.argv.index('--session')
+        if index + 1 >= len(sys.argv):
+            print(json.dumps({"error": "--session needs a session id"}, indent=2))
+            sys.exit(1)
+        session_id = sys.argv[index + 1]
+        del sys.argv[index:index + 2]
+        # Separate runs need a store that outlives the process
+        os.environ.setdefault('INVOICE_SESSION_STORE', 'sqlite')
+    
+    # Check for --memory-profile flag (or MEMORY_PROFILE=1): tracemalloc report on exit
+    memory = get_memory_monitor()
+    if '--memory-profile' in sys.argv:
+        sys.argv.remove('--memory-profile')
+        memory.start()
+    memory.checkpoint("start")
+    
+    try:
+        # Check if command provided as argument
+        if len(sys.argv) > 1:
+            command = ' '.join(sys.argv[1:])
+            single_command_mode(command, generate_pdf_flag, session_id)
+        else:
+            # Interactive mode
+            interactive_mode()
+    finally:
+        if memory.enabled:
+            memory.checkpoint("end")
+            print("\n" + memory.format_report(), file=sys.stderr)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,613 @@
+"""
+Rule-based fast path for common Hinglish document commands
+
+Handles the everyday shapes of /invoice traffic without a model call:
+
+    make gst bill for CJ 50 bag cement @380
+    kachha bill Ramesh 2000
+    parchi 500 cash
+    estimate for Verma ji 20 bori cement 370 each aur 100 kg sariya @65
+
+A command is answered locally only when the parser is confident: exactly
+one document type is named, every remaining word is understood (a party
+name, items, amounts, payment details or filler), and the fields that
+validate_document requires are present. Anything else returns a fallback
+reason and goes to the LLM as before.
+
+Run `python -m invoice_agent.miscFiles.fast_parser commands.txt` to report
+coverage and fallback reasons over a file of commands (one per line).
+"""
+
+import re
+import copy
+import random
+import threading
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.metrics import INVOICE_FAST_PATH
+from invoice_agent.schemas import (
+    BILL_OF_SUPPLY_SCHEMA,
+    GST_INVOICE_SCHEMA,
+    PAYMENT_RECEIPT_SCHEMA,
+    QUOTATION_SCHEMA,
+)
+from invoice_agent.utils.date_utils import get_quotation_validity_date, get_today_date
+
+# Phrases naming each document type (matched on word boundaries, longest first)
+DOCUMENT_PHRASES = {
+    "gst_invoice": ["gst invoice", "gst bill", "tax invoice", "pakka bill", "pakka", "pucca bill", "gst"],
+    "bill_of_supply": ["bill of supply", "kachha bill", "kacha bill", "kachcha bill", "kachha", "kacha", "cash memo"],
+    "quotation": ["quotation", "quote", "estimate", "estimation"],
+    "payment_receipt": ["payment receipt", "receipt", "parchi", "rasid", "raseed", "payment mila", "received",
+                        "mila", "mile", "jama"],
+}
+
+DOCUMENT_PATTERNS = {
+    doc_type: [re.compile(rf"\b{re.escape(phrase)}\b") for phrase in sorted(phrases, key=len, reverse=True)]
+    for doc_type, phrases in DOCUMENT_PHRASES.items()
+}
+
+# Document number prefixes per type
+NUMBER_PREFIXES = {
+    "gst_invoice": "INV",
+    "bill_of_supply": "BOS",
+    "quotation": "QT",
+    "payment_receipt": "RCP",
+}
+
+# Known materials: (description, HSN code, default unit); HSN codes follow the system prompt
+MATERIALS = {
+    "cement": ("Cement", "2523", "bag"),
+    "wire": ("Electrical Wire", "8536", "bundle"),
+    "switch": ("Electrical Switch", "8536", "piece"),
+    "mcb": ("MCB", "8536", "piece"),
+    "steel": ("Steel Rod", "7214", "kg"),
+    "sariya": ("Steel Rod", "7214", "kg"),
+    "saria": ("Steel Rod", "7214", "kg"),
+    "rod": ("Steel Rod", "7214", "kg"),
+    "tmt": ("TMT Bar", "7214", "kg"),
+    "iron": ("Iron", "7214", "kg"),
+    "paint": ("Paint", "3208", "litre"),
+    "brick": ("Bricks", "6901", "piece"),
+    "bricks": ("Bricks", "6901", "piece"),
+    "int": ("Bricks", "6901", "piece"),
+    "eent": ("Bricks", "6901", "piece"),
+}
+
+UNITS = {
+    "bag": "bag", "bags": "bag", "bori": "bag", "boriyan": "bag",
+    "kg": "kg", "kgs": "kg", "kilo": "kg",
+    "pc": "piece", "pcs": "piece", "piece": "piece", "pieces": "piece", "nos": "Nos", "no": "Nos",
+    "unit": "Nos", "units": "Nos",
+    "litre": "litre", "litres": "litre", "liter": "litre", "liters": "litre", "ltr": "litre",
+    "bundle": "bundle", "bundles": "bundle",
+    "meter": "meter", "meters": "meter", "mtr": "meter",
+    "box": "box", "boxes": "box", "packet": "packet", "packets": "packet", "pkt": "packet",
+    "ton": "ton", "tons": "ton", "tonne": "ton",
+    "feet": "feet", "ft": "feet", "sqft": "sqft", "dozen": "dozen",
+}
+
+PAYMENT_MODES = {
+    "cash": "Cash", "nakad": "Cash", "nagad": "Cash",
+    "upi": "UPI", "gpay": "UPI", "phonepe": "UPI", "paytm": "UPI",
+    "cheque": "Cheque", "check": "Cheque",
+    "neft": "NEFT", "rtgs": "RTGS", "imps": "IMPS", "bank": "Bank Transfer",
+}
+
+# Words that carry no information for the document
+FILLER = {
+    "make", "banao", "bana", "banado", "banana", "do", "de", "dena", "create", "generate", "please", "plz", "pls",
+    "bhai", "ji", "ek", "a", "an", "the", "bill", "invoice", "ka", "ki", "ke", "hai", "h", "of", "new", "naya",
+    "mujhe", "chahiye", "ye", "yeh", "liye", "wala", "wali", "sir", "me", "mein", "total", "amount",
+    "via", "by", "through", "mode", "paid", "in",
+}
+CURRENCY = {"rs", "rupee", "rupees", "rupaye", "rupay", "inr"}
+FILLER |= CURRENCY
+
+# Ordinary words that are never a party name ("receipt 500 cash advance")
+COMMON_WORDS = {
+    "tha", "thi", "hai", "hain", "hua", "hue", "gaya", "gaye", "kiya", "mila", "mile", "liya", "diya", "diye",
+    "se", "ko", "ne", "aur", "and", "or", "for", "from", "to", "return", "returned", "wapas", "wapis", "vapas",
+    "refund", "advance", "due", "pending", "baaki", "baki", "balance", "payment", "pay", "received", "jama",
+    "udhaar", "udhar", "sale", "purchase", "goods", "maal", "saman", "samaan", "kharcha", "expense", "rent",
+    "kiraya", "salary", "aaj", "today", "kal", "abhi", "month", "mahina", "full", "half", "partial", "extra",
+    "done", "sent", "transfer", "customer", "party", "naam", "receipt", "parchi", "cash", "karo", "kar", "kardo",
+    "cancel", "delete", "hatao", "edit", "change", "update", "galat", "sahi", "each", "per",
+}
+# Words showing money going out ("Ramesh ko diya", "cash return"): such a
+# "receipt" is a payment made by the shop, which the model has to read
+OUTGOING = {
+    "diya", "diye", "di", "ko", "return", "returned", "wapas", "wapis", "vapas", "refund", "refunded",
+    "bheja", "bheje", "gave", "given",
+}
+
+GSTIN = re.compile(r"\b\d{2}[a-z]{5}\d{4}[a-z][1-9a-z]z[0-9a-z]\b", re.IGNORECASE)
+NUMBER = r"\d+(?:\.\d+)?(?:\s*(?:k|lakh|lac|hazar|hazaar|thousand)\b)?"
+RATE_MARK = r"(?:@|at|rate|x|\*|rs|₹|ke bhav|bhav)"
+RATE_TAIL = r"(?:\s*(?:rs|rupees?|rupaye|rupay|inr))?(?:\s*(?:each|per\s+[a-z]+|/\s*[a-z]+|ka|ke|wala))?"
+UNIT_WORDS = "|".join(sorted(UNITS, key=len, reverse=True))
+
+# "50 bag cement @380", "10 bags cement 350 rupees each", "50 cement @ 380"
+ITEM_QTY_FIRST = re.compile(
+    rf"(?P<qty>{NUMBER})\s*(?:(?P<unit>{UNIT_WORDS})\b)?\s*(?P<desc>[a-z][a-z ]*?)"
+    rf"(?:\s*(?P<mark>(?:{RATE_MARK}\s*)+)(?P<rate>{NUMBER})(?P<tail>{RATE_TAIL})"
+    rf"|\s+(?P<rate2>{NUMBER})(?P<tail2>{RATE_TAIL}))?"
+)
+# "cement 50 bag @380"
+ITEM_DESC_FIRST = re.compile(
+    rf"(?P<desc>[a-z][a-z ]*?)\s+(?P<qty>{NUMBER})\s*(?:(?P<unit>{UNIT_WORDS})\b)?"
+    rf"(?:\s*(?P<mark>(?:{RATE_MARK}\s*)+)(?P<rate>{NUMBER})(?P<tail>{RATE_TAIL}))?"
+)
+ITEM_SEPARATOR = re.compile(r"\s*(?:,|;|\+|\band\b|\baur\b|\bor\b)\s*")
+PARTY_BEFORE = re.compile(r"\b(?:for|to|from|customer|party|naam)\s+(?P<name>[a-z][a-z.&']*(?:\s+[a-z][a-z.&']*){0,2})")
+PARTY_AFTER = re.compile(r"(?P<name>[a-z][a-z.&']*(?:\s+[a-z][a-z.&']*){0,2})\s+(?:ko|se|ne|ke liye|ka bill|ki bill)\b")
+BALANCE = re.compile(
+    rf"\b(?:baaki|baki|balance|pichla|previous|purana|udhaar)\s*(?:balance|baaki|tha|hai)?\s*(?P<amount>{NUMBER})"
+    r"(?:\s+(?:tha|thi|hai)\b)?"
+)
+
+
+@dataclass
+class ParseResult:
+    """Outcome of parsing one command"""
+    document: Optional[Dict[str, Any]]
+    reason: Optional[str] = None
+    leftover: List[str] = field(default_factory=list)
+
+    @property
+    def confident(self) -> bool:
+        return self.document is not None
+
+
+def parse_number(text: str) -> float:
+    """'2,000' / '2k' / '1.5 lakh' / '380' -> float"""
+    text = text.replace(",", "").strip()
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)\s*(k|lakh|lac|hazar|hazaar|thousand)?", text)
+    if not match:
+        raise ValueError(f"Not a number: {text}")
+    value = float(match.group(1))
+    multiplier = {"k": 1e3, "hazar": 1e3, "hazaar": 1e3, "thousand": 1e3, "lakh": 1e5, "lac": 1e5}
+    return value * multiplier.get(match.group(2) or "", 1)
+
+
+def new_document_number(doc_type: str) -> str:
+    """Fresh document number such as INV-20250101-4821"""
+    return f"{NUMBER_PREFIXES[doc_type]}-{datetime.now():%Y%m%d}-{random.randint(1000, 9999)}"
+
+
+def normalize_text(command: str) -> str:
+    """Lower-case, split numbers from words, spell out ₹ and drop digit grouping"""
+    text = command.lower().replace("₹", " rs ").replace("/-", " ")
+    text = re.sub(r"(?<=\d),(?=\d)", "", text)
+    text = re.sub(r"\brs\.", "rs", text)
+    text = re.sub(r"(?<=[a-z])(?=\d)|(?<=\d)(?=[a-z@])|@", lambda m: " @ " if m.group() == "@" else " ", text)
+    text = re.sub(r"(\d) (k|lakh|lac)\b", r"\1\2", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _remove(text: str, start: int, end: int) -> str:
+    return re.sub(r"\s+", " ", f"{text[:start]} {text[end:]}").strip()
+
+
+def _document_type(text: str) -> Tuple[Optional[str], str, Optional[str]]:
+    """(doc_type, text without the phrase, failure reason)"""
+    found = []
+    for doc_type, patterns in DOCUMENT_PATTERNS.items():
+        for pattern in patterns:
+            match = pattern.search(text)
+            if match:
+                found.append((doc_type, match))
+                break
+    types = {doc_type for doc_type, _ in found}
+    if not types:
+        return None, text, "no_document_type"
+    if len(types) > 1:
+        return None, text, "ambiguous_document_type"
+    for _, match in sorted(found, key=lambda f: f[1].start(), reverse=True):
+        text = _remove(text, match.start(), match.end())
+    return found[0][0], text, None
+
+
+def _is_vocabulary(word: str) -> bool:
+    return (
+        word in FILLER or word in COMMON_WORDS or word in UNITS or word in MATERIALS or word in PAYMENT_MODES
+        or re.fullmatch(NUMBER, word) is not None
+    )
+
+
+def _name_like(word: str) -> bool:
+    return re.fullmatch(r"[a-z][a-z.&']*", word) is not None and not _is_vocabulary(word)
+
+
+def _party(text: str, original: str) -> Tuple[Optional[str], str]:
+    """
+    (party name in its original casing, text without it)
+
+    The name is "" when the command names no party and None when the name
+    is ambiguous: a marked name ("for ...", "... ko") whose run is broken by
+    known words with more unknown words beyond them, two different
+    candidates, or more than one run of unknown words (or one longer than
+    three words) where a bare name would be taken. Callers fall back to the
+    model on None.
+    """
+    found = []
+    for pattern in (PARTY_BEFORE, PARTY_AFTER):
+        match = pattern.search(text)
+        if not match:
+            continue
+        words = match.group("name").split()
+        if pattern is PARTY_BEFORE:
+            # "for CJ ...": the name runs up to the first known word
+            size = next((i for i, word in enumerate(words) if _is_vocabulary(word)), len(words))
+            name, others = words[:size], words[size:]
+        else:
+            # "... CJ ko": the name runs back to the last known word, past
+            # filler right before the marker ("Verma ji ko")
+            end = len(words)
+            while end and words[end - 1] in FILLER:
+                end -= 1
+            size = next((i for i, word in enumerate(reversed(words[:end])) if _is_vocabulary(word)), end)
+            name, others = words[end - size:end], words[:end - size] + words[end:]
+        if any(_name_like(word) for word in others):
+            return None, text
+        if name:
+            rest = f"{text[:match.start()]} {' '.join(others)} {text[match.end():]}"
+            found.append((" ".join(name), re.sub(r"\s+", " ", rest).strip()))
+    if len({name for name, _ in found}) > 1:
+        return None, text
+    if found:
+        name, rest = found[0]
+        return _original_casing(name, original), rest
+
+    # Bare name: the one run of unknown words, at the start or the end
+    words = text.split()
+    runs: List[List[int]] = []
+    for i, word in enumerate(words):
+        if not _name_like(word):
+            continue
+        if runs and runs[-1][1] == i:
+            runs[-1][1] = i + 1
+        else:
+            runs.append([i, i + 1])
+    if not runs:
+        return "", text
+    start, end = runs[0]
+    if len(runs) > 1 or end - start > 3:
+        return None, text
+    if start != 0 and end != len(words):
+        return "", text
+    rest = " ".join(words[:start] + words[end:])
+    return _original_casing(" ".join(words[start:end]), original), rest
+
+
+def _original_casing(name: str, original: str) -> str:
+    match = re.search(r"\s+".join(re.escape(word) for word in name.split()), original, re.IGNORECASE)
+    value = match.group(0) if match else name
+    return value.title() if value.islower() else value
+
+
+def _material(desc: str) -> Tuple[str, Optional[str], Optional[str]]:
+    """(description, HSN or None, default unit or None)"""
+    words = [word for word in desc.split() if word not in FILLER]
+    for word in words:
+        if word in MATERIALS:
+            return MATERIALS[word]
+    return " ".join(words).title(), None, None
+
+
+def _items(text: str) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """Parse line items; returns (items, unparsed chunks)"""
+    items, leftover = [], []
+    for chunk in ITEM_SEPARATOR.split(text):
+        # Currency words stay: they mark the number before them as a rate
+        chunk = " ".join(word for word in chunk.split() if word not in FILLER or word in CURRENCY)
+        if not chunk:
+            continue
+        item = None
+        for pattern in (ITEM_QTY_FIRST, ITEM_DESC_FIRST):
+            match = pattern.fullmatch(chunk)
+            if not match:
+                continue
+            groups = match.groupdict()
+            rate = groups.get("rate") or groups.get("rate2")
+            if groups.get("rate2") and not (groups.get("tail2") or "").strip():
+                # A bare trailing number is ambiguous (rate or total?)
+                continue
+            description, hsn, default_unit = _material(groups["desc"])
+            if not description:
+                continue
+            quantity = parse_number(groups["qty"])
+            item = {
+                "description": description,
+                "hsn_code": hsn,
+                "quantity": int(quantity) if quantity.is_integer() else quantity,
+                "unit": UNITS.get(groups.get("unit") or "", default_unit or "Nos"),
+                "rate": parse_number(rate) if rate else None,
+            }
+            break
+        if item is None:
+            leftover.append(chunk)
+        else:
+            items.append(item)
+    return items, leftover
+
+
+def parse_items(text: str) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    Line items in free text such as "50 bag cement @380, 10 kg sariya 65 each"
+
+    Returns:
+        (items, unparsed chunks); an item's rate or hsn_code is None when
+        the text does not give it
+    """
+    return _items(normalize_text(text))
+
+
+def _lump_sum(text: str) -> Optional[float]:
+    """The amount when the rest of the command is a single number"""
+    words = [word for word in text.split() if word not in FILLER]
+    if len(words) == 1 and re.fullmatch(NUMBER, words[0]):
+        return parse_number(words[0])
+    return None
+
+
+def money(value: float):
+    """Round to paise; whole amounts as int"""
+    value = round(value, 2)
+    return int(value) if float(value).is_integer() else value
+
+
+def _build_items(items: List[Dict[str, Any]], keep: Tuple[str, ...]) -> List[Dict[str, Any]]:
+    built = []
+    for item in items:
+        amount = item["quantity"] * item["rate"] if item["rate"] is not None else None
+        full = dict(item, rate=money(item["rate"]) if item["rate"] is not None else None,
+                    amount=money(amount) if amount is not None else None)
+        built.append({key: full[key] for key in keep})
+    return built
+
+
+def _receipt(text: str, original: str) -> ParseResult:
+    if OUTGOING.intersection(text.split()):
+        return ParseResult(None, "outgoing_payment")
+    doc = copy.deepcopy(PAYMENT_RECEIPT_SCHEMA)
+
+    previous = None
+    match = BALANCE.search(text)
+    if match:
+        previous = parse_number(match.group("amount"))
+        text = _remove(text, match.start(), match.end())
+
+    mode = None
+    for word, label in PAYMENT_MODES.items():
+        found = re.search(rf"\b{word}\b", text)
+        if found:
+            mode = label
+            text = _remove(text, found.start(), found.end())
+            break
+
+    udhaar = re.search(r"\budhaar\b|\budhar\b", text)
+    if udhaar:
+        text = _remove(text, udhaar.start(), udhaar.end())
+    text = re.sub(r"\b(?:payment|mila|mile|received|jama|liya)\b", " ", text)
+
+    name, text = _party(text, original)
+    if name is None:
+        return ParseResult(None, "ambiguous_party")
+    amount = _lump_sum(text)
+    if amount is None:
+        return ParseResult(None, "no_amount" if not text.strip() else "unparsed", [text])
+    if amount <= 0:
+        return ParseResult(None, "zero_amount")
+    if mode is None:
+        return ParseResult(None, "no_payment_mode")
+    if udhaar and previous is None:
+        return ParseResult(None, "udhaar_without_balance")
+    if previous is not None and amount > previous:
+        # More than the balance: an advance or a misread amount
+        return ParseResult(None, "payment_exceeds_balance")
+
+    doc.update(
+        receipt_number=new_document_number("payment_receipt"),
+        receipt_date=get_today_date(),
+        received_from=name,
+        amount_received=money(amount),
+        payment_mode=mode,
+        payment_for="Udhaar payment" if udhaar or previous is not None else "Goods",
+        previous_balance=money(previous or 0),
+        current_balance=money(previous - amount) if previous is not None else 0,
+    )
+    return ParseResult(doc)
+
+
+def parse_command(command: str) -> ParseResult:
+    """
+    Parse a document command without the model
+
+    Args:
+        command: Natural language command (Hinglish/English)
+
+    Returns:
+        ParseResult; .document matches one of invoice_agent.schemas and
+        passes validate_document when confident, otherwise .reason says
+        why the LLM is needed
+    """
+    result = _parse_command(command)
+    if result.document is None:
+        return result
+    # Imported here: invoice_agent imports this module
+    from invoice_agent.miscFiles.invoice_agent import validate_document
+    is_valid, missing = validate_document(result.document)
+    if not is_valid:
+        return ParseResult(None, "incomplete", missing)
+    return result
+
+
+def _parse_command(command: str) -> ParseResult:
+    gstin = GSTIN.search(command)
+    if gstin:
+        # Before normalising, which splits letters from digits
+        command = _remove(command, gstin.start(), gstin.end())
+        command = re.sub(r"\bgstin\b|\bgst no\.?", " ", command, flags=re.IGNORECASE)
+
+    text = normalize_text(command)
+    if not text:
+        return ParseResult(None, "empty")
+
+    doc_type, text, reason = _document_type(text)
+    if doc_type is None:
+        return ParseResult(None, reason)
+
+    if doc_type == "payment_receipt":
+        return _receipt(text, command)
+
+    name, text = _party(text, command)
+    if name is None:
+        return ParseResult(None, "ambiguous_party")
+    lump_sum = _lump_sum(text)
+    if lump_sum is not None:
+        items, leftover = [], []
+    else:
+        items, leftover = _items(text)
+    if leftover:
+        return ParseResult(None, "unparsed", leftover)
+    if not name:
+        return ParseResult(None, "no_party")
+    if (lump_sum is not None and lump_sum <= 0) or any(
+        item["quantity"] <= 0 or (item["rate"] is not None and item["rate"] <= 0) for item in items
+    ):
+        return ParseResult(None, "zero_amount")
+
+    today = get_today_date()
+    if doc_type == "gst_invoice":
+        if not items:
+            return ParseResult(None, "no_items")
+        if any(item["rate"] is None for item in items):
+            return ParseResult(None, "missing_rate")
+        if any(item["hsn_code"] is None for item in items):
+            return ParseResult(None, "unknown_hsn")
+        doc = copy.deepcopy(GST_INVOICE_SCHEMA)
+        lines = _build_items(items, ("description", "hsn_code", "quantity", "unit", "rate", "amount"))
+        subtotal = sum(line["amount"] for line in lines)
+        cgst = round(subtotal * doc["cgst_rate"] / 100, 2)
+        sgst = round(subtotal * doc["sgst_rate"] / 100, 2)
+        doc.update(
+            invoice_number=new_document_number(doc_type),
+            invoice_date=today,
+            customer_name=name,
+            customer_gstin=gstin.group(0).upper() if gstin else "",
+            items=lines,
+            subtotal=money(subtotal),
+            cgst_amount=money(cgst),
+            sgst_amount=money(sgst),
+            total=money(subtotal + cgst + sgst),
+        )
+        return ParseResult(doc)
+
+    if doc_type == "bill_of_supply":
+        if lump_sum is not None:
+            lines = [{"description": "Goods", "quantity": 1, "unit": "Nos", "amount": money(lump_sum)}]
+        elif items and all(item["rate"] is not None for item in items):
+            lines = _build_items(items, ("description", "quantity", "unit", "amount"))
+        else:
+            return ParseResult(None, "missing_rate" if items else "no_items")
+        doc = copy.deepcopy(BILL_OF_SUPPLY_SCHEMA)
+        doc.update(
+            bill_number=new_document_number(doc_type),
+            bill_date=today,
+            customer_name=name,
+            items=lines,
+            total=money(sum(line["amount"] for line in lines)),
+        )
+        return ParseResult(doc)
+
+    # Quotation
+    if lump_sum is not None:
+        lines = [{"description": "Goods", "quantity": 1, "unit": "Nos", "rate": money(lump_sum),
+                  "amount": money(lump_sum)}]
+    elif items and all(item["rate"] is not None for item in items):
+        lines = _build_items(items, ("description", "quantity", "unit", "rate", "amount"))
+    else:
+        return ParseResult(None, "missing_rate" if items else "no_items")
+    doc = copy.deepcopy(QUOTATION_SCHEMA)
+    subtotal = money(sum(line["amount"] for line in lines))
+    doc.update(
+        quotation_number=new_document_number(doc_type),
+        quotation_date=today,
+        valid_until=get_quotation_validity_date(),
+        customer_name=name,
+        items=lines,
+        subtotal=subtotal,
+        total_estimate=subtotal,
+    )
+    return ParseResult(doc)
+
+
+class FastPathStats:
+    """Coverage of the fast path: commands handled locally vs sent to the LLM"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.handled: Counter = Counter()
+        self.fallbacks: Counter = Counter()
+
+    def record(self, result: ParseResult):
+        with self._lock:
+            if result.confident:
+                self.handled[result.document["document_type"]] += 1
+            else:
+                self.fallbacks[result.reason] += 1
+        if result.confident:
+            INVOICE_FAST_PATH.labels("handled", result.document["document_type"]).inc()
+        else:
+            INVOICE_FAST_PATH.labels("fallback", result.reason).inc()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            handled = sum(self.handled.values())
+            fallbacks = sum(self.fallbacks.values())
+            total = handled + fallbacks
+            return {
+                "commands": total,
+                "handled": handled,
+                "fallbacks": fallbacks,
+                "coverage": round(handled / total, 4) if total else None,
+                "fallback_rate": round(fallbacks / total, 4) if total else None,
+                "handled_by_type": dict(self.handled),
+                "fallback_reasons": dict(self.fallbacks),
+            }
+
+
+fast_path_stats = FastPathStats()
+
+
+if __name__ == "__main__":
+    import sys
+    import json
+
+    if len(sys.argv) < 2:
+        print("Usage: python -m invoice_agent.miscFiles.fast_parser <commands.txt | \"command\">")
+        sys.exit(1)
+
+    try:
+        with open(sys.argv[1], encoding="utf-8") as f:
+            commands = [line.strip() for line in f if line.strip()]
+    except OSError:
+        commands = [" ".join(sys.argv[1:])]
+
+    for command in commands:
+        result = parse_command(command)
+        fast_path_stats.record(result)
+        if len(commands) == 1:
+            print(json.dumps(result.document, indent=2, ensure_ascii=False) if result.confident
+                  else f"↪️ Falls back to the LLM: {result.reason} {result.leftover or ''}")
+        elif not result.confident:
+            print(f"↪️ {result.reason:<24} {command}")
+
+    stats = fast_path_stats.stats()
+    print(f"\n⚡ Fast path coverage: {stats['handled']}/{stats['commands']} ({(stats['coverage'] or 0):.0%})")
+    for reason, count in sorted(stats["fallback_reasons"].items(), key=lambda r: -r[1]):
+        print(f"   {reason:<24} {count}")
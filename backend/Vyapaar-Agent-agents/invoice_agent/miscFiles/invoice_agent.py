@@ -3,21 +3,66 @@ Core Agent Logic for Transaction Document Generation
 """
 
 import os
+import re
 import json
-from typing import Tuple, Optional
+import threading
+import time
+from typing import Callable, Tuple, Optional
 from dotenv import load_dotenv
-from google import genai
 from datetime import datetime
 
-from invoice_agent.prompts.transaction_prompt import get_transaction_system_prompt, get_clarification_prompt
+from core.clients import get_registry
+from core.context_cache import get_prompt_cache
+from core.metrics import (
+    INVOICE_CLARIFICATION,
+    INVOICE_PATCHES,
+    INVOICE_RESULTS,
+    INVOICE_STAGE_SECONDS,
+    record_token_usage,
+)
+from core.model_backend import ModelResponse
+from core.resilience import get_caller
+from core.tracing import annotate, traced
+from invoice_agent.prompts.transaction_prompt import (
+    CLARIFICATION_TEMPLATES,
+    get_patch_prompt,
+    get_transaction_system_prompt,
+)
+from invoice_agent.miscFiles.fast_parser import fast_path_stats, parse_command
+from invoice_agent.miscFiles.patches import apply_patch, is_new_command, parse_answer
+from invoice_agent.miscFiles.response_cache import get_response_cache
+from invoice_agent.miscFiles.sessions import InvoiceSession, get_session_store
+from invoice_agent.miscFiles.stream_parser import DocumentStreamParser, emit_document
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Gemini client
-client = genai.Client(api_key=os.getenv('GEMINI_API_KEY'))
+# Deadline/retry/breaker policy (override via RESILIENCE_INVOICE_GENERATE_* env vars)
+generate_caller = get_caller("invoice_generate", deadline_seconds=30.0, max_retries=2)
+patch_caller = get_caller("invoice_patch", deadline_seconds=10.0, max_retries=1)
 
+# Stage latency histograms, bound once so the hot path only observes
+STAGE_TIMERS = {
+    stage: INVOICE_STAGE_SECONDS.labels(stage)
+    for stage in ("fast_path", "cache", "prompt", "model", "parse", "validate", "clarify", "save", "patch")
+}
 
+CLARIFICATION_SOURCES = {source: INVOICE_CLARIFICATION.labels(source) for source in ("model", "template")}
+PATCH_SOURCES = {source: INVOICE_PATCHES.labels(source) for source in ("local", "model", "failed")}
+MAX_CLARIFICATION_QUESTIONS = 3
+ITEM_FIELD = re.compile(r"items\[(\d+)\]\.(\w+)")
+
+# Answer common command shapes with the local parser before calling the model
+FAST_PATH_ENABLED = os.getenv("INVOICE_FAST_PATH", "true").strip().lower() in ("1", "true", "yes")
+
+# Serve repeats of a command from the response cache instead of the model
+RESPONSE_CACHE_ENABLED = os.getenv("INVOICE_RESPONSE_CACHE", "true").strip().lower() in ("1", "true", "yes")
+
+# on_event(event, data): receives header/item/totals parts of the document as they are decoded
+EventCallback = Callable[[str, dict], None]
+
+
+@traced("invoice.validate_document")
 def validate_document(doc: dict) -> Tuple[bool, list]:
     """
     Validates extracted document JSON.
@@ -72,6 +117,7 @@ def validate_document(doc: dict) -> Tuple[bool, list]:
                 missing.append("previous_balance")
 
     return len(missing) == 0, missing
+@traced("invoice.save_document_json")
 def save_document_json(document: dict, base_dir: str = "outputs/json") -> str:
     """
     Saves the document JSON to disk in a structured folder.
@@ -95,124 +141,383 @@ def save_document_json(document: dict, base_dir: str = "outputs/json") -> str:
 
     return file_path
 
-def generate_document_json(user_input: str) -> dict:
+def _stream_response(backend, model: str, contents, config: dict, on_event: EventCallback) -> ModelResponse:
+    """
+    Streams a generation, passing each decoded part of the document to on_event
+
+    Retries and hedging apply until the first chunk arrives; after that each
+    chunk must follow the previous one within the caller's deadline (see
+    ResilientCaller.stream).
+    """
+    chunks = generate_caller.stream(
+        lambda: backend.generate_stream(model=model, contents=contents, config=config)
+    )
+    parser = DocumentStreamParser()
+    texts, usage, served_by = [], {}, model
+    try:
+        for chunk in chunks:
+            texts.append(chunk.text)
+            usage = chunk.usage or usage
+            served_by = chunk.model
+            for event, data in parser.feed(chunk.text):
+                on_event(event, data)
+    finally:
+        chunks.close()
+    return ModelResponse("".join(texts), served_by, usage)
+
+
+@traced("invoice.generate_document_json")
+def generate_document_json(user_input: str, on_event: Optional[EventCallback] = None) -> dict:
     """
     Converts natural language input to structured JSON for transaction documents
     
     Args:
         user_input: Natural language command (Hinglish/English)
+        on_event: When given, the response is streamed and each part of the
+            document is passed to it as soon as it is decoded
         
     Returns:
         Dictionary with document data
     """
     try:
-        # Get system prompt
-        system_prompt = get_transaction_system_prompt()
-        
-        # Call Gemini API
-        response = client.models.generate_content(
-            model=os.getenv('MODEL_NAME', 'gemini-2.5-flash'),
-            contents=user_input,
-            config={
+        backend = get_registry().get_backend()
+        model = os.getenv('MODEL_NAME', 'gemini-2.5-flash')
+
+        # Get system prompt (served from the provider's context cache when possible)
+        with STAGE_TIMERS["prompt"].time():
+            system_prompt = get_transaction_system_prompt()
+            cached_content = get_prompt_cache().get(
+                backend, model, "invoice_generate", system_instruction=system_prompt
+            )
+
+        def call_model(prefix):
+            config = {
                 # CRITICAL: Wrap in float() because .env values are strings
                 'temperature': float(os.getenv('MODEL_TEMPERATURE', 0.3)),
-                
+
                 # Optional: Control response length
                 'max_output_tokens': int(os.getenv('MODEL_MAX_TOKENS', 1000)),
-                
-                'system_instruction': system_prompt
+
+                'http_options': generate_caller.http_options()
             }
-        )
-        
-        # Extract the response text
-        response_text = response.text.strip()
+            if prefix:
+                config['cached_content'] = prefix
+            else:
+                config['system_instruction'] = system_prompt
+
+            if on_event is not None:
+                return _stream_response(backend, model, user_input, config, on_event)
+            return generate_caller.call(lambda: backend.generate(
+                model=model,
+                contents=user_input,
+                config=config
+            ))
+
+        # Call Gemini API (inline prompt if the cached prefix has vanished)
+        with STAGE_TIMERS["model"].time():
+            response = get_prompt_cache().call_with_prefix(cached_content, "invoice_generate", call_model)
         
-        # Remove markdown code blocks if present
-        if response_text.startswith('```'):
-            lines = response_text.split('\n')
-            response_text = '\n'.join(lines[1:-1]) if len(lines) > 2 else response_text
-            response_text = response_text.replace('```json', '').replace('```', '').strip()
+        record_token_usage("invoice_generate", response.usage)
+        annotate(model=response.model, **response.usage)
         
-        # Parse JSON
-        document_data = json.loads(response_text)
+        with STAGE_TIMERS["parse"].time():
+            # Extract the response text
+            response_text = response.text.strip()
+            
+            # Remove markdown code blocks if present
+            if response_text.startswith('```'):
+                lines = response_text.split('\n')
+                response_text = '\n'.join(lines[1:-1]) if len(lines) > 2 else response_text
+                response_text = response_text.replace('```json', '').replace('```', '').strip()
+            
+            # Parse JSON
+            document_data = json.loads(response_text)
         
         return document_data
         
     except json.JSONDecodeError as e:
+        annotate(error="json_decode")
         return {
             "error": "Failed to parse JSON response",
             "details": str(e),
             "raw_response": response_text[:500] if 'response_text' in locals() else "No response"
         }
     except Exception as e:
+        annotate(error=f"{type(e).__name__}: {e}")
         return {
             "error": "Failed to generate document",
             "details": str(e)
         }
 
 
-def generate_clarification_questions(missing_fields: list, original_input: str) -> list:
+class ClarificationStats:
+    """Where clarification questions came from: the model's response or local templates"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {"model": 0, "template": 0}
+
+    def record(self, source: str):
+        with self._lock:
+            self.counts[source] += 1
+        CLARIFICATION_SOURCES[source].inc()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = sum(self.counts.values())
+            return {
+                "questions": total,
+                "from_model": self.counts["model"],
+                "from_template": self.counts["template"],
+                "fallback_rate": round(self.counts["template"] / total, 4) if total else None,
+            }
+
+
+clarification_stats = ClarificationStats()
+
+
+def _template_question(field: str, document: dict) -> str:
+    """Local question for a missing field (items[i].rate -> "<item> kis rate pe diya?")"""
+    match = ITEM_FIELD.fullmatch(field)
+    if match:
+        index, key = int(match.group(1)), match.group(2)
+        items = document.get("items") or []
+        item = items[index].get("description") if index < len(items) else None
+        template = CLARIFICATION_TEMPLATES.get(key)
+        if template:
+            return template.format(item=item or f"Item {index + 1}")
+    return CLARIFICATION_TEMPLATES.get(field, f"Please provide: {field}")
+
+
+@traced("invoice.generate_clarification_questions")
+def generate_clarification_questions(missing_fields: list, document: dict, model_questions=None) -> list:
     """
-    Generates natural clarification questions for missing fields
+    Picks clarification questions for the fields validate_document found missing
     
     Args:
-        missing_fields: List of missing field names
-        original_input: Original user input
+        missing_fields: Missing field names from validate_document
+        document: The partial document (for item names in templates)
+        model_questions: {field: question} the model returned with the document
         
     Returns:
-        List of clarification questions
+        Up to MAX_CLARIFICATION_QUESTIONS questions; the model's question is
+        used when it asked about the field, a local template otherwise
     """
-    try:
-        clarification_prompt = get_clarification_prompt(missing_fields, original_input)
-        
-        response = client.models.generate_content(
-            model='gemini-2.0-flash-exp',
-            contents=clarification_prompt,
-            config={
-                'temperature': 0.7
+    if not isinstance(model_questions, dict):
+        model_questions = {}
+    questions = []
+    fallbacks = 0
+    for field in missing_fields[:MAX_CLARIFICATION_QUESTIONS]:
+        question = model_questions.get(field)
+        if isinstance(question, str) and question.strip():
+            questions.append(question.strip())
+            clarification_stats.record("model")
+        else:
+            questions.append(_template_question(field, document))
+            clarification_stats.record("template")
+            fallbacks += 1
+    annotate(template_questions=fallbacks, model_questions=len(questions) - fallbacks)
+    return questions
+
+
+class PatchStats:
+    """How follow-up answers were applied: parsed locally, by the patch call, or not at all"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {"local": 0, "model": 0, "failed": 0}
+
+    def record(self, source: str):
+        with self._lock:
+            self.counts[source] += 1
+        PATCH_SOURCES[source].inc()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = sum(self.counts.values())
+            return {
+                "answers": total,
+                **self.counts,
+                "local_rate": round(self.counts["local"] / total, 4) if total else None,
             }
-        )
-        
+
+
+patch_stats = PatchStats()
+
+
+@traced("invoice.generate_patch_json")
+def generate_patch_json(answer: str, context: dict) -> dict:
+    """
+    Asks the model for a patch of the missing fields only
+
+    Args:
+        answer: The user's follow-up answer
+        context: Session context (partial_document, missing_fields, questions)
+
+    Returns:
+        {field: value} for the fields the answer gives; empty on failure
+    """
+    document = context["partial_document"]
+    missing_fields = context["missing_fields"]
+    questions = {
+        field: (context.get("questions") or {}).get(field) or _template_question(field, document)
+        for field in missing_fields
+    }
+    prompt = get_patch_prompt(
+        document.get("document_type", "document"), missing_fields, questions, document.get("items") or [], answer
+    )
+    try:
+        backend = get_registry().get_backend()
+        model = os.getenv('INVOICE_PATCH_MODEL') or os.getenv('MODEL_NAME', 'gemini-2.5-flash')
+        config = {
+            'temperature': 0.1,
+            'max_output_tokens': int(os.getenv('INVOICE_PATCH_MAX_TOKENS', 256)),
+            'response_mime_type': 'application/json',
+            'http_options': patch_caller.http_options()
+        }
+        with STAGE_TIMERS["model"].time():
+            response = patch_caller.call(lambda: backend.generate(model=model, contents=prompt, config=config))
+        record_token_usage("invoice_patch", response.usage)
+        annotate(patch_model=response.model, **response.usage)
+
         response_text = response.text.strip()
-        
-        # Remove markdown if present
         if response_text.startswith('```'):
-            lines = response_text.split('\n')
-            response_text = '\n'.join(lines[1:-1]) if len(lines) > 2 else response_text
-            response_text = response_text.replace('```json', '').replace('```', '').strip()
-        
-        questions = json.loads(response_text)
-        return questions if isinstance(questions, list) else [questions]
-        
+            response_text = response_text.strip('`').removeprefix('json').strip()
+        patch = json.loads(response_text)
     except Exception as e:
-        # Fallback to simple questions
-        return [f"Please provide: {field}" for field in missing_fields[:3]]
+        annotate(error=f"{type(e).__name__}: {e}")
+        return {}
+    if not isinstance(patch, dict):
+        return {}
+    # Only the fields that were asked for (plus whole items when items were missing)
+    return {field: value for field, value in patch.items() if field in missing_fields and value not in (None, "")}
+
+
+def _patch_document(answer: str, context: dict) -> Tuple[dict, dict]:
+    """Applies a follow-up answer to the partial document; returns (document, patch info)"""
+    document = context["partial_document"]
+    if not context.get("missing_fields"):
+        context = dict(context, missing_fields=validate_document(document)[1])
+    patch = parse_answer(answer, context["missing_fields"], document)
+    source = "local"
+    if patch is None:
+        patch = generate_patch_json(answer, context)
+        source = "model" if patch else "failed"
+    patch_stats.record(source)
+    annotate(patch_source=source, patch_fields=",".join(patch))
+    return apply_patch(document, patch), {"fields": list(patch), "source": source}
+
+
+def _initial_document(user_input: str, use_cache: bool, on_event: Optional[EventCallback] = None) -> dict:
+    """Fast path, then the response cache, then the model"""
+    document = None
+    if FAST_PATH_ENABLED:
+        with STAGE_TIMERS["fast_path"].time():
+            parsed = parse_command(user_input)
+        fast_path_stats.record(parsed)
+        annotate(fast_path=parsed.confident, fast_path_reason=parsed.reason or "")
+        document = parsed.document
+    # Then a cached model answer for the same normalised command
+    cache = get_response_cache() if RESPONSE_CACHE_ENABLED and use_cache else None
+    if document is None and cache is not None:
+        with STAGE_TIMERS["cache"].time():
+            document = cache.get(user_input)
+        annotate(cache_hit=document is not None)
+    if document is None:
+        document = generate_document_json(user_input, on_event)
+        if cache is not None:
+            cache.put(user_input, document)
+    else:
+        # Nothing to stream: the whole document is ready at once
+        emit_document(document, on_event)
+    return document
 
 
-def process_user_input(user_input: str, conversation_context: Optional[dict] = None) -> dict:
+@traced("invoice.process_user_input")
+def process_user_input(
+    user_input: str,
+    conversation_context: Optional[dict] = None,
+    session_id: Optional[str] = None,
+    on_event: Optional[EventCallback] = None,
+) -> dict:
     """
     Main processing function with validation and clarification
     
     Args:
-        user_input: User's natural language input
+        user_input: User's natural language input, or an answer to the
+            clarification questions of the previous turn
         conversation_context: Optional context from previous clarifications
+            (partial_document, missing_fields, questions)
+        session_id: Optional session to continue; the context is loaded from
+            and saved to the session store
+        on_event: Optional callback receiving (event, data) for each part of
+            the document as it becomes available (header, item, totals)
         
     Returns:
         Dictionary with document data or clarification questions
     """
-    # Generate initial document
-    document = generate_document_json(user_input)
-    
+    store = get_session_store() if session_id else None
+    session = store.get(session_id) if store else None
+    use_cache = conversation_context is None
+    if session is not None and conversation_context is None:
+        conversation_context = session.context()
+
+    partial = (conversation_context or {}).get("partial_document")
+    patch_info = None
+    if partial and not is_new_command(user_input):
+        # A follow-up answer: patch the missing fields instead of regenerating
+        with STAGE_TIMERS["patch"].time():
+            document, patch_info = _patch_document(user_input, conversation_context)
+        emit_document(document, on_event)
+        model_questions = conversation_context.get("questions")
+        command = conversation_context.get("command", "")
+    else:
+        document = _initial_document(user_input, use_cache, on_event)
+        # Questions the model asked in the same response, keyed by field
+        model_questions = document.pop("clarification_questions", None)
+        command = user_input
+
+    result = _finish_document(document, model_questions)
+
+    if store is not None:
+        # A new command starts the session over; an answer continues it
+        continued = session is not None and patch_info is not None
+        if result.get("status") == "needs_clarification":
+            store.save(InvoiceSession(
+                session_id=session_id,
+                command=command,
+                document=document,
+                missing_fields=result["missing_fields"],
+                questions=model_questions if isinstance(model_questions, dict) else {},
+                turns=(session.turns if continued else []) + [user_input],
+                created_at=session.created_at if continued else time.time(),
+            ))
+        elif result.get("status") == "complete":
+            store.delete(session_id)
+        result["session_id"] = session_id
+    if patch_info is not None:
+        result["patch"] = patch_info
+    return result
+
+
+def _finish_document(document: dict, model_questions=None) -> dict:
+    """Validates a document, then saves it or asks for what is missing"""
     # Check for errors
     if "error" in document:
+        INVOICE_RESULTS.labels("error").inc()
+        annotate(outcome="error")
         return document
     
     # Validate document
-    is_valid, missing_fields = validate_document(document)
+    with STAGE_TIMERS["validate"].time():
+        is_valid, missing_fields = validate_document(document)
     
     if is_valid:
-        json_path = save_document_json(document)
+        with STAGE_TIMERS["save"].time():
+            json_path = save_document_json(document)
 
+        INVOICE_RESULTS.labels("complete").inc()
+        annotate(outcome="complete", document_type=document.get("document_type"))
         return {
             "status": "complete",
             "document": document,
@@ -220,9 +525,12 @@ def process_user_input(user_input: str, conversation_context: Optional[dict] = N
         }
 
     else:
-        # Generate clarification questions
-        questions = generate_clarification_questions(missing_fields, user_input)
+        # Pick clarification questions (no second model call)
+        with STAGE_TIMERS["clarify"].time():
+            questions = generate_clarification_questions(missing_fields, document, model_questions)
         
+        INVOICE_RESULTS.labels("needs_clarification").inc()
+        annotate(outcome="needs_clarification", missing_fields=",".join(missing_fields))
         return {
             "status": "needs_clarification",
             "missing_fields": missing_fields,
@@ -230,4 +538,3 @@ def process_user_input(user_input: str, conversation_context: Optional[dict] = N
             "partial_document": document
         }
     
-
@@ -0,0 +1,290 @@
+"""
+Incremental patches for partial documents
+
+A follow-up answer ("380 rate", "CJ Traders", "cash", "50 bag cement @380")
+is turned into a small patch keyed by validate_document field names:
+
+    {"items[0].rate": 380, "customer_name": "CJ Traders"}
+
+parse_answer does this locally when every word of the answer is accounted
+for; anything else goes to a tiny model call that only sees the missing
+fields and the answer (see get_patch_prompt). apply_patch then writes the
+values into a copy of the document and recomputes the derived amounts.
+"""
+
+import re
+import copy
+from typing import Any, Dict, List, Optional
+
+from invoice_agent.miscFiles.fast_parser import (
+    CURRENCY,
+    DOCUMENT_PATTERNS,
+    FILLER,
+    MATERIALS,
+    NUMBER,
+    PAYMENT_MODES,
+    UNITS,
+    money,
+    normalize_text,
+    parse_command,
+    parse_items,
+    parse_number,
+)
+from invoice_agent.schemas import (
+    BILL_OF_SUPPLY_SCHEMA,
+    GST_INVOICE_SCHEMA,
+    PAYMENT_RECEIPT_SCHEMA,
+    QUOTATION_SCHEMA,
+)
+
+SCHEMAS = {
+    "gst_invoice": GST_INVOICE_SCHEMA,
+    "bill_of_supply": BILL_OF_SUPPLY_SCHEMA,
+    "quotation": QUOTATION_SCHEMA,
+    "payment_receipt": PAYMENT_RECEIPT_SCHEMA,
+}
+
+ITEM_FIELD = re.compile(r"items\[(\d+)\]\.(\w+)")
+NUMERIC_FIELDS = {
+    "rate", "quantity", "rate_or_amount", "hsn_code", "total", "amount_received", "previous_balance",
+    "cgst_rate", "sgst_rate", "igst_rate",
+}
+DEFAULT_GST_RATE = 9  # Per half (CGST/SGST) when the document has no usable rate
+# Decoration the model or the user may leave around a number ("₹1,200", "18%")
+NUMBER_DECORATION = re.compile(r"^(?:₹|rs\.?|inr)\s*|\s*%$", re.IGNORECASE)
+RATE_FIELDS = ("rate", "rate_or_amount")
+
+# Words around a number that say what it is
+RATE_BEFORE = {"@", "at", "rate", "bhav", "per"}
+RATE_AFTER = {"each", "per", "ka", "ke"}
+# Words that only frame an answer ("naam CJ hai", "rate 380 tha")
+ANSWER_FILLER = FILLER | CURRENCY | RATE_BEFORE | RATE_AFTER | {
+    "naam", "name", "customer", "party", "qty", "quantity", "tha", "thi", "the", "hain", "baaki", "baki",
+    "balance", "pichla", "previous", "hsn", "code", "mila", "mile", "received", "lagao", "lagana", "laga",
+    "karo", "kar", "se", "pe", "par", "is", "was", "hua", "hue", "tak", "ko", "ne", "to", "for", "from", "aur",
+    "and",
+}
+# Words that show a reply is not a name ("kal dunga", "pata nahi"); such replies go to the model
+NOT_NAMES = {
+    "kal", "abhi", "baad", "nahi", "nahin", "na", "pata", "dunga", "dega", "bataunga", "batata", "later", "dont",
+    "don't", "know", "wait", "ruko", "same", "wahi", "pehle", "jaisa", "yes", "no", "haan", "ha", "ok", "okay",
+}
+
+
+def _field_key(field: str) -> str:
+    """'items[0].rate' -> 'rate'; top-level fields unchanged"""
+    match = ITEM_FIELD.fullmatch(field)
+    return match.group(2) if match else field
+
+
+def is_new_command(answer: str) -> bool:
+    """
+    Whether a reply to clarification questions is really a new command
+
+    It is when it names any document type, the open document's own included
+    ("make gst bill for Ramesh ..." while a GST bill for CJ is waiting), or
+    when the fast parser reads it as a complete command. Such input starts
+    the session over instead of patching the open document.
+    """
+    text = normalize_text(answer)
+    if any(pattern.search(text) for patterns in DOCUMENT_PATTERNS.values() for pattern in patterns):
+        return True
+    return parse_command(answer).confident
+
+
+def _schema_item(item: Dict[str, Any], doc_type: str) -> Dict[str, Any]:
+    """An item from a parse or a model patch, shaped like the schema's items"""
+    quantity = _amount(item.get("quantity"))
+    rate = _amount(item.get("rate"))
+    built = dict(SCHEMAS[doc_type]["items"][0])
+    built.update(
+        description=str(item.get("description") or ""),
+        quantity=quantity,
+        unit=str(item.get("unit") or ""),
+        amount=_amount(item.get("amount")) or money(quantity * rate),
+    )
+    if "rate" in built:
+        built["rate"] = rate
+    if "hsn_code" in built:
+        built["hsn_code"] = str(item.get("hsn_code") or "")
+    return built
+
+
+def parse_answer(answer: str, missing_fields: List[str], document: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Patch for the missing fields from a follow-up answer, without the model
+
+    Args:
+        answer: The user's reply
+        missing_fields: Fields validate_document reported for the document
+        document: The partial document
+
+    Returns:
+        {field: value}, or None when the answer is not fully understood
+    """
+    doc_type = document.get("document_type")
+    words = re.findall(r"[^\s,;!?]+", normalize_text(answer).rstrip("."))
+    if not words or doc_type not in SCHEMAS:
+        return None
+
+    if "items" in missing_fields:
+        items, leftover = parse_items(answer)
+        if not items or leftover:
+            return None
+        return {"items": [_schema_item(item, doc_type) for item in items]}
+
+    patch: Dict[str, Any] = {}
+    used = set()
+
+    if "payment_mode" in missing_fields:
+        for i, word in enumerate(words):
+            if word in PAYMENT_MODES:
+                patch["payment_mode"] = PAYMENT_MODES[word]
+                used.add(i)
+                break
+
+    # Numbers, labelled by the words next to them where possible
+    open_fields = [field for field in missing_fields if _field_key(field) in NUMERIC_FIELDS]
+    unlabelled = []
+    for i, word in enumerate(words):
+        if not re.fullmatch(NUMBER, word):
+            continue
+        used.add(i)
+        before = words[i - 1] if i else ""
+        after = words[i + 1] if i + 1 < len(words) else ""
+        if after in UNITS:
+            wanted = ("quantity",)
+            used.add(i + 1)
+        elif before in RATE_BEFORE or after in RATE_AFTER or (after in CURRENCY and i + 2 < len(words)
+                                                                 and words[i + 2] in RATE_AFTER):
+            wanted = RATE_FIELDS
+        else:
+            unlabelled.append(word)
+            continue
+        field = next((f for f in open_fields if _field_key(f) in wanted), None)
+        if field is None:
+            return None
+        patch[field] = money(parse_number(word))
+        open_fields.remove(field)
+
+    if unlabelled:
+        # Unlabelled numbers only fill fields of one kind, in order ("380 aur 65" for two rates)
+        if len(unlabelled) != len(open_fields) or len({_field_key(f) for f in open_fields}) != 1:
+            return None
+        for field, word in zip(list(open_fields), unlabelled):
+            if _field_key(field) == "hsn_code" and not re.fullmatch(r"\d{4,8}", word):
+                return None
+            value = money(parse_number(word))
+            patch[field] = str(value) if _field_key(field) == "hsn_code" else value
+
+    # Whatever is left must be a name, units/materials already on the document, or filler
+    rest = [
+        (i, word) for i, word in enumerate(words)
+        if i not in used and word not in ANSWER_FILLER and word not in UNITS and word not in MATERIALS
+    ]
+    if rest:
+        if "customer_name" not in missing_fields or len(rest) > 4 or not all(
+            re.fullmatch(r"[a-z][a-z.&']*", word) and word not in NOT_NAMES and word not in PAYMENT_MODES
+            for _, word in rest
+        ):
+            return None
+        patch["customer_name"] = _original_casing([word for _, word in rest], answer)
+
+    return patch or None
+
+
+def _original_casing(words: List[str], answer: str) -> str:
+    match = re.search(r"\s+".join(re.escape(word) for word in words), answer, re.IGNORECASE)
+    name = match.group(0) if match else " ".join(words)
+    return name.title() if name.islower() else name
+
+
+def apply_patch(document: Dict[str, Any], patch: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Copy of document with the patch applied and amounts recomputed
+
+    Unknown fields and item indexes past the end are ignored; the document
+    type is never changed by a patch.
+    """
+    doc = copy.deepcopy(document)
+    schema = SCHEMAS.get(doc.get("document_type"), {})
+    item_keys = set(schema.get("items", [{}])[0]) if "items" in schema else set()
+
+    for field, value in patch.items():
+        match = ITEM_FIELD.fullmatch(field)
+        if match:
+            index, key = int(match.group(1)), match.group(2)
+            items = doc.get("items") or []
+            if index >= len(items):
+                continue
+            if key == "rate_or_amount":
+                key = "rate" if "rate" in item_keys else "amount"
+            if key in item_keys:
+                items[index][key] = str(value) if key == "hsn_code" else _number(value)
+        elif field == "items" and isinstance(value, list) and "items" in schema:
+            doc["items"] = [_schema_item(item, doc["document_type"]) for item in value if isinstance(item, dict)]
+        elif field in schema and field != "document_type":
+            doc[field] = _number(value) if isinstance(schema[field], (int, float)) else value
+
+    recompute_totals(doc)
+    return doc
+
+
+def _number(value: Any) -> Any:
+    """A number for numeric-looking values ("1,200", "₹500", "9%"); anything else unchanged"""
+    if isinstance(value, str):
+        try:
+            value = parse_number(NUMBER_DECORATION.sub("", value.strip()))
+        except ValueError:
+            return value
+    return money(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else value
+
+
+def _amount(value: Any):
+    """A number from a patch value; 0 when it is missing or not a number"""
+    value = _number(value) if value is not None else 0
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0
+
+
+def _gst_rate(doc: Dict[str, Any], field: str):
+    rate = _number(doc.get(field))
+    if isinstance(rate, (int, float)) and not isinstance(rate, bool):
+        doc[field] = rate
+        return rate
+    return DEFAULT_GST_RATE
+
+
+def recompute_totals(doc: Dict[str, Any]):
+    """
+    Refresh amounts that follow from the fields a patch may have changed
+
+    Values come from the model or the user and are often strings ("9",
+    "1,200"); each operand is coerced with _number first (and written back
+    when it parses), and one that is not a number counts as missing.
+    """
+    doc_type = doc.get("document_type")
+    items = [item for item in doc.get("items") or [] if isinstance(item, dict)]
+    for item in items:
+        for key in ("quantity", "rate", "amount"):
+            if key in item:
+                item[key] = _number(item[key])
+        if "rate" in item and _amount(item["rate"]) and _amount(item.get("quantity")):
+            item["amount"] = money(item["quantity"] * item["rate"])
+    amounts = [_amount(item.get("amount")) for item in items]
+    priced = bool(items) and all(amounts)
+    subtotal = money(sum(amounts))
+
+    if doc_type == "gst_invoice" and priced:
+        cgst = round(subtotal * _gst_rate(doc, "cgst_rate") / 100, 2)
+        sgst = round(subtotal * _gst_rate(doc, "sgst_rate") / 100, 2)
+        doc.update(subtotal=subtotal, cgst_amount=money(cgst), sgst_amount=money(sgst),
+                   total=money(subtotal + cgst + sgst))
+    elif doc_type == "bill_of_supply" and priced:
+        doc["total"] = subtotal
+    elif doc_type == "quotation" and priced:
+        doc.update(subtotal=subtotal, total_estimate=subtotal)
+    elif doc_type == "payment_receipt":
+        previous, received = _amount(doc.get("previous_balance")), _amount(doc.get("amount_received"))
+        if previous:
+            doc.update(previous_balance=previous, amount_received=received,
+                       current_balance=money(previous - received))
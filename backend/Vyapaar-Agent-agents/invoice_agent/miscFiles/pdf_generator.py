@@ -11,6 +11,7 @@ from reportlab.platypus import Table, TableStyle, Paragraph
 from reportlab.lib import colors
 from pathlib import Path
 from datetime import datetime
+from core.memory import memory_stage
 
 # Output directory
 OUTPUT_DIR = Path("outputs/pdf")
@@ -127,7 +128,7 @@ def generate_gst_invoice_pdf(data: dict) -> str:
     c.drawRightString(width - 20, y_pos, f"₹{data.get('total', 0):.2f}")
     
     # ============ Footer ============
-    c.setFont("Helvetica-Italic", 8)
+    c.setFont("Helvetica-Oblique", 8)
     c.drawString(20, 60, "Terms & Conditions:")
     c.setFont("Helvetica", 7)
     c.drawString(20, 50, "1. Payment due within 30 days")
@@ -219,7 +220,7 @@ def generate_bill_of_supply_pdf(data: dict) -> str:
     c.drawRightString(width - 20, y_pos, f"₹{data.get('total', 0):.2f}")
     
     # Note
-    c.setFont("Helvetica-Italic", 9)
+    c.setFont("Helvetica-Oblique", 9)
     c.drawString(20, y_pos - 30, data.get("note", "Bill of Supply - Composition Scheme"))
     
     # Footer
@@ -246,7 +247,7 @@ def generate_quotation_pdf(data: dict) -> str:
     c.setFont("Helvetica-Bold", 18)
     c.drawCentredString(width / 2, height - 30, "QUOTATION")
     
-    c.setFont("Helvetica-Italic", 9)
+    c.setFont("Helvetica-Oblique", 9)
     c.drawCentredString(width / 2, height - 45, "** Estimate Only - Not a Tax Invoice **")
     
     # Business details
@@ -312,7 +313,7 @@ def generate_quotation_pdf(data: dict) -> str:
     c.drawRightString(width - 20, y_pos, f"₹{data.get('subtotal', 0):.2f}")
     
     y_pos -= 15
-    c.setFont("Helvetica-Italic", 8)
+    c.setFont("Helvetica-Oblique", 8)
     c.drawRightString(width - 20, y_pos, data.get("tax_note", "GST Extra as applicable"))
     
     y_pos -= 20
@@ -321,7 +322,7 @@ def generate_quotation_pdf(data: dict) -> str:
     c.drawRightString(width - 20, y_pos, f"₹{data.get('total_estimate', 0):.2f}")
     
     # Note
-    c.setFont("Helvetica-Italic", 9)
+    c.setFont("Helvetica-Oblique", 9)
     c.drawString(20, y_pos - 30, data.get("note", "Estimate Only - Not a Tax Invoice"))
     
     # Footer
@@ -413,7 +414,7 @@ def generate_payment_receipt_pdf(data: dict) -> str:
         balance_table.drawOn(c, 60, y - 70)
     
     # Footer
-    c.setFont("Helvetica-Italic", 8)
+    c.setFont("Helvetica-Oblique", 8)
     c.drawString(20, 70, "This is a computer-generated receipt")
     
     c.setFont("Helvetica-Bold", 9)
@@ -438,16 +439,17 @@ def generate_pdf(data: dict) -> str:
     """
     doc_type = data.get("document_type")
     
-    if doc_type == "gst_invoice":
-        return generate_gst_invoice_pdf(data)
-    elif doc_type == "bill_of_supply":
-        return generate_bill_of_supply_pdf(data)
-    elif doc_type == "quotation":
-        return generate_quotation_pdf(data)
-    elif doc_type == "payment_receipt":
-        return generate_payment_receipt_pdf(data)
-    else:
-        raise ValueError(f"Unknown document type: {doc_type}")
+    with memory_stage(f"pdf.{doc_type}"):
+        if doc_type == "gst_invoice":
+            return generate_gst_invoice_pdf(data)
+        elif doc_type == "bill_of_supply":
+            return generate_bill_of_supply_pdf(data)
+        elif doc_type == "quotation":
+            return generate_quotation_pdf(data)
+        elif doc_type == "payment_receipt":
+            return generate_payment_receipt_pdf(data)
+        else:
+            raise ValueError(f"Unknown document type: {doc_type}")
 
 
 # ============ Business Configuration ============
@@ -0,0 +1,226 @@
+"""
+Response cache for repeated /invoice commands
+
+Shops send the same command many times a day ("make gst bill for CJ"), and
+every repeat used to be a fresh model call. Documents generated by the model
+are cached under a key built from:
+
+  - the normalised command: case, whitespace and punctuation, spelling
+    variants of the same Hinglish word (kacha/kachha, bori/bag, rupaye/rs)
+    and number formats (2,000 / 2k / 2 hazar / 2000.00 all become 2000)
+  - today's date, the transaction prompt version and the model name, so a
+    new day, a prompt change or a model switch naturally misses
+
+Fields that must be fresh are not served from the cache: the document
+number is always re-stamped on a hit, and dates that were today's defaults
+(document date, quotation validity) are re-computed. Entries expire after
+INVOICE_CACHE_TTL_SECONDS and the least recently used ones are evicted beyond
+INVOICE_CACHE_MAX_ITEMS.
+"""
+
+import os
+import re
+import copy
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.metrics import INVOICE_CACHE, INVOICE_CACHE_ENTRIES
+from invoice_agent.miscFiles.fast_parser import new_document_number
+from invoice_agent.prompts.transaction_prompt import TRANSACTION_PROMPT_VERSION
+from invoice_agent.utils.date_utils import get_quotation_validity_date, get_today_date
+
+# Spellings of the same word, mapped to one form
+VARIANTS = {
+    "kacha": "kachha", "kachcha": "kachha", "kaccha": "kachha",
+    "pucca": "pakka", "pakaa": "pakka", "pukka": "pakka",
+    "rupee": "rs", "rupees": "rs", "rupaye": "rs", "rupay": "rs", "rupiya": "rs", "inr": "rs",
+    "bags": "bag", "bori": "bag", "boriyan": "bag", "bore": "bag",
+    "kgs": "kg", "kilo": "kg", "kilos": "kg",
+    "pcs": "pc", "piece": "pc", "pieces": "pc",
+    "saria": "sariya", "sariye": "sariya",
+    "nagad": "nakad", "udhar": "udhaar", "baki": "baaki",
+    "raseed": "rasid", "receit": "receipt", "reciept": "receipt",
+    "quote": "quotation", "qoutation": "quotation",
+    "banao": "bana", "banado": "bana", "banana": "bana", "banade": "bana",
+    "plz": "please", "pls": "please",
+    "hazaar": "hazar", "hajar": "hazar", "lac": "lakh", "lacs": "lakh", "lakhs": "lakh",
+}
+
+# Number words applied to the number before them
+MULTIPLIERS = {"k": 1e3, "hazar": 1e3, "thousand": 1e3, "lakh": 1e5, "crore": 1e7}
+
+# Per document type: the number field and the date fields stamped at generation time
+FRESH_FIELDS: Dict[str, Tuple[str, Tuple[str, ...]]] = {
+    "gst_invoice": ("invoice_number", ("invoice_date",)),
+    "bill_of_supply": ("bill_number", ("bill_date",)),
+    "quotation": ("quotation_number", ("quotation_date", "valid_until")),
+    "payment_receipt": ("receipt_number", ("receipt_date",)),
+}
+DATE_STAMPS = {"valid_until": get_quotation_validity_date}
+
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else str(round(value, 4))
+
+
+def normalize_command(command: str) -> str:
+    """
+    Canonical form of a command for cache lookups
+
+    Args:
+        command: Natural language command (Hinglish/English)
+
+    Returns:
+        Lower-cased command with spelling variants and number formats unified,
+        e.g. "Kacha bill Ramesh ₹2,000/-" -> "kachha bill ramesh rs 2000"
+    """
+    text = command.lower().replace("₹", " rs ").replace("/-", " ")
+    text = re.sub(r"(?<=\d),(?=\d)", "", text)  # 2,000 and 1,50,000
+    text = re.sub(r"\brs\.", "rs", text)
+    text = re.sub(r"[!?;:\"'()\[\]]+|\.(?!\d)", " ", text)
+    text = re.sub(r"(?<=[a-z])(?=\d)|(?<=\d)(?=[a-z])", " ", text)
+    text = text.replace("@", " @ ").replace(",", " , ")
+
+    words: List[str] = []
+    for word in text.split():
+        word = VARIANTS.get(word, word)
+        if word in MULTIPLIERS and words and _NUMBER.fullmatch(words[-1]):
+            words[-1] = _format_number(float(words[-1]) * MULTIPLIERS[word])
+            continue
+        if _NUMBER.fullmatch(word):
+            word = _format_number(float(word))
+        words.append(word)
+    return " ".join(words).strip(" ,")
+
+
+class InvoiceResponseCache:
+    """
+    In-process TTL + LRU store of model-generated documents
+    """
+
+    def __init__(self, max_items: int = 512, ttl_seconds: float = 6 * 3600):
+        """
+        Args:
+            max_items: Least recently used entries beyond this are evicted
+            ttl_seconds: Age after which an entry is treated as missing
+        """
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "expired": 0, "evictions": 0, "uncacheable": 0}
+
+    @staticmethod
+    def make_key(command: str) -> str:
+        """Normalised command + date + prompt version + model"""
+        model = os.getenv("MODEL_NAME", "gemini-2.5-flash")
+        raw = f"{normalize_command(command)}|{get_today_date()}|{TRANSACTION_PROMPT_VERSION}|{model}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, command: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a command
+
+        Returns:
+            A copy of the cached document with a new document number and
+            fresh default dates, or None on a miss
+        """
+        key = self.make_key(command)
+        now = time.time()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None and now - cached[0] > self.ttl_seconds:
+                del self._entries[key]
+                self._count("expired")
+                cached = None
+            if cached is None:
+                self._count("misses")
+                return None
+            self._entries.move_to_end(key)
+            self._count("hits")
+            entry = cached[1]
+
+        document = copy.deepcopy(entry["document"])
+        number_field, _ = FRESH_FIELDS[document["document_type"]]
+        document[number_field] = new_document_number(document["document_type"])
+        for field in entry["restamp"]:
+            document[field] = DATE_STAMPS.get(field, get_today_date)()
+        return document
+
+    def put(self, command: str, document: Dict[str, Any]) -> bool:
+        """
+        Store a generated document
+
+        Returns:
+            False when the document cannot be cached (error or unknown type)
+        """
+        doc_type = document.get("document_type")
+        if "error" in document or doc_type not in FRESH_FIELDS:
+            with self._lock:
+                self._count("uncacheable")
+            return False
+
+        number_field, date_fields = FRESH_FIELDS[doc_type]
+        stored = copy.deepcopy(document)
+        stored.pop(number_field, None)
+        # Only dates that were the generation-day defaults are re-stamped; a
+        # date the user asked for is part of the command and kept as is
+        restamp = [
+            field for field in date_fields
+            if stored.get(field) == DATE_STAMPS.get(field, get_today_date)()
+        ]
+        for field in restamp:
+            stored.pop(field)
+
+        key = self.make_key(command)
+        with self._lock:
+            self._entries[key] = (time.time(), {"document": stored, "restamp": restamp})
+            self._entries.move_to_end(key)
+            self._count("stores")
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+                self._count("evictions")
+            INVOICE_CACHE_ENTRIES.set(len(self._entries))
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            INVOICE_CACHE_ENTRIES.set(0)
+
+    def _count(self, event: str):
+        """Bump a stat and its metric (caller holds the lock)"""
+        self._stats[event] += 1
+        INVOICE_CACHE.labels(event).inc()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and size"""
+        with self._lock:
+            stats = dict(self._stats)
+            lookups = stats["hits"] + stats["misses"]
+            stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+            stats["entries"] = len(self._entries)
+            stats["max_items"] = self.max_items
+            stats["ttl_seconds"] = self.ttl_seconds
+            return stats
+
+
+_cache: Optional[InvoiceResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> InvoiceResponseCache:
+    """Process-wide cache, sized from INVOICE_CACHE_* env vars"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = InvoiceResponseCache(
+                max_items=int(os.getenv("INVOICE_CACHE_MAX_ITEMS", 512)),
+                ttl_seconds=float(os.getenv("INVOICE_CACHE_TTL_SECONDS", 6 * 3600)),
+            )
+        return _cache
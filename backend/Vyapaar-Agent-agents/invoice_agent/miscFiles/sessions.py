@@ -0,0 +1,194 @@
+"""
+Session store for multi-turn invoice conversations
+
+A session holds the partial document of a command that still needs
+clarification, the fields it is missing and the questions asked, so a
+follow-up answer can be applied as a patch instead of regenerating the
+whole document. Sessions are dropped when the document completes, and
+expire INVOICE_SESSION_TTL_SECONDS after their last turn.
+
+Stores (INVOICE_SESSION_STORE):
+  - memory (default): per process, bounded by INVOICE_SESSION_MAX_ITEMS
+  - sqlite: INVOICE_SESSION_DB_PATH, shared by every worker on the host
+    and surviving restarts (the CLI uses it for --session)
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+@dataclass
+class InvoiceSession:
+    """State carried between the turns of one conversation"""
+    session_id: str
+    command: str
+    document: Dict[str, Any]
+    missing_fields: List[str]
+    questions: Dict[str, str] = field(default_factory=dict)
+    turns: List[str] = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+    def context(self) -> Dict[str, Any]:
+        """The conversation_context process_user_input continues from"""
+        return {
+            "command": self.command,
+            "partial_document": self.document,
+            "missing_fields": self.missing_fields,
+            "questions": self.questions,
+            "turns": self.turns,
+        }
+
+
+class MemorySessionStore:
+    """
+    In-process TTL + LRU session store
+    """
+    backend = "memory"
+
+    def __init__(self, ttl_seconds: float = 1800, max_items: int = 10_000):
+        self.ttl_seconds = ttl_seconds
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, InvoiceSession]" = OrderedDict()
+        self._stats = {"saved": 0, "loaded": 0, "expired": 0, "evicted": 0, "closed": 0}
+
+    def get(self, session_id: str) -> Optional[InvoiceSession]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if time.time() - session.updated_at > self.ttl_seconds:
+                del self._sessions[session_id]
+                self._stats["expired"] += 1
+                return None
+            self._stats["loaded"] += 1
+            return session
+
+    def save(self, session: InvoiceSession):
+        session.updated_at = time.time()
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self._sessions.move_to_end(session.session_id)
+            self._stats["saved"] += 1
+            while len(self._sessions) > self.max_items:
+                self._sessions.popitem(last=False)
+                self._stats["evicted"] += 1
+
+    def delete(self, session_id: str):
+        with self._lock:
+            if self._sessions.pop(session_id, None) is not None:
+                self._stats["closed"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "backend": self.backend, "active": len(self._sessions)}
+
+
+class SqliteSessionStore:
+    """
+    SQLite-backed session store
+    """
+    backend = "sqlite"
+
+    def __init__(self, db_path: Path, ttl_seconds: float = 1800):
+        self.db_path = Path(db_path)
+        self.ttl_seconds = ttl_seconds
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stats = {"saved": 0, "loaded": 0, "expired": 0, "evicted": 0, "closed": 0}
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS invoice_sessions (
+                session_id TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_invoice_sessions_updated ON invoice_sessions(updated_at)"
+        )
+        self._conn.commit()
+
+    def get(self, session_id: str) -> Optional[InvoiceSession]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload, updated_at FROM invoice_sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            if time.time() - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM invoice_sessions WHERE session_id = ?", (session_id,))
+                self._conn.commit()
+                self._stats["expired"] += 1
+                return None
+            self._stats["loaded"] += 1
+        return InvoiceSession(**json.loads(row[0]))
+
+    def save(self, session: InvoiceSession):
+        session.updated_at = time.time()
+        payload = json.dumps(asdict(session), ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO invoice_sessions (session_id, payload, updated_at) VALUES (?, ?, ?)",
+                (session.session_id, payload, session.updated_at),
+            )
+            # Expired sessions are swept on write rather than by a timer
+            cursor = self._conn.execute(
+                "DELETE FROM invoice_sessions WHERE updated_at < ?", (session.updated_at - self.ttl_seconds,)
+            )
+            self._conn.commit()
+            self._stats["saved"] += 1
+            self._stats["expired"] += cursor.rowcount
+
+    def delete(self, session_id: str):
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM invoice_sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+            self._stats["closed"] += cursor.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            active = self._conn.execute("SELECT COUNT(*) FROM invoice_sessions").fetchone()[0]
+            return {**self._stats, "backend": self.backend, "active": active, "path": str(self.db_path)}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """Process-wide session store, configured from INVOICE_SESSION_* env vars"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            ttl = float(os.getenv("INVOICE_SESSION_TTL_SECONDS", 1800))
+            kind = os.getenv("INVOICE_SESSION_STORE", "memory").strip().lower()
+            if kind == "sqlite":
+                path = os.getenv("INVOICE_SESSION_DB_PATH", "sessions/invoice_sessions.sqlite3")
+                _store = SqliteSessionStore(Path(path), ttl_seconds=ttl)
+                logger.info(f"Invoice sessions stored in {path}")
+            elif kind == "memory":
+                _store = MemorySessionStore(ttl, int(os.getenv("INVOICE_SESSION_MAX_ITEMS", 10_000)))
+            else:
+                raise ValueError(f"Unknown INVOICE_SESSION_STORE: {kind} (expected memory or sqlite)")
+        return _store
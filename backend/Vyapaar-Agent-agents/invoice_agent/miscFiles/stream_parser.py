@@ -0,0 +1,170 @@
+"""
+Incremental parser for document JSON arriving from a streamed model response
+
+The model writes one JSON object (sometimes inside a ```json fence). As
+chunks arrive, DocumentStreamParser reports each part as soon as it is
+complete, so a client can render a draft invoice before the response ends:
+
+    ("header", {"customer_name": "CJ Traders"})   top-level fields
+    ("item", {"index": 0, "item": {...}})          each object in "items"
+    ("totals", {"total": 22420})                   amount fields (TOTAL_FIELDS)
+
+Only complete values are reported (a half-written number or string never
+is), and each once. The parser does not validate the document; the full
+text is still parsed with json.loads when the stream ends.
+"""
+
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Top-level fields reported as "totals" rather than "header"
+TOTAL_FIELDS = {
+    "subtotal", "cgst_rate", "cgst_amount", "sgst_rate", "sgst_amount", "total", "total_estimate",
+    "tax_note", "amount_received", "previous_balance", "current_balance",
+}
+# Top-level fields that are not part of the document
+SKIPPED_FIELDS = {"clarification_questions"}
+
+Event = Tuple[str, Dict[str, Any]]
+
+
+class DocumentStreamParser:
+    """
+    Scans the response text once, character by character, across feed() calls
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._started = False
+        self._finished = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        # Top level: the current key, whether its value is being read, and where it starts
+        self._key: Optional[str] = None
+        self._key_start = 0
+        self._in_value = False
+        self._value_start: Optional[int] = None
+        self._item_start: Optional[int] = None
+        self._items = 0
+
+    def feed(self, chunk: str) -> List[Event]:
+        """
+        Add the next chunk of response text
+
+        Returns:
+            Events for the parts completed by this chunk, in document order
+        """
+        self.text += chunk
+        events: List[Event] = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            if self._finished:
+                break
+            char = text[i]
+            if not self._started:
+                if char == "{":
+                    self._started = True
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        if self._in_value:
+                            self._complete_value(i + 1, events)
+                        else:
+                            self._key = self._loads(text[self._key_start:i + 1])
+                continue
+
+            if char == '"':
+                self._in_string = True
+                if self._depth == 1:
+                    if self._in_value:
+                        self._value_start = i
+                    else:
+                        self._key_start = i
+            elif char == ":" and self._depth == 1:
+                self._in_value = True
+                self._value_start = None
+            elif char in "{[":
+                if self._depth == 1 and self._in_value:
+                    self._value_start = i
+                self._depth += 1
+                if char == "{" and self._depth == 3 and self._key == "items":
+                    self._item_start = i
+            elif char in "}]":
+                if self._depth == 1 and self._in_value and self._value_start is not None:
+                    # A scalar closing the object: {"total": 100}
+                    self._complete_value(i, events)
+                self._depth -= 1
+                if char == "}" and self._depth == 2 and self._key == "items" and self._item_start is not None:
+                    item = self._loads(text[self._item_start:i + 1])
+                    if isinstance(item, dict):
+                        events.append(("item", {"index": self._items, "item": item}))
+                        self._items += 1
+                    self._item_start = None
+                elif self._depth == 1 and self._in_value:
+                    self._complete_value(i + 1, events)
+                elif self._depth == 0:
+                    self._finished = True
+            elif char == "," and self._depth == 1:
+                if self._in_value and self._value_start is not None:
+                    self._complete_value(i, events)
+                self._in_value = False
+            elif self._depth == 1 and self._in_value and self._value_start is None and not char.isspace():
+                self._value_start = i
+        self._pos = len(text)
+        return events
+
+    def _complete_value(self, end: int, events: List[Event]):
+        """Report the top-level value text[_value_start:end] under the current key"""
+        start, self._value_start, self._in_value = self._value_start, None, False
+        key = self._key
+        if start is None or key is None or key in SKIPPED_FIELDS or key == "items":
+            return
+        value = self._loads(self.text[start:end].strip())
+        if value is not _INVALID:
+            events.append(("totals" if key in TOTAL_FIELDS else "header", {key: value}))
+
+    @staticmethod
+    def _loads(text: str) -> Any:
+        try:
+            return json.loads(text)
+        except ValueError:
+            return _INVALID
+
+    @property
+    def finished(self) -> bool:
+        """Whether the closing brace of the document has been seen"""
+        return self._finished
+
+
+_INVALID = object()
+
+
+def document_events(document: Dict[str, Any]) -> List[Event]:
+    """The events a stream of this (already complete) document would produce"""
+    events: List[Event] = []
+    for key, value in document.items():
+        if key in SKIPPED_FIELDS:
+            continue
+        if key == "items" and isinstance(value, list):
+            events.extend(("item", {"index": i, "item": item}) for i, item in enumerate(value))
+        else:
+            events.append(("totals" if key in TOTAL_FIELDS else "header", {key: value}))
+    return events
+
+
+def emit_document(document: Dict[str, Any], on_event: Optional[Callable[[str, Dict[str, Any]], None]]):
+    """Send a complete document to on_event as header/item/totals events"""
+    if on_event is None:
+        return
+    for event, data in document_events(document):
+        on_event(event, data)
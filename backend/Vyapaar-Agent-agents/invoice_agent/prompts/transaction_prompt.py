@@ -1,8 +1,17 @@
-from datetime import datetime
+from datetime import date
+from functools import lru_cache
+
+# Bump whenever the transaction prompt changes so cached documents miss
+TRANSACTION_PROMPT_VERSION = "2"
 
 
 def get_transaction_system_prompt():
-    today_date = datetime.now().strftime("%Y-%m-%d")
+    """Today's system prompt, compiled once per day per TRANSACTION_PROMPT_VERSION"""
+    return _compile_transaction_prompt(date.today().isoformat(), TRANSACTION_PROMPT_VERSION)
+
+
+@lru_cache(maxsize=2)
+def _compile_transaction_prompt(today_date: str, version: str):
     return f"""
 You are a specialized agent for Indian small businesses.
 Convert Hinglish / Hindi / English commands into structured JSON for transaction documents.
@@ -19,7 +28,7 @@ GENERAL RULES:
 - No explanations
 - Use today's date if missing: {today_date}
 - Auto-generate document numbers
-- Infer reasonable defaults if missing
+- Infer reasonable defaults if missing, except for the required fields below
 
 GST RULES:
 - Cement → HSN 2523
@@ -36,21 +45,60 @@ QUOTATION RULES:
 RECEIPT RULES:
 - current_balance = previous_balance - amount_received
 
+MISSING INFORMATION:
+- Never invent these; leave them empty (or 0) when the user did not say them:
+  customer_name; items (with quantity, rate and, for GST invoices, an hsn_code
+  from the rules above); total (bill of supply); amount_received and
+  payment_mode (receipt); previous_balance (udhaar receipt)
+- For each one left empty, add a short friendly Hinglish question to
+  "clarification_questions", keyed by field name: customer_name, items,
+  items[0].rate, items[0].quantity, items[0].hsn_code, items[0].rate_or_amount,
+  total, amount_received, payment_mode, previous_balance
+  e.g. {{"customer_name": "Bill kiske naam pe banana hai?", "items[0].rate": "Cement kis rate pe diya?"}}
+- Leave out "clarification_questions" when nothing is missing
+
 OUTPUT MUST MATCH ONE OF THE KNOWN SCHEMAS.
 """
 
 
-def get_clarification_prompt(missing_fields: list, original_input: str):
-    """Generate clarification questions for missing fields"""
-    return f"""
-The user said: "{original_input}"
+# Local questions for missing fields the model did not ask about; item
+# fields (items[i].rate etc.) are keyed by the part after the dot
+CLARIFICATION_TEMPLATES = {
+    "document_type": "Kaunsa bill banana hai - GST invoice, kachha bill, estimate ya payment receipt?",
+    "customer_name": "Bill kiske naam pe banana hai?",
+    "items": "Kya saman diya, kitna aur kis rate pe?",
+    "total": "Bill kitne ka hai?",
+    "amount_received": "Kitna payment mila?",
+    "payment_mode": "Payment kaise mila - cash, UPI ya cheque?",
+    "previous_balance": "Pichla udhaar kitna baaki tha?",
+    "rate": "{item} kis rate pe diya?",
+    "quantity": "{item} kitna diya?",
+    "hsn_code": "{item} ka HSN code kya hai?",
+    "rate_or_amount": "{item} ka rate ya amount kya hai?",
+}
+
+
+def get_patch_prompt(document_type: str, missing_fields: list, questions: dict, items: list, answer: str) -> str:
+    """
+    Tiny prompt turning a follow-up answer into a patch for the missing fields
+
+    Only the missing fields, the questions asked and the item names are sent,
+    not the document or the full system prompt.
+    """
+    asked = "\n".join(
+        f"- {field}: {questions[field]}" if questions.get(field) else f"- {field}" for field in missing_fields
+    )
+    names = ", ".join(f"items[{i}] = {item.get('description') or '?'}" for i, item in enumerate(items)) or "none"
+    return f"""Fill missing fields of an Indian {document_type.replace('_', ' ')} from the user's Hinglish answer.
+
+Missing fields and the questions asked:
+{asked}
 
-We need these missing fields to complete the document:
-{', '.join(missing_fields)}
+Items: {names}
 
-Generate 1-3 natural, conversational questions in Hinglish to ask the user for this information.
-Make the questions simple and friendly.
+Answer: {answer}
 
-Output ONLY a JSON array of questions, like:
-["Rahul ka GSTIN number kya hai?", "Kitne rate pe becha?"]
-"""
\ No newline at end of file
+Return ONLY a JSON object with the fields the answer gives, keyed exactly as above.
+Numbers as numbers; hsn_code as a string; "items" as a list of
+{{"description", "hsn_code", "quantity", "unit", "rate"}} objects.
+Leave out fields the answer does not give. Return {{}} if it gives none."""